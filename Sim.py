@@ -1,13 +1,43 @@
 """Simulates the character's damage output."""
 
 import random
-from copy import deepcopy
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING,
+)
+from aoe import BATCH_TARGETS, draw_binomial, resolve_hits
+from apl import spell_key
 from base import Character, Spell
+from characters.Rime import SPELLBOOK
+from events import EventRecorder, EventType
+from snapshot import SimulationState
+
+if TYPE_CHECKING:
+    from apl import APL, APLState
+    from fight import FightProfile
+    from timeline import Timeline
+
+PROCS = (
+    "Anima Spikes",
+    "Dance of Swallows",
+    "Soulfrost Torrent",
+    "Spirit",
+    "Winter Orb",
+)
 
 
 class Simulation:
     """Simulates the character's damage output."""
 
+    # Whether runs can record their combat events to a `recorder`.
+    records_events = True
+
     def __init__(
         self,
         character: Character,
@@ -15,85 +45,216 @@ class Simulation:
         enemy_count: int = 1,
         do_debug: bool = True,
         is_deterministic: bool = False,
+        timeline: Optional["Timeline"] = None,
+        apl: Optional["APL"] = None,
+        rng: Optional[random.Random] = None,
+        opener: Sequence[str] = (),
+        recorder: Optional[EventRecorder] = None,
+        fight: Optional["FightProfile"] = None,
     ):
+        # Keep the instance attributes few: CPython 3.11 stops sharing the
+        # keys of instance dicts at 30 attributes (with the specialized
+        # ones), which slows every attribute access down by about 7%.
         self.character = character
         self.time = 0
         self.duration = duration
         self.total_damage = 0
-        self.do_debug = do_debug
+        # Receives the combat events, debug runs print them as they happen.
+        self.recorder = (
+            recorder
+            if recorder is not None
+            else EventRecorder(echo=True) if do_debug else None
+        )
         self.gcd = 0
         self.debuffs = []
         self.buffs = []
         self.enemy_count = enemy_count
+        # Target count over time, replaces `enemy_count` if set, and the
+        # start of its next phase, see `_set_phase`.
+        self.fight = fight
+        self._next_phase = float("inf")
+        if fight is not None:
+            self.enemy_count = fight.targets[0]
         self.is_deterministic = is_deterministic
+        # Random number generator of the simulation, never the global one,
+        # so simulations can run in parallel threads.
+        self.rng = rng if rng is not None else random.Random()
+        # Modifiers of the spellbook and the talents, see `base.spellbook`.
+        self.modifiers = SPELLBOOK.resolve(character.talents)
 
         self.damage_table = {}
+        self.timeline = timeline
+        # Priority list replacing the rotation order, bound in `run`.
+        self.apl = apl
+        self.apl_state: Optional["APLState"] = None
+        # Spells cast in order before the rotation, bound in `start`.
+        self.opener = opener
+        self._opener: List[Spell] = []
+        self._opener_index = 0
+        # Pending proc steps, see `_drain`.
+        self._procs: List[Tuple[Callable, tuple]] = []
+        # How often each proc happened.
+        self.proc_counts: Dict[str, int] = dict.fromkeys(PROCS, 0)
+        # Values derived from the character stats, see `_check_stats`.
+        self._stat_version = -1
+        self._damage_cache: Dict[Spell, float] = {}
+        self._cast_time_cache: Dict[Spell, float] = {}
+        self._gcd = 0.0
 
         if is_deterministic:
             self.character.crit = 0
             self.character.spirit = 0
 
+    def _check_stats(self) -> None:
+        """Clears the stat caches if the character stats changed."""
+
+        if self._stat_version != self.character.stat_version:
+            self._stat_version = self.character.stat_version
+            self._damage_cache.clear()
+            self._cast_time_cache.clear()
+            self._gcd = 1.5 / (1 + self.character.haste / 100)
+
+    def spell_damage(self, spell: Spell) -> float:
+        """Returns the (cached) damage of the spell."""
+
+        self._check_stats()
+        damage = self._damage_cache.get(spell)
+        if damage is None:
+            damage = spell.damage(self.character)
+            self._damage_cache[spell] = damage
+        return damage
+
+    def cast_time(self, spell: Spell) -> float:
+        """Returns the (cached) effective cast time of the spell."""
+
+        self._check_stats()
+        cast_time = self._cast_time_cache.get(spell)
+        if cast_time is None:
+            cast_time = spell.effective_cast_time(self.character)
+            self._cast_time_cache[spell] = cast_time
+        return cast_time
+
+    def gcd_duration(self) -> float:
+        """Returns the (cached) hasted global cooldown."""
+
+        self._check_stats()
+        return self._gcd
+
     def _fill_damage_table(self, key: str, damage: float) -> None:
         """Fill the damage table with the given key and damage."""
 
         self.damage_table[key] = self.damage_table.get(key, 0) + damage
+        if self.timeline is not None:
+            self.timeline.add_damage(self.time, key, damage)
+
+    def _record(
+        self, event_type: EventType, spell: str = "", damage: float = 0.0
+    ) -> None:
+        """Records a combat event with the current time and resources."""
+
+        self.recorder.record(
+            event_type,
+            self.time,
+            spell,
+            damage,
+            self.character.winter_orbs,
+            self.character.mana,
+        )
+
+    def _push(self, step: Callable, *args) -> None:
+        """Schedules a proc step, the last scheduled step runs first."""
+
+        self._procs.append((step, args))
+
+    def _drain(self) -> None:
+        """Runs scheduled proc steps until none are left.
+
+        Steps schedule their follow-ups instead of calling them, so proc
+        chains of any length run iteratively, in the same depth-first order
+        as nested calls would.
+        """
+
+        procs = self._procs
+        while procs:
+            step, args = procs.pop()
+            step(*args)
+
+    def _anima_spikes(self, hits: int) -> None:
+        """Deals the damage of `hits` Anima Spikes in one batch."""
+
+        # Downtime, e.g. orbs of Wrath of Winter ticks, hits nothing.
+        if not self.enemy_count:
+            return
+        anima_spikes = self.character.spells["anima spikes"]
+        damage = self.spell_damage(anima_spikes)
+        self.total_damage += damage * hits
+        self._fill_damage_table(anima_spikes.name, damage * hits)
+        self.proc_counts["Anima Spikes"] += hits
+
+        if self.recorder is not None:
+            for _ in range(hits):
+                self._record(EventType.SPIKE, anima_spikes.name, damage)
 
     # Whenever we gain orbs, we want to cast 3 Anime Spikes.
     def gain_orb(self, do_spikes=True) -> None:
         """Ensures orb is gained during cast"""
 
+        self._gain_orb(do_spikes)
+        self._drain()
+
+    def _gain_orb(self, do_spikes=True) -> None:
+        """Gains an orb and schedules the rest of the proc chain."""
+
         self.character.winter_orbs += 1
-        if self.do_debug:
-            print(
-                f"Time {self.time:.2f}: Gained Orbs - "
-                + f"Count: {self.character.winter_orbs}"
-            )
-        self.update_time(0.01)
+        self.proc_counts["Winter Orb"] += 1
+        if self.recorder is not None:
+            self._record(EventType.ORB_GAINED)
+        self._push(self._finish_gain_orb, do_spikes)
+        self._push(self._update_time, 0.01)
 
-        if do_spikes:
-            for _ in range(self.character.spells["anima spikes"].hits):
-                damage = self.character.spells["anima spikes"].damage(
-                    self.character
-                )
-                self.total_damage += damage
-                self._fill_damage_table(
-                    self.character.spells["anima spikes"].name, damage
-                )
+    def _finish_gain_orb(self, do_spikes: bool) -> None:
+        """Casts Anima Spikes once the orb gain advanced the time."""
 
-                if self.do_debug:
-                    print(
-                        f"Time {self.time:.2f}: "
-                        + f"Cast {self.character.spells['anima spikes'].name},"
-                        + f" dealing {damage:.2f} damage"
-                    )
+        if do_spikes:
+            self._anima_spikes(self.character.spells["anima spikes"].hits)
 
-        # If we are capped on Orbs, cap on 5.
-        if self.character.winter_orbs > 5:
-            if self.do_debug:
-                print("Over capped on Orbs")
-            self.character.winter_orbs = 5
+        # If we are capped on Orbs, cap on max_orbs.
+        max_orbs = self.modifiers.max_orbs
+        if self.character.winter_orbs > max_orbs:
+            if self.recorder is not None:
+                self._record(EventType.ORB_CAPPED)
+            self.character.winter_orbs = max_orbs
 
     def lose_orb(self, orb_cost):
         """Ensures orb is lost during cast"""
 
+        self._lose_orb(orb_cost)
+        self._drain()
+
+    def _lose_orb(self, orb_cost: int) -> None:
+        """Spends orbs and schedules the Spirit refunds."""
+
+        reductions = self.modifiers.orb_cooldown_reductions
         for _ in range(orb_cost):
             self.character.winter_orbs -= 1
-            if "Wisdom of the North" in self.character.talents:
+            if reductions:
                 for spell in self.character.rotation:
-                    if spell.name in (
-                        "Ice Blitz",
-                        "Dance of Swallows",
-                        "Winters Blessing",
-                    ):
-                        spell.update_cooldown(1)  # Reduces the cooldown by 1.
-        if orb_cost > 0 and self.do_debug:
-            print(
-                f"Time {self.time:.2f}: Used Orbs - "
-                + f"Count: {self.character.winter_orbs}"
-            )
-        if orb_cost > 0 and random.uniform(0, 100) < self.character.spirit:
-            for _ in range(orb_cost):
-                self.gain_orb()
+                    if spell.name in reductions:
+                        spell.update_cooldown(reductions[spell.name])
+        if orb_cost > 0 and self.recorder is not None:
+            self._record(EventType.ORB_SPENT)
+        refunds = self.spirit_refunds(orb_cost) if orb_cost > 0 else 0
+        if refunds:
+            self.proc_counts["Spirit"] += refunds
+            for _ in range(refunds):
+                self._push(self._gain_orb)
+
+    def spirit_refunds(self, orb_cost: int) -> int:
+        """Rolls Spirit, which refunds every spent orb."""
+
+        return (
+            orb_cost if self.rng.uniform(0, 100) < self.character.spirit else 0
+        )
 
     # Handle all Damage.
     def do_damage(
@@ -106,268 +267,481 @@ class Simulation:
     ) -> None:
         """Does damage to the enemy (dummy)"""
 
+        self._do_damage(spell, damage, anima_gained, orb_cost, is_cast)
+        self._drain()
+
+    def _do_damage(
+        self,
+        spell: Spell,
+        damage: float,
+        anima_gained: float,
+        orb_cost: int,
+        is_cast: bool = True,
+    ) -> None:
+        """Deals the damage and schedules the procs it triggers."""
+
         damage = self.apply_damage_multipliers(spell, damage)
         self.apply_glacial_assault(spell)
         self.update_spell_cooldowns(spell)
         aoe_count = self.determine_aoe_count(spell)
 
-        for i in range(aoe_count):
-            damage = self.apply_critical_hit(spell, damage)
-            damage = self.apply_aoe_damage_reduction(spell, damage, i)
-            self.total_damage += damage
-            self._fill_damage_table(spell.name, damage)
+        if aoe_count > BATCH_TARGETS:
+            dealt = self.apply_aoe_hits(spell, damage, aoe_count)
+        else:
+            dealt = 0.0
+            for i in range(aoe_count):
+                damage = self.apply_critical_hit(spell, damage)
+                damage = self.apply_aoe_damage_reduction(spell, damage, i)
+                self.total_damage += damage
+                self._fill_damage_table(spell.name, damage)
+                dealt += damage
 
+        # Recorded with the damage on every target, once every proc of the
+        # hit resolved.
+        if self.recorder is not None:
+            self._push(self.handle_debug_output, spell, dealt, is_cast)
         self.manage_mana_and_orbs(spell, anima_gained, orb_cost)
-        self.handle_debug_output(spell, damage, is_cast)
 
     def apply_damage_multipliers(self, spell: Spell, damage: float) -> float:
         """Apply damage multipliers based on active buffs and talents."""
 
-        damage_multipliers = {
-            "Wrath of Winter": 1.15,
-            "Ice Blitz": (
-                1.25
-                if "Wisdom of the North" in self.character.talents
-                else 1.15
-            ),
-            "Soulfrost Torrent": (
-                1.2 if "Chillblain" in self.character.talents else 1.0
-            ),
-            "Freezing Torrent": (
-                1.2 if "Chillblain" in self.character.talents else 1.0
-            ),
-            "Bursting Ice": (
-                1.2 if "Coalescing Ice" in self.character.talents else 1.0
-            ),
-        }
+        damage_multipliers = self.modifiers.buff_damage
 
         for buff in self.buffs:
             if buff.name in damage_multipliers:
                 damage *= damage_multipliers[buff.name]
 
-        if "Avalanche" in self.character.talents and spell.name == "Ice Comet":
-            # Multiply by:
-            # - 3x if the crit hits 8% of the time
-            # - 2x if it hits 30% of the time
-            # - 1x otherwise.
-            damage *= (
-                3
-                if random.uniform(0, 100) < 8
-                else 2 if random.uniform(0, 100) < 30 else 1
-            )
+        rolls = self.modifiers.damage_rolls.get(spell.name)
+        if rolls:
+            damage *= self.roll_multiplier(rolls)
         return damage
 
+    def roll_multiplier(self, rolls: Sequence[Tuple[float, float]]) -> float:
+        """Rolls the damage multipliers in order (e.g. Avalanche: 3x 8% of
+        the time, else 2x 30% of the time), 1x if none hits."""
+
+        for chance, multiplier in rolls:
+            if self.rng.uniform(0, 100) < chance:
+                return multiplier
+        return 1
+
     def apply_glacial_assault(self, spell: Spell) -> None:
         """Apply Glacial Assault buff if conditions are met."""
 
-        if (
-            spell.name == "Cold Snap"
-            and "Glacial Assault" in self.character.talents
-        ):
+        if spell.name == "Cold Snap" and self.modifiers.glacial_assault_stacks:
             self.character.glacial_assault_buff.apply_debuff()
             self.buffs.append(self.character.glacial_assault_buff)
 
     def update_spell_cooldowns(self, spell: Spell) -> None:
         """Update cooldowns for specific spells."""
 
-        cooldown_updates = {
-            "Unrelenting Ice": ("Bursting Ice", 0.5),
-            "Icy Flow": ("Freezing Torrent", 0.2),
-        }
-
-        for talent, (spell_name, cooldown) in cooldown_updates.items():
-            if talent in self.character.talents and spell.name in (
-                "Soulfrost Torrent",
-                "Freezing Torrent",
-                "Anima Spikes",
-                "Dance of Swallows",
-            ):
-                for character_spell in self.character.rotation:
-                    if character_spell.name == spell_name:
-                        character_spell.update_cooldown(cooldown)
+        if spell.name not in self.modifiers.cooldown_triggers:
+            return
+        for spell_name, cooldown in (
+            self.modifiers.hit_cooldown_reductions.items()
+        ):
+            for character_spell in self.character.rotation:
+                if character_spell.name == spell_name:
+                    character_spell.update_cooldown(cooldown)
 
     def determine_aoe_count(self, spell: Spell) -> int:
         """Determine the number of targets affected by AoE spells."""
 
-        return {
-            "Ice Comet": self.enemy_count,
-            "Bursting Ice": self.enemy_count,
-            "Soulfrost Torrent": (
-                min(self.enemy_count, 5)
-                if "Chillblain" in self.character.talents
-                else 1
-            ),
-            "Freezing Torrent": (
-                min(self.enemy_count, 5)
-                if "Chillblain" in self.character.talents
-                else 1
-            ),
-        }.get(spell.name, 1)
+        return self.modifiers.aoe_count(spell.name, self.enemy_count)
 
-    def apply_critical_hit(self, spell: Spell, damage: float) -> float:
-        """Calculate and apply critical hit damage."""
+    def crit_chance(self, spell: Spell) -> float:
+        """Returns the crit chance of the spell in percent."""
 
         crit_chance = self.character.crit
-        if "Soulfrost Torrent" in self.character.talents and spell.name in (
-            "Anima Spikes",
-            "Dance of Swallows",
-        ):
-            crit_chance += 10 if not self.is_deterministic else 0
-        if (
-            spell.name == "Glacial Blast"
-            and "Glacial Assault" in self.character.talents
-        ):
-            crit_chance += 20 if not self.is_deterministic else 0
+        bonus = self.modifiers.crit_bonus.get(spell.name)
+        if bonus is not None:
+            crit_chance += bonus if not self.is_deterministic else 0
+        return crit_chance
+
+    def apply_critical_hit(self, spell: Spell, damage: float) -> float:
+        """Calculate and apply critical hit damage."""
 
-        if random.uniform(0, 100) < crit_chance:
+        if self.rng.uniform(0, 100) < self.crit_chance(spell):
             damage *= 2
-            if (
-                "Soulfrost Torrent" in self.character.talents
-                and random.uniform(0, 100) < 25
-            ):
-                if not any(
-                    buff.name == "Soulfrost Torrent" for buff in self.buffs
-                ):
-                    self.character.soulfrost_buff.apply_debuff()
-                    self.buffs.append(self.character.soulfrost_buff)
+            chance = self.modifiers.soulfrost_chance
+            if chance and self.rng.uniform(0, 100) < chance:
+                self.proc_soulfrost()
         return damage
 
+    def proc_soulfrost(self) -> None:
+        """Applies the Soulfrost buff unless it is active."""
+
+        if not self._count_buffs("Soulfrost Torrent"):
+            self.proc_counts["Soulfrost Torrent"] += 1
+            self.character.soulfrost_buff.apply_debuff()
+            self.buffs.append(self.character.soulfrost_buff)
+
+    def aoe_damage_reduction(self, spell: Spell) -> float:
+        """Returns the multiplier of the damage carried to every secondary
+        target."""
+
+        return self.modifiers.secondary_target_damage.get(spell.name, 1.0)
+
     def apply_aoe_damage_reduction(
         self, spell: Spell, damage: float, index: int
     ) -> float:
         """Apply AoE damage reduction if applicable."""
 
-        if (
-            spell.name in ("Soulfrost Torrent", "Freezing Torrent")
-            and "Chillblain" in self.character.talents
-            and index != 0
-        ):
-            damage *= 0.2
+        if index != 0:
+            damage *= self.aoe_damage_reduction(spell)
         return damage
 
+    def apply_aoe_hits(
+        self, spell: Spell, damage: float, aoe_count: int
+    ) -> float:
+        """Deals the hits on more than BATCH_TARGETS targets at once, see
+        `aoe`.
+
+        Returns the damage on every target.
+        """
+
+        total, _, crits = resolve_hits(
+            self.rng,
+            aoe_count,
+            self.crit_chance(spell),
+            self.aoe_damage_reduction(spell),
+        )
+        chance = self.modifiers.soulfrost_chance
+        if chance:
+            for _ in range(draw_binomial(self.rng, crits, chance / 100)):
+                self.proc_soulfrost()
+        self.total_damage += damage * total
+        self._fill_damage_table(spell.name, damage * total)
+        return damage * total
+
     def manage_mana_and_orbs(
         self, spell: Spell, anima_gained: float, orb_cost: int
     ) -> None:
-        """Manage mana and orb resources."""
+        """Manage mana and orb resources.
 
-        if (
-            spell.name == "Bursting Ice"
-            and "Coalescing Ice" in self.character.talents
-            and self.enemy_count == 1
-        ):
-            self.character.mana += 2
-        self.character.mana += anima_gained
+        Orb changes and Dance of Swallows are scheduled as proc steps.
+        """
 
-        anima_spikes = self.character.spells["anima spikes"]
+        single_target_mana = self.modifiers.single_target_mana.get(spell.name)
+        if single_target_mana and self.enemy_count == 1:
+            self.character.mana += single_target_mana
+        self.character.mana += anima_gained
 
+        spike_buffs = self.modifiers.spike_buffs
         for buff in self.buffs:
-            if buff.name == "Ice Blitz":
-                for _ in range(int(anima_gained)):
-                    damage = anima_spikes.damage(self.character)
-                    self.total_damage += damage
-                    self._fill_damage_table(anima_spikes.name, damage)
-
-                    if self.do_debug:
-                        print(
-                            f"Time {self.time:.2f}: "
-                            + f"Cast {anima_spikes.name}, "
-                            + f"dealing {damage:.2f} damage"
-                        )
+            if buff.name in spike_buffs and int(anima_gained) > 0:
+                self._anima_spikes(int(anima_gained))
+
+        # Scheduled in reverse, they run after the orb change resolved.
+        swallow_hits = self.modifiers.swallow_hits.get(spell.name)
+        if swallow_hits:
+            self._push(self._dance_of_swallows, self.debuffs, swallow_hits, 0)
+        self._push(self._check_mana)
 
         if orb_cost < 0:
-            self.gain_orb()
+            self._gain_orb()
         else:
-            self.lose_orb(orb_cost)
+            self._lose_orb(orb_cost)
 
-        if self.character.mana >= 10:
-            self.character.mana = 0
-            self.gain_orb()
+    def _check_mana(self) -> None:
+        """Converts mana_per_orb mana into an orb."""
 
-        if spell.name == "Cold Snap":
-            for _ in range(10):
-                self.do_dance_of_swallows()
-        elif spell.name == "Freezing Torrent":
-            self.do_dance_of_swallows()
+        if self.character.mana >= self.modifiers.mana_per_orb:
+            self.character.mana = 0
+            self._gain_orb()
 
     def handle_debug_output(
         self, spell: Spell, damage: float, is_cast: bool
     ) -> None:
-        """Output debug information if debugging is enabled."""
-        if self.do_debug:
-            action = "hit" if is_cast else "ticks"
-            print(
-                f"Time {self.time:.2f}: Your {spell.name} {action} for "
-                + f"{damage:.2f} damage"
+        """Records the hit of the spell once its procs resolved."""
+
+        if self.recorder is not None:
+            self._record(
+                EventType.HIT if is_cast else EventType.TICK,
+                spell.name,
+                damage,
             )
 
     def do_dance_of_swallows(self) -> None:
         """Handles the Dance of Swallows."""
 
-        for debuff in self.debuffs:
-            if debuff.name == "Dance of Swallows":
-                self.do_damage(debuff, debuff.damage(self.character), 0, 0)
+        self._push(self._dance_of_swallows, self.debuffs, 1, 0)
+        self._drain()
+
+    def _dance_of_swallows(
+        self, debuffs: List[Spell], repeats: int, index: int
+    ) -> None:
+        """Hits with the Dance of Swallows debuff at `index`, `repeats` times
+        over the whole debuff list."""
+
+        if index >= len(debuffs):
+            if repeats > 1:
+                self._push(self._dance_of_swallows, debuffs, repeats - 1, 0)
+            return
+
+        debuff = debuffs[index]
+        self._push(self._dance_of_swallows, debuffs, repeats, index + 1)
+        if debuff.name == "Dance of Swallows":
+            self.proc_counts["Dance of Swallows"] += 1
+            self._do_damage(debuff, self.spell_damage(debuff), 0, 0)
 
     def update_time(self, delta_time: int) -> None:
         """Updates the time and cooldowns."""
 
+        self._update_time(delta_time)
+        self._drain()
+
+    def _update_time(self, delta_time: float) -> None:
+        """Advances the time, then updates the debuffs and buffs."""
+
         self.time += delta_time
         self.gcd -= delta_time
+        if self.time >= self._next_phase:
+            self._set_phase(self.fight.phase_at(self.time))
 
         # Update spell cooldowns
         for spell in self.character.rotation:
             spell.update_cooldown(delta_time)
 
-        # Process debuffs
-        for (
-            debuff
-        ) in self.debuffs:  # Iterate over a copy to avoid modification issues
-            debuff.update_remaining_debuff_duration(delta_time)
-            # Handle multiple ticks within the delta_time interval
-            if debuff.ticks > 0:
-                while (
-                    self.time >= debuff.next_tick_time
-                    and debuff.remaining_debuff_duration > 0
-                ):
-                    self.do_damage(
-                        debuff,
-                        debuff.damage(self.character) / debuff.ticks,
-                        debuff.mana_generation / debuff.ticks,
-                        debuff.winter_orb_cost,
-                        False,
-                    )
-                    debuff.next_tick_time += (
-                        debuff.debuff_duration / debuff.ticks
-                    )  # Schedule next tick
+        self._process_debuffs(iter(self.debuffs), delta_time)
 
-            # Remove expired debuff
-            if debuff.remaining_debuff_duration <= 0:
-                if debuff in self.debuffs:
-                    if self.do_debug:
-                        print(f"Removing {debuff.name}")
-                    self.debuffs.remove(debuff)
+    def _set_phase(self, phase: int) -> None:
+        """Enters the phase of the fight profile, with its target count."""
+
+        self._next_phase = self.fight.next_start(phase)
+        targets = self.fight.targets[phase]
+        if targets != self.enemy_count:
+            self.enemy_count = targets
+            if self.recorder is not None:
+                self._record(EventType.PHASE, damage=targets)
+            self.targets_changed()
+
+    def targets_changed(self) -> None:
+        """Updates the state that depends on the target count."""
+
+        if self.apl_state is not None:
+            self.apl_state.update_targets(self.enemy_count)
+
+    def _process_debuffs(
+        self,
+        debuffs: Iterator[Spell],
+        delta_time: float,
+        resumed: Optional[Spell] = None,
+    ) -> None:
+        """Updates the remaining debuffs, then the buffs.
+
+        Stops at every due tick and schedules itself to continue with the
+        same iterator once the tick resolved. `resumed` is the debuff whose
+        tick just resolved.
+        """
+
+        if resumed is not None and self._resolve_debuff(
+            debuffs, delta_time, resumed
+        ):
+            return
+
+        for debuff in debuffs:
+            debuff.update_remaining_debuff_duration(delta_time)
+            if self._resolve_debuff(debuffs, delta_time, debuff):
+                return
 
         # Process buffs similarly
-        for buff in self.buffs:
+        self._process_buffs(iter(self.buffs), delta_time)
+
+    def _resolve_debuff(
+        self, debuffs: Iterator[Spell], delta_time: float, debuff: Spell
+    ) -> bool:
+        """Handles the next due tick or the expiry of the debuff.
+
+        Returns True if a tick was scheduled, which resumes the update.
+        """
+
+        # Handle multiple ticks within the delta_time interval
+        if (
+            debuff.ticks > 0
+            and self.time >= debuff.next_tick_time
+            and debuff.remaining_debuff_duration > 0
+        ):
+            self._push(self._debuff_ticked, debuffs, delta_time, debuff)
+            self._do_damage(
+                debuff,
+                self.spell_damage(debuff) / debuff.ticks,
+                debuff.mana_generation / debuff.ticks,
+                debuff.winter_orb_cost,
+                False,
+            )
+            return True
+
+        # Remove expired debuff
+        if debuff.remaining_debuff_duration <= 0:
+            if debuff in self.debuffs:
+                if self.recorder is not None:
+                    self._record(EventType.EXPIRED, debuff.name)
+                self.debuffs.remove(debuff)
+        return False
+
+    def _debuff_ticked(
+        self, debuffs: Iterator[Spell], delta_time: float, debuff: Spell
+    ) -> None:
+        """Schedules the next tick of the debuff and resumes the update."""
+
+        debuff.next_tick_time += (
+            debuff.debuff_duration / debuff.ticks
+        )  # Schedule next tick
+        self._process_debuffs(debuffs, delta_time, debuff)
+
+    def _process_buffs(
+        self,
+        buffs: Iterator[Spell],
+        delta_time: float,
+        resumed: Optional[Spell] = None,
+    ) -> None:
+        """Updates the remaining buffs, see `_process_debuffs`."""
+
+        if resumed is not None and self._resolve_buff(
+            buffs, delta_time, resumed
+        ):
+            return
+
+        for buff in buffs:
             buff.update_remaining_debuff_duration(delta_time)
+            if (
+                buff.ticks > 0 or buff.remaining_debuff_duration <= 0
+            ) and self._resolve_buff(buffs, delta_time, buff):
+                return
 
-            if buff.ticks > 0:
-                while self.time >= buff.next_tick_time:
-                    if buff.name == "Wrath of Winter":
-                        self.gain_orb()
-                buff.next_tick_time += (
-                    buff.debuff_duration / buff.ticks
-                )  # Schedule next tick
+    def _resolve_buff(
+        self, buffs: Iterator[Spell], delta_time: float, buff: Spell
+    ) -> bool:
+        """Handles the ticks and the expiry of the buff.
 
-            if buff.remaining_debuff_duration <= 0:
-                self.buffs.remove(buff)
+        Returns True if a tick was scheduled, which resumes the update.
+        """
 
-                # Hacky Buff Handling
-                if buff.name == "Wrath of Winter":
-                    self.character.haste -= 30
+        if buff.ticks > 0:
+            if (
+                self.time >= buff.next_tick_time
+                and buff.name in self.modifiers.orb_tick_buffs
+            ):
+                self._push(self._process_buffs, buffs, delta_time, buff)
+                self._gain_orb()
+                return True
+            buff.next_tick_time += (
+                buff.debuff_duration / buff.ticks
+            )  # Schedule next tick
+
+        if buff.remaining_debuff_duration <= 0:
+            self.buffs.remove(buff)
+
+            # Hacky Buff Handling
+            haste = self.modifiers.buff_haste.get(buff.name)
+            if haste:
+                self.character.haste -= haste
+        return False
+
+    def _next_spell(self) -> Optional[Spell]:
+        """Returns the first ready spell of the rotation.
+
+        Returns None after advancing the time if no spell is ready, or if
+        a higher priority spell comes off cooldown before it would finish.
+        """
+
+        # Locate a spell that we can cast.
+        for spell in self.character.rotation:
+            if spell.is_ready(self.character, self.enemy_count):
+                break
+        else:
+            if self.recorder is not None:
+                self._record(EventType.IDLE)
+            self.update_time(0.1)
+            return None
 
-    # Generic Run
-    def run(self) -> float:
-        """Runs the simulation."""
+        cast_time = self.cast_time(spell)
+        gcd = self.gcd_duration()
+
+        # Check for spells
+        for test_spell in self.character.rotation:
+            if spell.name == test_spell.name:
+                break
+
+            if (
+                cast_time == 0
+                and test_spell.remaining_cooldown > 0
+                and test_spell.remaining_cooldown < gcd
+            ):
+                if self.recorder is not None:
+                    self._record(EventType.WAIT_GCD, test_spell.name)
+                self.update_time(test_spell.remaining_cooldown)
+                return None
+
+            if (
+                test_spell.remaining_cooldown < cast_time
+                and test_spell.remaining_cooldown > 0
+            ):
+                if self.recorder is not None:
+                    self._record(EventType.WAIT, test_spell.name)
+                self.update_time(test_spell.remaining_cooldown)
+                return None
+
+        return spell
+
+    def _next_apl_spell(self) -> Optional[Spell]:
+        """Returns the spell chosen by the APL, see `_next_spell`."""
+
+        spell = self.apl_state.select()
+        if spell is None:
+            if self.recorder is not None:
+                self._record(EventType.IDLE_APL)
+            self.update_time(0.1)
+            return None
+
+        if self.apl.wait_from is not None:
+            cast_time = self.cast_time(spell)
+            blocking = self.apl_state.blocking(cast_time, self.gcd_duration())
+            if blocking is not None:
+                if self.recorder is not None:
+                    self._record(
+                        (
+                            EventType.WAIT_GCD
+                            if cast_time == 0
+                            else EventType.WAIT
+                        ),
+                        blocking.name,
+                    )
+                self.update_time(blocking.remaining_cooldown)
+                return None
+        return spell
+
+    def _next_opener_spell(self) -> Optional[Spell]:
+        """Returns the next opener spell once it is ready, see
+        `_next_spell`."""
+
+        spell = self._opener[self._opener_index]
+        if not spell.is_ready(self.character, self.enemy_count):
+            if self.recorder is not None:
+                self._record(EventType.WAIT_OPENER, spell.name)
+            self.update_time(0.1)
+            return None
+        self._opener_index += 1
+        if self.apl_state is not None:
+            self.apl_state.cast(spell)
+        return spell
+
+    def _select_spell(self) -> Optional[Spell]:
+        """Returns the spell to cast next: the opener, then the APL or the
+        rotation order."""
+
+        if self._opener_index < len(self._opener):
+            return self._next_opener_spell()
+        if self.apl_state is not None:
+            return self._next_apl_spell()
+        return self._next_spell()
+
+    def start(self) -> None:
+        """Resets the character and the outputs for a new fight."""
+
+        if self.recorder is not None:
+            self._record(EventType.START, damage=self.duration)
 
         for spell in self.character.rotation:
             spell.reset_cooldown()
@@ -375,178 +749,285 @@ class Simulation:
         for spell in self.character.spells.values():
             self.damage_table[spell.name] = 0
 
-        while self.time < self.duration:
-            if self.gcd > 0:
-                self.update_time(self.gcd)
-
-            # Locate a spell that we can cast.
-            spell = next(
-                (
-                    s
-                    for s in self.character.rotation
-                    if s.is_ready(self.character, self.enemy_count)
-                ),
-                None,
-            )
+        if self.timeline is not None:
+            self.timeline.start_iteration()
 
-            if spell is not None:
-                check = False
-
-                # Check for spells
-                for test_spell in self.character.rotation:
-                    if spell.name != test_spell.name:
-                        if (
-                            spell.effective_cast_time(self.character) == 0
-                            and test_spell.remaining_cooldown > 0
-                            and test_spell.remaining_cooldown
-                            < (1.5 / (1 + self.character.haste / 100))
-                        ):
-                            if self.do_debug:
-                                print(
-                                    f"Waiting for {test_spell.name} "
-                                    + "(GCD Trigger)"
-                                )
-                            self.update_time(test_spell.remaining_cooldown)
-                            check = True
-                            break
-
-                        if (
-                            test_spell.remaining_cooldown
-                            < spell.effective_cast_time(self.character)
-                            and test_spell.remaining_cooldown > 0
-                        ):
-                            if self.do_debug:
-                                print(f"Waiting for {test_spell.name}")
-                            self.update_time(test_spell.remaining_cooldown)
-                            check = True
-                            break
-                    else:
-                        break
-
-                if check:
-                    continue
-
-            if spell is None:
-                if self.do_debug:
-                    print(f"Time {self.time:.2f}: No ready spell available")
-                self.update_time(0.1)
-                continue
-
-            self.gcd = 1.5 / (1 + self.character.haste / 100)
-
-            if self.do_debug:
-                print(f"Time {self.time:.2f}: Cast {spell.name}.")
-
-            non_boosted_spell = None
-
-            # Replace Freezing Torrent with Soulfrost if applicable
-            if spell.name == "Freezing Torrent" and any(
-                buff.name == "Soulfrost Torrent" for buff in self.buffs
-            ):
-                non_boosted_spell = deepcopy(spell)
-                spell = self.character.soulfrost
-                # Remove Soulfrost from buffs
-                self.buffs = [
-                    buff
-                    for buff in self.buffs
-                    if buff.name != "Soulfrost Torrent"
-                ]
-
-            # Replace Glacial Blast with Boosted Blast if applicable
-            elif (
-                spell.name == "Glacial Blast"
-                and "Glacial Assault" in self.character.talents
-            ):
-                glacial_assault_count = sum(
-                    1 for buff in self.buffs if buff.name == "Glacial Assault"
+        if self.apl is None:
+            self.apl_state = None
+        elif self.apl_state is None or self.apl_state.apl is not self.apl:
+            self.apl_state = self.apl.bind(self)
+        else:
+            # Restarted, e.g. by pooled batches.
+            self.apl_state.update_targets(self.enemy_count)
+            self.apl_state.reset()
+        if self.fight is not None:
+            self._set_phase(self.fight.phase_at(self.time))
+
+        rotation = {
+            spell_key(spell.name): spell for spell in self.character.rotation
+        }
+        self._opener = []
+        for name in self.opener:
+            if name not in rotation:
+                raise ValueError(
+                    f"Opener spell `{name}` is not in the rotation."
                 )
-                if glacial_assault_count == 4:
-                    self.buffs = [
-                        buff
-                        for buff in self.buffs
-                        if buff.name != "Glacial Assault"
-                    ]
-                    non_boosted_spell = deepcopy(spell)
-                    spell = self.character.boosted_blast
-
-            self.update_time(0.01)
-
-            if spell.channeled:
-                # Cast -> Cooldown Starts -> Channel Starts
-                # -> Channel Finished -> Done.
-
-                if non_boosted_spell:
-                    non_boosted_spell.set_cooldown()
-                else:
-                    spell.set_cooldown()
-
-                for _ in range(spell.ticks):
-                    self.do_damage(
-                        spell,
-                        spell.damage(self.character) / spell.ticks,
-                        spell.mana_generation / spell.ticks,
-                        spell.winter_orb_cost,
-                    )
-                    self.update_time(
-                        spell.effective_cast_time(self.character) / spell.ticks
-                    )
+            self._opener.append(rotation[name])
+        self._opener_index = 0
 
-            elif spell.is_debuff:
-                self.update_time(spell.effective_cast_time(self.character))
-                spell.apply_debuff()
-                if spell.winter_orb_cost > 0:
-                    self.lose_orb(spell.winter_orb_cost)
-                if spell.ticks > 0:
-                    spell.next_tick_time = (
-                        self.time + spell.debuff_duration / spell.ticks
-                    )
-                self.debuffs.append(spell)
-
-                if non_boosted_spell:
-                    non_boosted_spell.set_cooldown()
-                else:
-                    spell.set_cooldown()
-
-            elif spell.is_buff:
-                # Cast -> Cast Duration Starts -> "Hits"
-                # -> Cooldown Starts -> Done
-
-                self.update_time(spell.effective_cast_time(self.character))
-                # Lazy coding
-                spell.apply_debuff()
-                if spell.ticks > 0:
-                    spell.next_tick_time = (
-                        self.time + spell.debuff_duration / spell.ticks
-                    )
-                self.buffs.append(spell)
+    def step(self) -> None:
+        """Advances the fight by one cast, or by a wait if none is ready."""
+
+        if self.gcd > 0:
+            self.update_time(self.gcd)
+
+        if not self.enemy_count:
+            self._wait_downtime()
+            return
+
+        spell = self._select_spell()
+        if spell is None:
+            return
+
+        self.gcd = self.gcd_duration()
 
-                # Hacky Buff Coding
-                if spell.name == "Wrath of Winter":
-                    self.character.haste += 30
+        if self.recorder is not None:
+            self._record(EventType.CAST, spell.name)
 
-                if non_boosted_spell:
-                    non_boosted_spell.set_cooldown()
-                else:
-                    spell.set_cooldown()
-            else:
-                # Cast -> Cast Duration Starts -> "Hits"
-                # -> Cooldown Starts -> Done
+        # Replacement casts start no cooldown, neither of the replaced spell
+        # nor of the replacement.
+        replaced = False
 
-                self.update_time(spell.effective_cast_time(self.character))
+        # Replace Freezing Torrent with Soulfrost if applicable
+        if spell.name == "Freezing Torrent" and self._count_buffs(
+            "Soulfrost Torrent"
+        ):
+            replaced = True
+            spell = self.character.soulfrost
+            # Remove Soulfrost from buffs
+            self._remove_buffs("Soulfrost Torrent")
+
+        # Replace Glacial Blast with Boosted Blast if applicable
+        elif (
+            spell.name == "Glacial Blast"
+            and self.modifiers.glacial_assault_stacks
+        ):
+            glacial_assault_count = self._count_buffs("Glacial Assault")
+            if glacial_assault_count == self.modifiers.glacial_assault_stacks:
+                self._remove_buffs("Glacial Assault")
+                replaced = True
+                spell = self.character.boosted_blast
+
+        self.update_time(0.01)
+
+        if spell.channeled:
+            # Cast -> Cooldown Starts -> Channel Starts
+            # -> Channel Finished -> Done.
+
+            if not replaced:
+                spell.set_cooldown()
+
+            for _ in range(spell.ticks):
                 self.do_damage(
                     spell,
-                    spell.damage(self.character),
-                    spell.mana_generation,
+                    self.spell_damage(spell) / spell.ticks,
+                    spell.mana_generation / spell.ticks,
                     spell.winter_orb_cost,
                 )
+                self.update_time(
+                    self.cast_time(spell) / spell.ticks
+                )
+
+        elif spell.is_debuff:
+            self.update_time(self.cast_time(spell))
+            spell.apply_debuff()
+            if spell.winter_orb_cost > 0:
+                self.lose_orb(spell.winter_orb_cost)
+            if spell.ticks > 0:
+                spell.next_tick_time = (
+                    self.time + spell.debuff_duration / spell.ticks
+                )
+            self.debuffs.append(spell)
+
+            if not replaced:
+                spell.set_cooldown()
+
+        elif spell.is_buff:
+            # Cast -> Cast Duration Starts -> "Hits"
+            # -> Cooldown Starts -> Done
+
+            self.update_time(self.cast_time(spell))
+            # Lazy coding
+            spell.apply_debuff()
+            if spell.ticks > 0:
+                spell.next_tick_time = (
+                    self.time + spell.debuff_duration / spell.ticks
+                )
+            self.buffs.append(spell)
+
+            # Hacky Buff Coding
+            haste = self.modifiers.buff_haste.get(spell.name)
+            if haste:
+                self.character.haste += haste
+
+            if not replaced:
+                spell.set_cooldown()
+        else:
+            # Cast -> Cast Duration Starts -> "Hits"
+            # -> Cooldown Starts -> Done
+
+            self.update_time(self.cast_time(spell))
+            self.do_damage(
+                spell,
+                self.spell_damage(spell),
+                spell.mana_generation,
+                spell.winter_orb_cost,
+            )
+
+            if not replaced:
+                spell.set_cooldown()
+
+    def _count_buffs(self, name: str) -> int:
+        """Returns the number of active buffs of that name."""
+
+        count = 0
+        for buff in self.buffs:
+            if buff.name == name:
+                count += 1
+        return count
+
+    def _remove_buffs(self, name: str) -> None:
+        """Removes the buffs of that name, in place."""
 
-                if non_boosted_spell:
-                    non_boosted_spell.set_cooldown()
-                else:
-                    spell.set_cooldown()
+        buffs = self.buffs
+        index = len(buffs)
+        while index:
+            index -= 1
+            if buffs[index].name == name:
+                del buffs[index]
+
+    def _wait_downtime(self) -> None:
+        """Waits until the next phase of the fight, or its end."""
+
+        delta_time = min(self._next_phase, self.duration) - self.time
+        if delta_time > 0:
+            if self.recorder is not None:
+                self._record(EventType.IDLE)
+            self.update_time(delta_time)
+
+    def finish(self) -> float:
+        """Ends the fight and returns its DPS."""
+
+        if self.timeline is not None:
+            self.timeline.end_iteration()
 
         dps = self.total_damage / self.duration
-        if self.do_debug:
-            print(f"Total Damage: {self.total_damage:.2f}, DPS: {dps:.2f}")
+        if self.recorder is not None:
+            self._record(EventType.END, damage=self.total_damage)
 
         return dps
+
+    def run(self) -> float:
+        """Runs the simulation."""
+
+        self.start()
+        return self.resume()
+
+    def resume(self) -> float:
+        """Runs the fight from the current state to its end."""
+
+        while self.time < self.duration:
+            self.step()
+        return self.finish()
+
+    def _state_spells(self) -> List[Spell]:
+        """Returns every spell object of the character, in a stable order."""
+
+        character = self.character
+        spells = {}
+        for spell in (
+            *character.spells.values(),
+            *character.rotation,
+            character.boosted_blast,
+            character.soulfrost_buff,
+            character.glacial_assault_buff,
+            character.comet_bonus,
+        ):
+            spells.setdefault(id(spell), spell)
+        return list(spells.values())
+
+    def snapshot(self) -> SimulationState:
+        """Returns the state of the fight between two casts."""
+
+        if self._procs:
+            raise RuntimeError("Cannot snapshot while procs are pending.")
+
+        spells = self._state_spells()
+        index = {id(spell): i for i, spell in enumerate(spells)}
+        return SimulationState(
+            time=self.time,
+            gcd=self.gcd,
+            total_damage=self.total_damage,
+            mana=self.character.mana,
+            winter_orbs=self.character.winter_orbs,
+            haste=self.character.haste,
+            spells=[
+                (
+                    spell.remaining_cooldown,
+                    spell.remaining_debuff_duration,
+                    spell.next_tick_time,
+                )
+                for spell in spells
+            ],
+            buffs=[index[id(buff)] for buff in self.buffs],
+            debuffs=[index[id(debuff)] for debuff in self.debuffs],
+            damage_table=dict(self.damage_table),
+            proc_counts=dict(self.proc_counts),
+            opener_index=self._opener_index,
+            timeline=(
+                self.timeline.iteration_cells()
+                if self.timeline is not None
+                else []
+            ),
+            rng_state=self.rng.getstate(),
+        )
+
+    def restore(
+        self, state: SimulationState, restore_rng: bool = True
+    ) -> None:
+        """Starts the fight from a snapshot of the same character.
+
+        With `restore_rng=False` the simulation keeps its own generator,
+        which forks a new iteration from the snapshot.
+        """
+
+        self.start()
+        spells = self._state_spells()
+        if len(spells) != len(state.spells):
+            raise ValueError("Snapshot is of a different character.")
+
+        self.time = state.time
+        self.gcd = state.gcd
+        self.total_damage = state.total_damage
+        self.character.mana = state.mana
+        self.character.winter_orbs = state.winter_orbs
+        self.character.haste = state.haste
+        for spell, (cooldown, duration, next_tick) in zip(
+            spells, state.spells
+        ):
+            spell.remaining_cooldown = cooldown
+            spell.remaining_debuff_duration = duration
+            spell.next_tick_time = next_tick
+        self.buffs = [spells[i] for i in state.buffs]
+        self.debuffs = [spells[i] for i in state.debuffs]
+        if self.fight is not None:
+            self._set_phase(self.fight.phase_at(self.time))
+        self.damage_table.update(state.damage_table)
+        self.proc_counts.update(state.proc_counts)
+        self._opener_index = state.opener_index
+        if self.timeline is not None:
+            self.timeline.restore_iteration(state.timeline)
+        if self.apl_state is not None:
+            self.apl_state.sync()
+        if restore_rng:
+            self.rng.setstate(state.rng_state)
@@ -0,0 +1,124 @@
+"""Module for batched resolution of multi-target hits.
+
+A hit on n targets rolls a crit per target in order, and the damage carried
+to the next target keeps the crits before it: target i takes 2^(crits of
+targets 0..i) * r^i times the damage of the hit, r the reduction of
+secondary targets. Instead of rolling every target, targets are resolved
+in blocks of up to BLOCK_SIZE. The distribution of the (damage multiplier
+sum, crit count) of a block is computed once per block size, crit chance
+and reduction, and a block costs one random number and a binary search,
+with the same distribution as rolling every target.
+"""
+
+import functools
+from bisect import bisect_right
+from itertools import accumulate
+from random import Random
+from typing import Dict, List, Tuple
+
+# Hits on more targets are resolved in blocks, smaller ones roll every
+# target, which is as fast.
+BATCH_TARGETS = 8
+# Targets per block, a block table has at most 10790 outcomes without
+# reduction. Hits on up to BLOCK_SIZE targets cost a single random number.
+BLOCK_SIZE = 16
+
+
+class HitTable:
+    """Outcomes of a block of targets, with their cumulative probability."""
+
+    def __init__(self, size: int, crit_chance: float, reduction: float):
+        # Probability of every (crit count, multiplier sum) after each
+        # target, equal outcomes of different crit orders are merged.
+        outcomes: Dict[Tuple[int, float], float] = {(0, 0.0): 1.0}
+        for target in range(size):
+            rolled: Dict[Tuple[int, float], float] = {}
+            for (crits, total), probability in outcomes.items():
+                for crit, chance in ((0, 1 - crit_chance), (1, crit_chance)):
+                    if chance <= 0:
+                        continue
+                    key = (
+                        crits + crit,
+                        total + 2 ** (crits + crit) * reduction**target,
+                    )
+                    rolled[key] = rolled.get(key, 0.0) + probability * chance
+            outcomes = rolled
+
+        self.outcomes: List[Tuple[int, float]] = list(outcomes)
+        cumulative = list(accumulate(outcomes.values()))
+        # Normalized, the last outcome ends at exactly 1.
+        self.cumulative = [value / cumulative[-1] for value in cumulative]
+        self.cumulative[-1] = 1.0
+
+    def sample(self, rng: Random) -> Tuple[int, float]:
+        """Returns the crit count and the multiplier sum of a block."""
+
+        return self.outcomes[bisect_right(self.cumulative, rng.random())]
+
+
+@functools.lru_cache(maxsize=None)
+def _hit_blocks(
+    targets: int, crit_chance: float, reduction: float
+) -> Tuple[Tuple[HitTable, float], ...]:
+    """Returns the table of every block of targets, with the reduction of
+    its first target."""
+
+    return tuple(
+        (
+            HitTable(min(BLOCK_SIZE, targets - start), crit_chance, reduction),
+            reduction**start,
+        )
+        for start in range(0, targets, BLOCK_SIZE)
+    )
+
+
+def resolve_hits(
+    rng: Random, targets: int, crit_chance: float, reduction: float = 1.0
+) -> Tuple[float, float, int]:
+    """Rolls a hit on `targets` targets.
+
+    `crit_chance` is in percent, `reduction` multiplies the damage carried
+    to every secondary target. Returns the sum of the damage multipliers of
+    every target, the multiplier of the last target and the crit count.
+    """
+
+    blocks = _hit_blocks(
+        targets, min(max(crit_chance, 0), 100) / 100, reduction
+    )
+    if len(blocks) == 1:
+        crits, total = blocks[0][0].sample(rng)
+        return total, 2**crits * reduction ** (targets - 1), crits
+
+    total = 0.0
+    crits = 0
+    for table, start_reduction in blocks:
+        block_crits, block_total = table.sample(rng)
+        total += 2**crits * start_reduction * block_total
+        crits += block_crits
+    return total, 2**crits * reduction ** (targets - 1), crits
+
+
+@functools.lru_cache(maxsize=None)
+def _binomial_cumulative(trials: int, chance: float) -> List[float]:
+    """Returns the cumulative probabilities of 0..trials successes."""
+
+    probability = (1 - chance) ** trials
+    probabilities = [probability]
+    for successes in range(trials):
+        probability *= (
+            (trials - successes) / (successes + 1) * chance / (1 - chance)
+        )
+        probabilities.append(probability)
+    cumulative = list(accumulate(probabilities))
+    return [value / cumulative[-1] for value in cumulative[:-1]] + [1.0]
+
+
+def draw_binomial(rng: Random, trials: int, chance: float) -> int:
+    """Returns the successes of `trials` rolls of `chance` (0 to 1), with
+    one random number. Draws none if the result is certain."""
+
+    if trials <= 0 or chance <= 0:
+        return 0
+    if chance >= 1:
+        return trials
+    return bisect_right(_binomial_cumulative(trials, chance), rng.random())
@@ -0,0 +1,1082 @@
+"""Headless Python API of the simulator.
+
+This module never imports `rich`, so scripts and services can call the
+engine with fast startup and get plain structured results back:
+
+    from api import SimulationConfig, simulate
+
+    result = simulate(SimulationConfig(enemy_count=3, talent_tree="2-12-3"))
+    print(result.base.average_dps)
+"""
+
+import contextlib
+import functools
+import gc
+import math
+import os
+import random
+import threading
+from copy import deepcopy
+from dataclasses import asdict, dataclass, field, fields
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from apl import APL, compile_apl
+from base import Character
+from characters.Rime.build import build_character
+from fight import FightProfile, parse_fight
+from progress import ProgressCounter, ProgressReporter
+from scaling import LINEAR_STATS, linear_weight, what_if_dps
+from Sim import Simulation
+from timeline import Timeline
+
+# Exports, traces, sinks, snapshots, generated engines and checkpoints are
+# imported lazily by the functions using them, to keep `import api` fast.
+if TYPE_CHECKING:
+    from checkpoint import Checkpoint
+    from events import EventRecorder
+    from sink import ResultSink
+
+STATS = ("intellect", "crit", "expertise", "haste", "spirit")
+SIMULATION_TYPES = ("average_dps", "stat_weights")
+# `specialized` runs the simulation generated for the build by `codegen`,
+# `generic` the `Simulation` engine itself. Both give the same results.
+ENGINES = ("specialized", "generic")
+# `serial` runs every scenario in the calling thread, `threads` and
+# `processes` split them into chunks of CHUNK_SIZE iterations run on a pool.
+# Threads only scale on free-threaded CPython builds.
+BACKENDS = ("serial", "threads", "processes")
+# Fixed, so seeded parallel results do not depend on the worker count.
+CHUNK_SIZE = 250
+# Log-spaced buckets of the DPS histogram, about 0.23% wide.
+DPS_BUCKETS_PER_DECADE = 1000
+
+
+@dataclass
+class SimulationConfig:
+    """Options of a simulation, the same as the CLI ones."""
+
+    simulation_type: str = "average_dps"
+    enemy_count: int = 1
+    talent_tree: str = ""
+    preset: str = ""
+    custom_character: str = ""
+    duration: int = 120
+    run_count: int = 2000
+    stat_weights_gain: float = 20
+    timeline_bin: float = 0
+    seed: Optional[int] = None
+    # Action priority list text, replaces the default rotation order.
+    apl: str = ""
+    engine: str = "specialized"
+    # Comma separated spells cast before the rotation, e.g.
+    # `wrath_of_winter,ice_blitz,cold_snap`.
+    opener: str = ""
+    # Keep the DPS and the spell damage of every iteration, see `sink`.
+    keep_iterations: bool = False
+    # Record the events of every trace_every-th iteration, 0 disables it.
+    trace_every: int = 0
+    # Record the events of the lowest and the highest DPS iterations.
+    trace_extremes: bool = False
+    # Target count over time, e.g. `0:1,30:5,45:1`, replaces enemy_count,
+    # see `fight`.
+    fight: str = ""
+    # Reuse one simulation for every iteration of a batch and pause the
+    # cyclic garbage collector while it runs, see `run_batch`.
+    pooled: bool = False
+
+    @classmethod
+    def from_dict(cls, options: Dict) -> "SimulationConfig":
+        """Creates a config from a dict, rejecting unknown options."""
+
+        known = {config_field.name for config_field in fields(cls)}
+        unknown = set(options) - known
+        if unknown:
+            raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+        return cls(**options)
+
+    def to_dict(self) -> Dict:
+        """Returns the config as a plain dict."""
+
+        return asdict(self)
+
+    def validate(self) -> None:
+        """Raises ValueError if the config cannot be simulated."""
+
+        if self.simulation_type not in SIMULATION_TYPES:
+            raise ValueError(
+                "Simulation type must be one of: "
+                + ", ".join(SIMULATION_TYPES)
+            )
+        if self.engine not in ENGINES:
+            raise ValueError("Engine must be one of: " + ", ".join(ENGINES))
+        for name in ("enemy_count", "duration", "run_count"):
+            value = getattr(self, name)
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError(f"{name} must be a positive integer.")
+        if self.timeline_bin < 0:
+            raise ValueError("timeline_bin must not be negative.")
+        if not isinstance(self.trace_every, int) or self.trace_every < 0:
+            raise ValueError("trace_every must be a non-negative integer.")
+        # Raises on malformed fight profiles.
+        fight = self.fight_profile()
+
+        # Raises on malformed presets, characters, talent trees, APLs or
+        # openers.
+        Simulation(
+            self.character(),
+            self.duration,
+            self.enemy_count,
+            do_debug=False,
+            apl=compile_apl(self.apl) if self.apl else None,
+            opener=self.opener_spells(),
+            fight=fight,
+        ).start()
+
+    def fight_profile(self) -> Optional[FightProfile]:
+        """Returns the (cached) compiled fight profile, None if unset."""
+
+        return parse_fight(self.fight) if self.fight else None
+
+    def opener_spells(self) -> List[str]:
+        """Returns the spell names of the opener."""
+
+        return [
+            name.strip() for name in self.opener.split(",") if name.strip()
+        ]
+
+    def character(self) -> Character:
+        """Builds the character of the config."""
+
+        return build_character(
+            preset=self.preset,
+            custom_character=self.custom_character,
+            talent_tree=self.talent_tree,
+        )
+
+    def scenarios(self) -> List[Tuple[str, Optional[str]]]:
+        """Returns the (name, increased stat) pairs to simulate."""
+
+        if self.simulation_type == "stat_weights":
+            return [("base", None)] + [
+                (stat, stat) for stat in STATS if stat not in LINEAR_STATS
+            ]
+        return [("base", None)]
+
+    def linear_stat_weights(self) -> Dict[str, float]:
+        """Returns the exact weights of the stats that only scale damage,
+        which need no scenario, see `scaling`."""
+
+        base = self.character()
+        return {
+            stat: linear_weight(base, scenario_character(self, stat))
+            for stat in LINEAR_STATS
+        }
+
+
+@dataclass
+class BatchResult:
+    """Aggregated result of a batch of iterations of one character."""
+
+    run_count: int = 0
+    dps_total: float = 0.0
+    # Sum of the squared DPS, for the standard deviation.
+    dps_squares: float = 0.0
+    # Iterations per log-spaced DPS bucket, bucket 0 holds DPS below 1.
+    dps_histogram: Dict[int, int] = field(default_factory=dict)
+    lowest_dps: float = float("inf")
+    highest_dps: float = float("-inf")
+    damage_total: Dict[str, float] = field(default_factory=dict)
+    proc_total: Dict[str, int] = field(default_factory=dict)
+    timeline: Optional[Timeline] = None
+    # Per-iteration results, if kept.
+    iterations: Optional["ResultSink"] = None
+    # Event traces of sampled iterations, named `iteration-<row>`, and of
+    # the `lowest` and `highest` DPS ones.
+    traces: Dict[str, "EventRecorder"] = field(default_factory=dict)
+
+    @property
+    def average_dps(self) -> float:
+        """Mean DPS over all iterations."""
+
+        return self.dps_total / self.run_count if self.run_count else 0.0
+
+    @property
+    def stdev_dps(self) -> float:
+        """Sample standard deviation of the DPS."""
+
+        if self.run_count < 2:
+            return 0.0
+        variance = (
+            self.dps_squares - self.dps_total**2 / self.run_count
+        ) / (self.run_count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def dps_percentile(self, percentile: float) -> float:
+        """Returns a DPS percentile, accurate to the histogram buckets."""
+
+        target = percentile / 100 * self.run_count
+        seen = 0
+        for bucket in sorted(self.dps_histogram):
+            seen += self.dps_histogram[bucket]
+            if seen >= target and seen > 0:
+                if bucket == 0:
+                    return 0.0
+                return 10 ** ((bucket - 0.5) / DPS_BUCKETS_PER_DECADE)
+        return 0.0
+
+    @property
+    def damage_table(self) -> Dict[str, float]:
+        """Mean damage per iteration of every spell."""
+
+        runs = max(self.run_count, 1)
+        return {
+            name: damage / runs for name, damage in self.damage_total.items()
+        }
+
+    @property
+    def proc_counts(self) -> Dict[str, float]:
+        """Mean number of procs per iteration."""
+
+        runs = max(self.run_count, 1)
+        return {name: count / runs for name, count in self.proc_total.items()}
+
+    def what_if_dps(self, damage_percents: Dict[str, float]) -> float:
+        """Mean DPS if the spells had the given damage percents, e.g.
+        `{"Frost Bolt": 80}`, derived from the damage table, see
+        `scaling`."""
+
+        return what_if_dps(
+            self.average_dps, self.damage_total, damage_percents
+        )
+
+    def add(self, sim: Simulation, dps: float) -> None:
+        """Adds a finished iteration."""
+
+        self.run_count += 1
+        self.dps_total += dps
+        self.dps_squares += dps * dps
+        bucket = (
+            int(math.log10(dps) * DPS_BUCKETS_PER_DECADE) + 1
+            if dps >= 1
+            else 0
+        )
+        self.dps_histogram[bucket] = self.dps_histogram.get(bucket, 0) + 1
+        self.lowest_dps = min(dps, self.lowest_dps)
+        self.highest_dps = max(dps, self.highest_dps)
+        for name, damage in sim.damage_table.items():
+            self.damage_total[name] = self.damage_total.get(name, 0) + damage
+        for name, count in sim.proc_counts.items():
+            self.proc_total[name] = self.proc_total.get(name, 0) + count
+
+    def merge(self, other: "BatchResult") -> None:
+        """Merges the result of another batch of the same character."""
+
+        traces = dict(other.traces)
+        if other.lowest_dps >= self.lowest_dps:
+            traces.pop("lowest", None)
+        if other.highest_dps <= self.highest_dps:
+            traces.pop("highest", None)
+        self.traces.update(traces)
+
+        self.run_count += other.run_count
+        self.dps_total += other.dps_total
+        self.dps_squares += other.dps_squares
+        for bucket, count in other.dps_histogram.items():
+            self.dps_histogram[bucket] = (
+                self.dps_histogram.get(bucket, 0) + count
+            )
+        self.lowest_dps = min(self.lowest_dps, other.lowest_dps)
+        self.highest_dps = max(self.highest_dps, other.highest_dps)
+        for name, damage in other.damage_total.items():
+            self.damage_total[name] = self.damage_total.get(name, 0) + damage
+        for name, count in other.proc_total.items():
+            self.proc_total[name] = self.proc_total.get(name, 0) + count
+        if self.timeline is None:
+            self.timeline = other.timeline
+        elif other.timeline is not None:
+            self.timeline.merge(other.timeline)
+        # Chunks of a scenario write into the same sink.
+        if self.iterations is None:
+            self.iterations = other.iterations
+
+    def partial(self) -> Dict[str, Any]:
+        """Returns the mergeable aggregates as JSON serializable data.
+
+        Per-iteration results and traces are local and not included.
+        """
+
+        return {
+            "run_count": self.run_count,
+            "dps_total": self.dps_total,
+            "dps_squares": self.dps_squares,
+            "dps_histogram": sorted(self.dps_histogram.items()),
+            "lowest_dps": self.lowest_dps,
+            "highest_dps": self.highest_dps,
+            "damage_total": self.damage_total,
+            "proc_total": self.proc_total,
+            "timeline": (
+                self.timeline.partial() if self.timeline is not None else None
+            ),
+        }
+
+    @classmethod
+    def from_partial(cls, data: Dict[str, Any]) -> "BatchResult":
+        """Creates a result from `partial` data, with identical sums."""
+
+        return cls(
+            run_count=data["run_count"],
+            dps_total=data["dps_total"],
+            dps_squares=data["dps_squares"],
+            dps_histogram={
+                bucket: count for bucket, count in data["dps_histogram"]
+            },
+            lowest_dps=data["lowest_dps"],
+            highest_dps=data["highest_dps"],
+            damage_total=dict(data["damage_total"]),
+            proc_total=dict(data["proc_total"]),
+            timeline=(
+                Timeline.from_partial(data["timeline"])
+                if data["timeline"] is not None
+                else None
+            ),
+        )
+
+    def to_dict(self) -> Dict:
+        """Returns the result as plain, JSON serializable data."""
+
+        result = {
+            "run_count": self.run_count,
+            "average_dps": self.average_dps,
+            "lowest_dps": self.lowest_dps,
+            "highest_dps": self.highest_dps,
+            "stdev_dps": self.stdev_dps,
+            "dps_percentiles": {
+                p: self.dps_percentile(p) for p in (10, 50, 90)
+            },
+            "damage_table": self.damage_table,
+            "proc_counts": self.proc_counts,
+        }
+        if self.timeline is not None:
+            result["timeline"] = self.timeline.summary()
+        if self.iterations is not None:
+            result["distribution"] = {
+                "statistics": self.iterations.statistics(),
+                "histogram": self.iterations.histogram(),
+            }
+        if self.traces:
+            result["traces"] = sorted(self.traces)
+        return result
+
+
+@dataclass
+class Result:
+    """Result of a simulation config."""
+
+    config: SimulationConfig
+    batches: Dict[str, BatchResult]
+
+    @property
+    def base(self) -> BatchResult:
+        """Result of the unmodified character."""
+
+        return self.batches["base"]
+
+    @property
+    def stat_weights(self) -> Dict[str, float]:
+        """Relative DPS gain of every stat, empty unless stat_weights."""
+
+        if self.config.simulation_type != "stat_weights":
+            return {}
+        base_dps = self.base.average_dps
+        linear = self.config.linear_stat_weights()
+        return {
+            stat: (
+                linear[stat]
+                if stat in linear
+                else 1 + (self.batches[stat].average_dps - base_dps) / base_dps
+            )
+            for stat in STATS
+        }
+
+    def export(self, path: str) -> None:
+        """Writes the per-iteration results of every scenario to a `.npz`
+        file, with columns named `<scenario>/<column>`.
+
+        Requires `keep_iterations`, see `sink` and `columns`.
+        """
+
+        if any(batch.iterations is None for batch in self.batches.values()):
+            raise ValueError("Exporting requires keep_iterations.")
+
+        from columns import write_npz
+
+        columns = {}
+        for name, batch in self.batches.items():
+            columns.update(batch.iterations.views(f"{name}/"))
+        write_npz(path, columns)
+
+    def save_traces(self, directory: str) -> List[str]:
+        """Writes every event trace to `<directory>/<scenario>/<trace>.log`
+        and returns the paths. Read them with `events.EventLog`.
+        """
+
+        paths = []
+        for name, batch in self.batches.items():
+            if not batch.traces:
+                continue
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+            for trace, recorder in sorted(batch.traces.items()):
+                path = os.path.join(directory, name, f"{trace}.log")
+                recorder.save(path)
+                paths.append(path)
+        return paths
+
+    def to_dict(self) -> Dict:
+        """Returns the result as plain, JSON serializable data."""
+
+        return {
+            "config": self.config.to_dict(),
+            "results": {
+                name: batch.to_dict() for name, batch in self.batches.items()
+            },
+            "stat_weights": self.stat_weights,
+        }
+
+
+def scenario_character(
+    config: SimulationConfig, stat: Optional[str] = None
+) -> Character:
+    """Builds the character of a scenario, with `stat` increased."""
+
+    character = config.character()
+    if stat is None:
+        return character
+
+    points = {name: getattr(character, f"{name}_points") for name in STATS}
+    points[stat] += config.stat_weights_gain
+    increased = Character(**points)
+    increased.talents = character.talents
+    increased.rotation = character.rotation
+    return increased
+
+
+class _GCPause:
+    """Disables the cyclic garbage collector while any pooled batch runs.
+
+    Batches of parallel threads share it, the collector is enabled again
+    once the last one ends, if it was enabled before the first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._was_enabled = False
+
+    def __enter__(self) -> None:
+        with self._lock:
+            if not self._count:
+                self._was_enabled = gc.isenabled()
+                gc.disable()
+            self._count += 1
+
+    def __exit__(self, *exc_info) -> None:
+        with self._lock:
+            self._count -= 1
+            if not self._count and self._was_enabled:
+                gc.enable()
+
+
+_gc_pause = _GCPause()
+
+
+def run_batch(
+    character: Character,
+    duration: int,
+    run_count: int,
+    enemy_count: int,
+    timeline_bin: float = 0,
+    seed: Optional[int] = None,
+    counter: Optional[ProgressCounter] = None,
+    slot: int = 0,
+    apl: Optional[APL] = None,
+    engine: str = "specialized",
+    opener: Sequence[str] = (),
+    fork: bool = True,
+    sink: Optional["ResultSink"] = None,
+    first_row: int = 0,
+    trace_every: int = 0,
+    trace_extremes: bool = False,
+    reseed: bool = False,
+    rng: Optional[random.Random] = None,
+    partial: Optional[BatchResult] = None,
+    fight: Optional[FightProfile] = None,
+    pooled: bool = False,
+) -> BatchResult:
+    """Runs `run_count` iterations of the character.
+
+    Finished iterations are added to the `slot` of the progress `counter`,
+    and written to the `sink` rows from `first_row` on.
+    With `fork`, the opening until the first random roll is simulated once
+    and every iteration continues from its snapshot, with the same results.
+
+    Rows that are multiples of `trace_every` run on the generic engine with
+    an event recorder, which draws the same random numbers. With
+    `trace_extremes`, the generator state before every iteration is kept
+    for the lowest and highest DPS ones, which are replayed with a recorder
+    at the end. Both leave the results unchanged.
+
+    With `reseed`, iteration `row` draws from `Random(seed + row)`, so
+    batches of different builds share their random numbers per iteration.
+
+    A batch continues from the generator `rng` instead of `Random(seed)`
+    and adds to the `partial` result of earlier iterations if given, so a
+    scenario run in several batches gives the same result as in one.
+
+    With a `fight` profile, the target count follows it instead of
+    `enemy_count`.
+
+    With `pooled`, the forked iterations reuse a single simulation and its
+    character, restored from the snapshot, instead of copying the
+    character for every iteration. They create no reference cycles, so the
+    cyclic garbage collector is paused while the batch runs.
+    """
+
+    if reseed and seed is None:
+        raise ValueError("Reseeding iterations requires a seed.")
+
+    from codegen import specialize
+    from events import EventRecorder
+    from snapshot import deterministic_prefix
+
+    # Each batch owns its generator, batches can run in parallel threads.
+    if rng is None:
+        rng = random.Random(seed)
+
+    simulation_class = (
+        specialize(character, enemy_count, fight=fight)
+        if engine == "specialized"
+        else Simulation
+    )
+
+    result = (
+        partial
+        if partial is not None
+        else BatchResult(
+            timeline=(
+                Timeline(duration, timeline_bin) if timeline_bin else None
+            ),
+            iterations=sink,
+        )
+    )
+
+    def new_simulation(
+        timeline: Optional[Timeline],
+        recorder: Optional[EventRecorder] = None,
+        sim_rng: random.Random = rng,
+    ) -> Simulation:
+        # Only the generic engine records events.
+        return (simulation_class if recorder is None else Simulation)(
+            deepcopy(character),
+            duration=duration,
+            enemy_count=enemy_count,
+            do_debug=False,
+            is_deterministic=False,
+            timeline=timeline,
+            apl=apl,
+            rng=sim_rng,
+            opener=opener,
+            recorder=recorder,
+            fight=fight,
+        )
+
+    prefix = (
+        deterministic_prefix(
+            new_simulation(
+                Timeline(duration, timeline_bin) if timeline_bin else None
+            )
+        )
+        if (fork or pooled) and run_count > 1
+        else None
+    )
+    # Simulation reused by every forked iteration.
+    pool = (
+        new_simulation(result.timeline)
+        if pooled and prefix is not None
+        else None
+    )
+
+    # Generator state and DPS of the lowest and highest DPS iterations.
+    extremes: Dict[str, Tuple[tuple, float]] = {}
+
+    with _gc_pause if pool is not None else contextlib.nullcontext():
+        for row in range(first_row, first_row + run_count):
+            if reseed:
+                rng.seed(seed + row)
+            if trace_extremes:
+                state = rng.getstate()
+
+            if trace_every and row % trace_every == 0:
+                # Traced from the start, the prefix holds no random rolls.
+                recorder = EventRecorder()
+                sim = new_simulation(result.timeline, recorder)
+                dps = sim.run()
+                result.traces[f"iteration-{row}"] = recorder
+            else:
+                sim = (
+                    pool
+                    if pool is not None
+                    else new_simulation(result.timeline)
+                )
+                if prefix is None:
+                    dps = sim.run()
+                else:
+                    sim.restore(prefix, restore_rng=False)
+                    dps = sim.resume()
+
+            if trace_extremes:
+                if dps < extremes.get("lowest", (None, float("inf")))[1]:
+                    extremes["lowest"] = (state, dps)
+                if dps > extremes.get("highest", (None, float("-inf")))[1]:
+                    extremes["highest"] = (state, dps)
+            result.add(sim, dps)
+            if sink is not None:
+                sink.write(row, sim, dps)
+
+            if counter is not None:
+                counter.add(1, slot)
+
+    for name, (state, _) in extremes.items():
+        replay_rng = random.Random()
+        replay_rng.setstate(state)
+        recorder = EventRecorder()
+        new_simulation(None, recorder, replay_rng).run()
+        result.traces[name] = recorder
+
+    return result
+
+
+def _new_sink(rows: int, shared: bool = False) -> "ResultSink":
+    """Returns a sink for `rows` iterations, see `sink`."""
+
+    from sink import ResultSink
+
+    return ResultSink(rows, shared=shared)
+
+
+def _run_config(
+    config: SimulationConfig,
+    counter: Optional[ProgressCounter] = None,
+    slots: Optional[List[int]] = None,
+    checkpoint: Optional["Checkpoint"] = None,
+) -> Result:
+    """Runs every scenario of the config, scenario i counts into slots[i].
+
+    With a `checkpoint`, scenarios run in batches of CHUNK_SIZE iterations
+    that continue the same generator and result, and the progress is
+    recorded after each batch.
+    """
+
+    config.validate()
+    if checkpoint is not None:
+        return _run_checkpointed_config(config, checkpoint, counter, slots)
+
+    batches = {}
+    for index, (name, stat) in enumerate(config.scenarios()):
+        batches[name] = run_batch(
+            scenario_character(config, stat),
+            config.duration,
+            config.run_count,
+            config.enemy_count,
+            timeline_bin=config.timeline_bin if stat is None else 0,
+            seed=config.seed,
+            counter=counter,
+            slot=slots[index] if slots is not None else 0,
+            apl=compile_apl(config.apl) if config.apl else None,
+            engine=config.engine,
+            opener=config.opener_spells(),
+            sink=(
+                _new_sink(config.run_count) if config.keep_iterations else None
+            ),
+            trace_every=config.trace_every,
+            trace_extremes=config.trace_extremes,
+            fight=config.fight_profile(),
+            pooled=config.pooled,
+        )
+    return Result(config, batches)
+
+
+def _run_checkpointed_config(
+    config: SimulationConfig,
+    checkpoint: "Checkpoint",
+    counter: Optional[ProgressCounter] = None,
+    slots: Optional[List[int]] = None,
+) -> Result:
+    """Runs every scenario of the config from its checkpointed progress."""
+
+    batches = {}
+    for index, (name, stat) in enumerate(config.scenarios()):
+        slot = slots[index] if slots is not None else 0
+        state = checkpoint.scenario_state(name)
+        if state is None:
+            row, rng, batch = 0, random.Random(checkpoint.seed), None
+        else:
+            row, rng, batch = state
+            if counter is not None:
+                counter.add(row, slot)
+
+        character = scenario_character(config, stat)
+        apl = compile_apl(config.apl) if config.apl else None
+        while row < config.run_count:
+            count = min(CHUNK_SIZE, config.run_count - row)
+            batch = run_batch(
+                character,
+                config.duration,
+                count,
+                config.enemy_count,
+                timeline_bin=config.timeline_bin if stat is None else 0,
+                counter=counter,
+                slot=slot,
+                apl=apl,
+                engine=config.engine,
+                opener=config.opener_spells(),
+                first_row=row,
+                rng=rng,
+                partial=batch,
+                fight=config.fight_profile(),
+                pooled=config.pooled,
+            )
+            row += count
+            checkpoint.set_scenario(name, row, rng, batch)
+            checkpoint.update()
+        batches[name] = batch
+
+    checkpoint.save()
+    return Result(config, batches)
+
+
+def config_chunks(
+    config: SimulationConfig,
+) -> List[Tuple[str, Optional[str], int]]:
+    """Returns the (name, increased stat, first iteration) parallel tasks."""
+
+    return [
+        (name, stat, start)
+        for name, stat in config.scenarios()
+        for start in range(0, config.run_count, CHUNK_SIZE)
+    ]
+
+
+def run_chunk(
+    config: SimulationConfig,
+    stat: Optional[str],
+    start: int,
+    seed: int,
+    slot: int,
+    sink: Optional["ResultSink"] = None,
+    counter: Optional[ProgressCounter] = None,
+) -> BatchResult:
+    """Runs the chunk of a scenario starting at iteration `start`.
+
+    Every chunk builds its own character and generator, so chunks share no
+    mutable state and can run in parallel threads.
+    """
+
+    return run_batch(
+        scenario_character(config, stat),
+        config.duration,
+        min(CHUNK_SIZE, config.run_count - start),
+        config.enemy_count,
+        timeline_bin=config.timeline_bin if stat is None else 0,
+        seed=seed + start,
+        counter=counter,
+        slot=slot,
+        apl=compile_apl(config.apl) if config.apl else None,
+        engine=config.engine,
+        opener=config.opener_spells(),
+        sink=sink,
+        first_row=start,
+        trace_every=config.trace_every,
+        trace_extremes=config.trace_extremes,
+        fight=config.fight_profile(),
+        pooled=config.pooled,
+    )
+
+
+def _run_parallel(
+    config: SimulationConfig,
+    backend: str,
+    workers: Optional[int] = None,
+    counter: Optional[ProgressCounter] = None,
+    checkpoint: Optional["Checkpoint"] = None,
+) -> Result:
+    """Runs the chunks of the config on a pool, chunk i counts into slot i.
+
+    With a `checkpoint`, finished chunks are recorded and the chunks it
+    holds already are not run again.
+    """
+
+    config.validate()
+    chunks = config_chunks(config)
+    if checkpoint is not None:
+        seed = checkpoint.seed
+    else:
+        seed = (
+            config.seed if config.seed is not None else random.randrange(2**32)
+        )
+
+    batches: Dict[int, BatchResult] = {}
+    if checkpoint is not None:
+        for index, partial in checkpoint.chunks.items():
+            batches[index] = BatchResult.from_partial(partial)
+            if counter is not None:
+                counter.add(batches[index].run_count, index)
+    remaining = [index for index in range(len(chunks)) if index not in batches]
+
+    # Workers write the rows of their chunks in place, processes attach to
+    # the shared sinks by name.
+    sinks = {
+        name: _new_sink(config.run_count, shared=backend == "processes")
+        for name, _ in config.scenarios()
+        if config.keep_iterations
+    }
+    chunk_sinks = [sinks.get(name) for name, _, _ in chunks]
+
+    try:
+        # Imported lazily, they are a noticeable part of the startup time.
+        from concurrent.futures import as_completed
+
+        if backend == "threads":
+            from concurrent.futures import ThreadPoolExecutor
+
+            executor = ThreadPoolExecutor(max_workers=workers)
+            run = functools.partial(run_chunk, config, counter=counter)
+            sink_arguments = chunk_sinks
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(counter,),
+            )
+            run = functools.partial(_run_worker_chunk, config)
+            sink_arguments = [
+                sink.layout() if sink is not None else None
+                for sink in chunk_sinks
+            ]
+
+        with executor:
+            futures = {
+                executor.submit(
+                    run,
+                    chunks[index][1],
+                    chunks[index][2],
+                    seed,
+                    index,
+                    sink_arguments[index],
+                ): index
+                for index in remaining
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                batches[index] = future.result()
+                if checkpoint is not None:
+                    checkpoint.set_chunk(index, batches[index])
+                    checkpoint.update()
+        if checkpoint is not None:
+            checkpoint.save()
+    finally:
+        # The rows stay readable here until the sinks are closed.
+        for sink in sinks.values():
+            sink.unlink()
+
+    # Merged in chunk order, so the sums do not depend on the scheduling.
+    results: Dict[str, BatchResult] = {}
+    for index, (name, _, _) in enumerate(chunks):
+        batch = batches[index]
+        if name in results:
+            results[name].merge(batch)
+        else:
+            results[name] = batch
+    for name, sink in sinks.items():
+        results[name].iterations = sink
+    return Result(config, results)
+
+
+def simulate(
+    config: SimulationConfig,
+    on_progress: Optional[Callable[[str, int], None]] = None,
+    progress_interval: float = 0.1,
+    backend: str = "serial",
+    workers: Optional[int] = None,
+    checkpoint: str = "",
+    resume: bool = False,
+    checkpoint_interval: Optional[float] = None,
+) -> Result:
+    """Runs a simulation config and returns its result.
+
+    `on_progress` is called with the scenario name and the number of newly
+    finished iterations, at most every `progress_interval` seconds and from
+    a separate thread. `backend` is one of BACKENDS, the parallel ones use
+    up to `workers` threads or processes.
+
+    With a `checkpoint` file, the progress is saved to it every
+    `checkpoint_interval` seconds, and with `resume` the run continues from
+    it, with the same results as an uninterrupted run.
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError("Backend must be one of: " + ", ".join(BACKENDS))
+
+    progress = None
+    if checkpoint:
+        if (
+            config.keep_iterations
+            or config.trace_every
+            or config.trace_extremes
+        ):
+            raise ValueError("Checkpointed runs keep no iterations or traces.")
+        # Imported lazily, only checkpointed runs need it.
+        from checkpoint import CHECKPOINT_INTERVAL, Checkpoint
+
+        progress = Checkpoint.open(
+            checkpoint,
+            config,
+            "serial" if backend == "serial" else "chunks",
+            resume,
+            (
+                checkpoint_interval
+                if checkpoint_interval is not None
+                else CHECKPOINT_INTERVAL
+            ),
+        )
+
+    if backend == "serial":
+        names = [name for name, _ in config.scenarios()]
+        run = functools.partial(
+            _run_config,
+            config,
+            slots=list(range(len(names))),
+            checkpoint=progress,
+        )
+    else:
+        # One slot per chunk, every slot keeps a single writer.
+        names = [name for name, _, _ in config_chunks(config)]
+        run = functools.partial(
+            _run_parallel, config, backend, workers, checkpoint=progress
+        )
+
+    if on_progress is None:
+        return run(counter=None)
+
+    counter = ProgressCounter(len(names), shared=backend == "processes")
+    with ProgressReporter(
+        counter,
+        lambda slot, count: on_progress(names[slot], count),
+        progress_interval,
+    ):
+        return run(counter=counter)
+
+
+# Progress counter of a simulate_many or simulate worker process.
+_worker_counter: Optional[ProgressCounter] = None
+
+
+def _init_worker(counter: Optional[ProgressCounter]) -> None:
+    """Pool initializer, stores the shared progress counter."""
+
+    global _worker_counter  # pylint: disable=global-statement
+    _worker_counter = counter
+
+
+def _run_indexed_config(index: int, config: SimulationConfig) -> Result:
+    """Runs the index-th config of simulate_many in a worker process."""
+
+    return _run_config(
+        config, _worker_counter, [index] * len(config.scenarios())
+    )
+
+
+def _run_worker_chunk(
+    config: SimulationConfig,
+    stat: Optional[str],
+    start: int,
+    seed: int,
+    slot: int,
+    sink_layout: Optional[Tuple[str, int, List[str]]] = None,
+) -> BatchResult:
+    """Runs a chunk of `simulate` in a worker process."""
+
+    if sink_layout is None:
+        return run_chunk(
+            config, stat, start, seed, slot, counter=_worker_counter
+        )
+
+    from sink import ResultSink
+
+    with ResultSink.attach(*sink_layout) as sink:
+        batch = run_chunk(
+            config, stat, start, seed, slot, sink, _worker_counter
+        )
+    # The rows are in shared memory already, only return the aggregates.
+    batch.iterations = None
+    return batch
+
+
+def simulate_many(
+    configs: Iterable[SimulationConfig],
+    processes: int = 1,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    progress_interval: float = 0.1,
+) -> List[Result]:
+    """Runs several configs, in parallel processes if `processes` > 1.
+
+    `on_progress` is called with the config index and the number of newly
+    finished iterations, aggregated over all workers.
+    """
+
+    configs = list(configs)
+    counter = (
+        ProgressCounter(len(configs), shared=processes > 1)
+        if on_progress is not None
+        else None
+    )
+    reporter = (
+        ProgressReporter(counter, on_progress, progress_interval)
+        if counter is not None
+        else None
+    )
+
+    if reporter is not None:
+        reporter.start()
+    try:
+        if processes <= 1:
+            return [
+                _run_config(config, counter, [index] * len(config.scenarios()))
+                for index, config in enumerate(configs)
+            ]
+
+        # Imported lazily, it is a noticeable part of the startup time.
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(counter,),
+        ) as executor:
+            return list(
+                executor.map(_run_indexed_config, range(len(configs)), configs)
+            )
+    finally:
+        if reporter is not None:
+            reporter.stop()
@@ -0,0 +1,378 @@
+"""Module for action priority lists (APL).
+
+An APL is a SimC-like text with one action per line, highest priority first:
+
+    # Comments and the `actions+=/` prefix are allowed.
+    wrath_of_winter
+    ice_comet,if=orbs>=3&targets>=3
+    glacial_blast,if=!buff.ice_blitz|cooldown.ice_blitz.remains>5
+    frost_bolt
+
+Conditions can use `orbs`, `mana`, `targets`, `time`, `buff.<name>` (buff
+presence), `cooldown.<spell>.remains` and `cooldown.<spell>.ready`, combined
+with comparisons, `&`, `|`, `!` and parentheses.
+
+The `wait_for_cooldowns` action makes every entry below it wait for the
+entries above it, like the default rotation: instead of casting it, the
+simulation waits for a higher entry whose cooldown ends before the cast (or
+the GCD of an instant cast) would.
+
+The whole list is compiled into a single decision function. Every simulation
+keeps a bitmask index of the entries that are off cooldown, affordable and
+in target range, updated only for the spells whose state changed, so a
+decision does not rescan the rotation.
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from base import Spell
+    from Sim import Simulation
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<number>\d+(?:\.\d+)?)"
+    + r"|(?P<name>[a-z_][a-z0-9_]*(?:\.[a-z0-9_]+)*)"
+    + r"|(?P<op>>=|<=|!=|==|=|>|<|&|\||!|\(|\)|\+|-|\*|/))"
+)
+_ACTIONS_PREFIX = re.compile(r"^actions\+?=/?")
+_OPERATORS = {"=": "==", "&": "and", "|": "or", "!": "not"}
+_VARIABLES = ("orbs", "mana", "targets", "time")
+_WAIT_ACTION = "wait_for_cooldowns"
+
+
+def spell_key(name: str) -> str:
+    """Returns the APL name of a spell or buff, e.g. `ice_comet`."""
+
+    return name.lower().replace(" ", "_")
+
+
+class APLEntry:
+    """A single action of the priority list."""
+
+    def __init__(self, spell: str, condition: str = ""):
+        self.spell = spell
+        self.condition = condition
+        self.cooldowns: Set[str] = set()
+        self.buffs: Set[str] = set()
+        self.source = self._translate(condition) if condition else "True"
+
+    def _translate(self, condition: str) -> str:
+        """Translates the condition into a Python expression."""
+
+        source = []
+        position = 0
+        while position < len(condition):
+            match = _TOKEN.match(condition, position)
+            if match is None or match.end() == position:
+                raise ValueError(
+                    f"Invalid APL condition `{condition}` "
+                    + f"at position {position}."
+                )
+            position = match.end()
+
+            if match.group("number"):
+                source.append(match.group("number"))
+            elif match.group("op"):
+                op = match.group("op")
+                source.append(_OPERATORS.get(op, op))
+            else:
+                source.append(self._translate_name(match.group("name")))
+
+        # Tokens stay separate, `orbs>1 2` must not become `orbs>12`.
+        translated = " ".join(source)
+        try:
+            compile(translated, "<apl>", "eval")
+        except SyntaxError:
+            raise ValueError(f"Invalid APL condition `{condition}`.") from None
+        return translated
+
+    def _translate_name(self, name: str) -> str:
+        """Translates a condition variable into a Python expression."""
+
+        parts = name.split(".")
+        if len(parts) == 1 and name in _VARIABLES:
+            return name
+        if len(parts) == 2 and parts[0] == "buff":
+            self.buffs.add(parts[1])
+            return f"({parts[1]!r} in buffs)"
+        if len(parts) == 3 and parts[0] == "cooldown":
+            self.cooldowns.add(parts[1])
+            remains = f"cooldowns[{parts[1]!r}].remaining_cooldown"
+            if parts[2] == "remains":
+                return f"max({remains}, 0)"
+            if parts[2] == "ready":
+                return f"({remains} <= 0)"
+        raise ValueError(f"Unknown APL variable `{name}`.")
+
+
+class APL:
+    """A compiled action priority list."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.entries: List[APLEntry] = []
+        # Index of the first entry that waits for the entries above it.
+        self.wait_from: Optional[int] = None
+
+        for number, line in enumerate(text.splitlines(), 1):
+            line = _ACTIONS_PREFIX.sub("", line.split("#", 1)[0].strip())
+            if not line:
+                continue
+
+            if line == _WAIT_ACTION:
+                if self.wait_from is None:
+                    self.wait_from = len(self.entries)
+                continue
+
+            try:
+                self.entries.append(self._parse_line(line))
+            except ValueError as error:
+                raise ValueError(f"APL line {number}: {error}") from None
+
+        if not self.entries:
+            raise ValueError("APL has no actions.")
+
+        self.uses_buffs = any(entry.buffs for entry in self.entries)
+        self.decide = self._compile()
+
+    @staticmethod
+    def _parse_line(line: str) -> APLEntry:
+        """Parses an action line, e.g. `ice_comet,if=orbs>=3`."""
+
+        spell, _, options = line.partition(",")
+        condition = ""
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            if key.strip() != "if":
+                raise ValueError(f"Unknown APL option `{key}`.")
+            condition = value.strip()
+        return APLEntry(spell.strip(), condition)
+
+    def _compile(self) -> Callable[..., int]:
+        """Compiles the entries into one decision function.
+
+        The function returns the index of the first entry that is a
+        candidate and whose condition holds, or -1.
+        """
+
+        lines = [
+            "def decide(candidates, orbs, mana, targets, time, buffs, "
+            + "cooldowns):"
+        ]
+        for index, entry in enumerate(self.entries):
+            lines.append(
+                f"    if candidates & {1 << index} and ({entry.source}):"
+            )
+            lines.append(f"        return {index}")
+        lines.append("    return -1")
+
+        namespace: Dict = {}
+        exec(  # pylint: disable=exec-used
+            compile("\n".join(lines), "<apl>", "exec"),
+            {"__builtins__": {"max": max}},
+            namespace,
+        )
+        return namespace["decide"]
+
+    def bind(self, sim: "Simulation") -> "APLState":
+        """Returns the decision state of the APL for a simulation."""
+
+        return APLState(self, sim)
+
+
+class APLState:
+    """The ready index of an APL within one simulation."""
+
+    def __init__(self, apl: APL, sim: "Simulation"):
+        self.apl = apl
+        self.sim = sim
+
+        rotation = {
+            spell_key(spell.name): spell for spell in sim.character.rotation
+        }
+        self.spells: List["Spell"] = []
+        for entry in apl.entries:
+            if entry.spell not in rotation:
+                raise ValueError(
+                    f"APL spell `{entry.spell}` is not in the rotation."
+                )
+            self.spells.append(rotation[entry.spell])
+
+        self.cooldowns = {
+            name: rotation[name]
+            for entry in apl.entries
+            for name in entry.cooldowns
+            if name in rotation
+        }
+        missing = {
+            name for entry in apl.entries for name in entry.cooldowns
+        } - set(self.cooldowns)
+        if missing:
+            raise ValueError(
+                "APL cooldowns of spells not in the rotation: "
+                + ", ".join(sorted(missing))
+            )
+
+        character = sim.character
+        buffs = {
+            spell_key(spell.name)
+            for spell in (
+                *character.spells.values(),
+                character.soulfrost_buff,
+                character.glacial_assault_buff,
+            )
+            if spell.is_buff
+        }
+        unknown = {
+            name for entry in apl.entries for name in entry.buffs
+        } - buffs
+        if unknown:
+            raise ValueError(
+                "Unknown APL buffs: " + ", ".join(sorted(unknown))
+            )
+
+        # Entries casting the same spell share its cooldown.
+        self.same_spell = [
+            sum(
+                1 << other
+                for other, other_spell in enumerate(self.spells)
+                if other_spell is spell
+            )
+            for spell in self.spells
+        ]
+
+        # Entries that can be afforded with a given orb count.
+        self.max_orbs = sim.modifiers.max_orbs
+        self.affordable = [
+            sum(
+                1 << index
+                for index, spell in enumerate(self.spells)
+                if spell.winter_orb_cost <= orbs
+            )
+            for orbs in range(self.max_orbs + 1)
+        ]
+        self.update_targets(sim.enemy_count)
+
+        # Entries on cooldown, only these are checked for state changes.
+        self.cooling = 0
+        self.last: Optional[int] = None
+
+    def update_targets(self, enemy_count: int) -> None:
+        """Recomputes the entries castable on the target count."""
+
+        self.targets = enemy_count
+        self.in_range = sum(
+            1 << index
+            for index, spell in enumerate(self.spells)
+            if spell.min_target_count <= enemy_count <= spell.max_target_count
+        )
+
+    def reset(self) -> None:
+        """Marks every entry as off cooldown."""
+
+        self.cooling = 0
+        self.last = None
+
+    def sync(self) -> None:
+        """Rebuilds the index from the spells, e.g. after a restore."""
+
+        self.cooling = sum(
+            1 << index
+            for index, spell in enumerate(self.spells)
+            if spell.remaining_cooldown > 0
+        )
+        self.last = None
+
+    def _settle_last(self) -> None:
+        """Marks the entries of the last cast as cooling if it went on
+        cooldown."""
+
+        if self.last is not None:
+            if self.spells[self.last].remaining_cooldown > 0:
+                self.cooling |= self.same_spell[self.last]
+            self.last = None
+
+    def cast(self, spell: "Spell") -> None:
+        """Records a spell cast outside of the APL, e.g. by the opener."""
+
+        self._settle_last()
+        for index, entry_spell in enumerate(self.spells):
+            if entry_spell is spell:
+                self.last = index
+                return
+
+    def blocking(self, cast_time: float, gcd: float) -> Optional["Spell"]:
+        """Returns the spell of a higher entry than the last selected one
+        whose cooldown ends before its cast would, None if there is none
+        or the entry does not wait, see `wait_for_cooldowns`.
+
+        Instant casts wait for cooldowns ending within the `gcd`.
+        """
+
+        wait_from = self.apl.wait_from
+        if wait_from is None or self.last is None or self.last < wait_from:
+            return None
+
+        limit = gcd if cast_time == 0 else cast_time
+        # Only cooling entries have a cooldown left, in priority order.
+        higher = self.cooling & ((1 << self.last) - 1)
+        while higher:
+            bit = higher & -higher
+            higher ^= bit
+            spell = self.spells[bit.bit_length() - 1]
+            if 0 < spell.remaining_cooldown < limit:
+                return spell
+        return None
+
+    def select(self) -> Optional["Spell"]:
+        """Returns the spell to cast next, or None if none is castable."""
+
+        sim = self.sim
+        spells = self.spells
+
+        # The last cast is the only entry that can have gone on cooldown.
+        self._settle_last()
+
+        # Cooldown reductions only ever make cooling entries ready sooner.
+        cooling = self.cooling
+        while cooling:
+            bit = cooling & -cooling
+            cooling ^= bit
+            if spells[bit.bit_length() - 1].remaining_cooldown <= 0:
+                self.cooling ^= bit
+
+        orbs = sim.character.winter_orbs
+        candidates = (
+            self.in_range
+            & self.affordable[min(max(orbs, 0), self.max_orbs)]
+            & ~self.cooling
+        )
+        if not candidates:
+            return None
+
+        index = self.apl.decide(
+            candidates,
+            orbs,
+            sim.character.mana,
+            self.targets,
+            sim.time,
+            (
+                {spell_key(buff.name) for buff in sim.buffs}
+                if self.apl.uses_buffs
+                else None
+            ),
+            self.cooldowns,
+        )
+        if index < 0:
+            return None
+        self.last = index
+        return spells[index]
+
+
+@lru_cache(maxsize=32)
+def compile_apl(text: str) -> APL:
+    """Compiles an APL text, cached by its content."""
+
+    return APL(text)
@@ -1,5 +1,6 @@
 """Module for the Character class."""
 
+from copy import deepcopy
 from typing import Dict, List, TYPE_CHECKING
 
 from characters.Rime import RimeSpell, RimeBuff
@@ -18,6 +19,9 @@ class Character:
     spiritPerPoint = 0.21
 
     def __init__(self, intellect, crit, expertise, haste, spirit):
+        # Bumped whenever a stat that affects damage or cast times changes,
+        # so cached values derived from them can be invalidated.
+        self.stat_version = 0
         self.intellect_points = intellect
         self.intellect = intellect * Character.intellectPerPoint
         self.crit_points = crit
@@ -35,21 +39,58 @@ class Character:
         self.spirit_points = spirit
         self.mana = 0
         self.winter_orbs = 0
-        # This will hold the character's available spells.
+        # This will hold the character's available spells. The enum spells
+        # are copied, so no two characters share mutable spell state.
         self.spells: Dict[str, Spell] = {
-            spell.value.name.lower(): spell.value for spell in RimeSpell
+            spell.value.name.lower(): deepcopy(spell.value)
+            for spell in RimeSpell
         }
         # This will hold the character's rotation.
         self.rotation: List[Spell] = []
         # All the talents.
         self.talents: List[str] = []
 
-        self.soulfrost = RimeSpell.SOULFROST_TORRENT.value
-        self.boosted_blast = RimeBuff.BOOSTED_BLAST.value
+        self.soulfrost = self.spells["soulfrost torrent"]
+        self.boosted_blast = deepcopy(RimeBuff.BOOSTED_BLAST.value)
 
-        self.soulfrost_buff = RimeBuff.SOULFROST_BUFF.value
-        self.glacial_assault_buff = RimeBuff.GLACIAL_ASSAULT_BUFF.value
-        self.comet_bonus = RimeBuff.COMET_BONUS.value
+        self.soulfrost_buff = deepcopy(RimeBuff.SOULFROST_BUFF.value)
+        self.glacial_assault_buff = deepcopy(
+            RimeBuff.GLACIAL_ASSAULT_BUFF.value
+        )
+        self.comet_bonus = deepcopy(RimeBuff.COMET_BONUS.value)
+
+    @property
+    def intellect(self) -> float:
+        """Intellect, scales all damage."""
+
+        return self._intellect
+
+    @intellect.setter
+    def intellect(self, value: float) -> None:
+        self._intellect = value
+        self.stat_version += 1
+
+    @property
+    def expertise(self) -> float:
+        """% increase to damage"""
+
+        return self._expertise
+
+    @expertise.setter
+    def expertise(self, value: float) -> None:
+        self._expertise = value
+        self.stat_version += 1
+
+    @property
+    def haste(self) -> float:
+        """% increase to cast speed"""
+
+        return self._haste
+
+    @haste.setter
+    def haste(self, value: float) -> None:
+        self._haste = value
+        self.stat_version += 1
 
     def add_spell_to_rotation(self, spell: RimeSpell) -> None:
         """Adds a spell to the character's rotation."""
@@ -57,7 +98,7 @@ class Character:
         if spell.value.name.lower() not in self.spells:
             raise ValueError(f"Spell {spell} not found in available spells.")
 
-        self.rotation.append(spell.value)
+        self.rotation.append(self.spells[spell.value.name.lower()])
 
     def add_talent(self, talent: str) -> None:
         """Adds a talent to the character's available talents."""
@@ -0,0 +1,486 @@
+"""Module for spellbooks, the spells, buffs and talents of a character as
+data.
+
+A spellbook is a JSON file with the spells and buffs of a character, the
+base modifiers of the simulation (buff damage, targets, resources, ...) and
+the modifiers of every talent, see `characters/Rime/spellbook.json`.
+`load_spellbook` validates it and compiles it into a `Spellbook`, a table
+with one array per spell field. The compiled table is cached in
+`__pycache__` next to the file, keyed by the hash of its content, so later
+loads (e.g. in every worker process) read the arrays back without parsing
+and validating the file again.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .spell import Spell
+
+# Bumped whenever the compiled layout changes, which invalidates the caches.
+FORMAT_VERSION = 1
+MAGIC = b"SPELLBOOK"
+
+# Spell fields with their array type code and default, see `Spell`.
+SPELL_FIELDS: Dict[str, Tuple[str, object]] = {
+    "cast_time": ("d", 0),
+    "cooldown": ("d", 0),
+    "mana_generation": ("d", 0),
+    "winter_orb_cost": ("q", 0),
+    "damage_percent": ("d", 0),
+    "hits": ("q", 1),
+    "channeled": ("b", False),
+    "ticks": ("q", 0),
+    "is_debuff": ("b", False),
+    "debuff_duration": ("d", 0),
+    "do_debuff_damage": ("b", False),
+    "is_buff": ("b", False),
+    "min_target_count": ("q", 1),
+    "max_target_count": ("q", 1000),
+}
+
+# Modifier kinds: `table` maps spell names to numbers, `targets` to target
+# caps (null for every enemy), `rolls` to [chance in percent, multiplier]
+# pairs rolled in order, `names` is a list of spell names.
+MODIFIER_KINDS: Dict[str, str] = {
+    "buff_damage": "table",
+    "buff_haste": "table",
+    "crit_bonus": "table",
+    "aoe_targets": "targets",
+    "secondary_target_damage": "table",
+    "damage_rolls": "rolls",
+    "cooldown_triggers": "names",
+    "hit_cooldown_reductions": "table",
+    "orb_cooldown_reductions": "table",
+    "single_target_mana": "table",
+    "swallow_hits": "table",
+    "spike_buffs": "names",
+    "orb_tick_buffs": "names",
+    "soulfrost_chance": "number",
+    "glacial_assault_stacks": "integer",
+    "max_orbs": "integer",
+    "mana_per_orb": "number",
+}
+
+
+@dataclass(frozen=True)
+class Modifiers:
+    """Modifiers of the spellbook combined with the ones of a talent set.
+
+    Talents override the base modifiers spell by spell, in the order of the
+    spellbook.
+    """
+
+    # Damage multiplier while the buff is active.
+    buff_damage: Dict[str, float] = field(default_factory=dict)
+    # Haste gained while the buff is active.
+    buff_haste: Dict[str, float] = field(default_factory=dict)
+    # Crit chance added to the spell, in percent.
+    crit_bonus: Dict[str, float] = field(default_factory=dict)
+    # Targets hit by the spell, None for every enemy, 1 if missing.
+    aoe_targets: Dict[str, Optional[int]] = field(default_factory=dict)
+    # Multiplier of the damage carried to every secondary target.
+    secondary_target_damage: Dict[str, float] = field(default_factory=dict)
+    # Damage multipliers rolled in order, the first hit applies.
+    damage_rolls: Dict[str, Tuple[Tuple[float, float], ...]] = field(
+        default_factory=dict
+    )
+    # Spells whose hits reduce the cooldowns of hit_cooldown_reductions.
+    cooldown_triggers: FrozenSet[str] = frozenset()
+    hit_cooldown_reductions: Dict[str, float] = field(default_factory=dict)
+    # Cooldown reduction of the spell for every spent orb.
+    orb_cooldown_reductions: Dict[str, float] = field(default_factory=dict)
+    # Mana gained by the spell when fighting a single enemy.
+    single_target_mana: Dict[str, float] = field(default_factory=dict)
+    # Hits of every Dance of Swallows debuff triggered by the spell.
+    swallow_hits: Dict[str, int] = field(default_factory=dict)
+    # Buffs during which gained anima casts as many Anima Spikes.
+    spike_buffs: FrozenSet[str] = frozenset()
+    # Buffs whose ticks gain an orb.
+    orb_tick_buffs: FrozenSet[str] = frozenset()
+    # Chance of a crit to proc Soulfrost, in percent.
+    soulfrost_chance: float = 0
+    # Glacial Assault stacks that boost Glacial Blast, 0 if disabled.
+    glacial_assault_stacks: int = 0
+    max_orbs: int = 5
+    mana_per_orb: float = 10
+
+    def aoe_count(self, spell_name: str, enemy_count: int) -> int:
+        """Returns the number of targets hit by the spell."""
+
+        cap = self.aoe_targets.get(spell_name, 1)
+        return enemy_count if cap is None else min(enemy_count, cap)
+
+
+@dataclass(frozen=True)
+class TalentData:
+    """Talent of a spellbook."""
+
+    key: str
+    identifier: str
+    name: str
+    modifiers: Dict
+
+
+class Spellbook:
+    """Compiled spellbook, with one array per spell field."""
+
+    def __init__(
+        self,
+        digest: str,
+        spell_keys: List[str],
+        buff_keys: List[str],
+        names: List[str],
+        columns: Dict[str, array],
+        talents: List[TalentData],
+        modifiers: Dict,
+    ):
+        self.digest = digest
+        self.spell_keys = spell_keys
+        self.buff_keys = buff_keys
+        # Spells first, then buffs.
+        self.keys = spell_keys + buff_keys
+        self.names = names
+        self.columns = columns
+        self.talents = talents
+        self.modifiers = modifiers
+        self.index = {key: row for row, key in enumerate(self.keys)}
+        self._resolved: Dict[FrozenSet[str], Modifiers] = {}
+
+    def row(self, key: str) -> Dict:
+        """Returns the spell fields of the spell or buff."""
+
+        row = self.index[key]
+        return {
+            name: _TYPES[typecode](self.columns[name][row])
+            for name, (typecode, _) in SPELL_FIELDS.items()
+        }
+
+    def spell(self, key: str) -> Spell:
+        """Returns a new spell object of the spell or buff."""
+
+        return Spell(self.names[self.index[key]], **self.row(key))
+
+    def resolve(self, talents: Iterable[str]) -> Modifiers:
+        """Returns the (cached) modifiers of the talent names.
+
+        Unknown names have no modifiers.
+        """
+
+        selected = frozenset(talents)
+        modifiers = self._resolved.get(selected)
+        if modifiers is None:
+            merged = _merge({}, self.modifiers)
+            for talent in self.talents:
+                if talent.name in selected:
+                    merged = _merge(merged, talent.modifiers)
+            modifiers = _to_modifiers(merged)
+            self._resolved[selected] = modifiers
+        return modifiers
+
+    def to_bytes(self) -> bytes:
+        """Returns the compiled table, see `from_bytes`."""
+
+        header = json.dumps(
+            {
+                "version": FORMAT_VERSION,
+                "digest": self.digest,
+                "spell_keys": self.spell_keys,
+                "buff_keys": self.buff_keys,
+                "names": self.names,
+                "talents": [
+                    [t.key, t.identifier, t.name, t.modifiers]
+                    for t in self.talents
+                ],
+                "modifiers": self.modifiers,
+            }
+        ).encode()
+        return b"".join(
+            [MAGIC, struct.pack("<I", len(header)), header]
+            + [self.columns[name].tobytes() for name in SPELL_FIELDS]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Spellbook":
+        """Reads a compiled table, raises ValueError if it is invalid."""
+
+        if not data.startswith(MAGIC):
+            raise ValueError("Not a compiled spellbook.")
+        offset = len(MAGIC)
+        (length,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        header = json.loads(data[offset : offset + length])
+        offset += length
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError("Compiled spellbook of another version.")
+
+        rows = len(header["spell_keys"]) + len(header["buff_keys"])
+        columns = {}
+        view = memoryview(data)
+        for name, (typecode, _) in SPELL_FIELDS.items():
+            column = array(typecode)
+            size = rows * column.itemsize
+            column.frombytes(view[offset : offset + size])
+            offset += size
+            columns[name] = column
+        if offset != len(data):
+            raise ValueError("Truncated compiled spellbook.")
+
+        return cls(
+            header["digest"],
+            header["spell_keys"],
+            header["buff_keys"],
+            header["names"],
+            columns,
+            [TalentData(*talent) for talent in header["talents"]],
+            header["modifiers"],
+        )
+
+
+_TYPES = {"d": float, "q": int, "b": bool}
+
+
+def _merge(base: Dict, update: Dict) -> Dict:
+    """Returns the modifiers of `base` overridden by `update`."""
+
+    merged = dict(base)
+    for name, value in update.items():
+        if isinstance(value, dict):
+            merged[name] = {**merged.get(name, {}), **value}
+        else:
+            merged[name] = value
+    return merged
+
+
+def _to_modifiers(modifiers: Dict) -> Modifiers:
+    """Builds the modifiers from validated data."""
+
+    values = dict(modifiers)
+    if "damage_rolls" in values:
+        values["damage_rolls"] = {
+            name: tuple((chance, multiplier) for chance, multiplier in rolls)
+            for name, rolls in values["damage_rolls"].items()
+        }
+    for name, kind in MODIFIER_KINDS.items():
+        if kind == "names" and name in values:
+            values[name] = frozenset(values[name])
+    return Modifiers(**values)
+
+
+def _is_number(value) -> bool:
+    """Returns True for ints and floats, but not bools."""
+
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Validator:
+    """Validates the data of a spellbook file."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.spell_names: FrozenSet[str] = frozenset()
+
+    def fail(self, where: str, problem: str) -> None:
+        """Raises the error of an invalid entry."""
+
+        raise ValueError(f"{self.source}: `{where}` {problem}.")
+
+    def mapping(self, value, where: str) -> Dict:
+        """Checks that the value is an object."""
+
+        if not isinstance(value, dict):
+            self.fail(where, "must be an object")
+        return value
+
+    def spells(self, data: Dict, section: str) -> Dict[str, Dict]:
+        """Checks the spells of a section, returns their fields."""
+
+        rows = {}
+        for key, spell in self.mapping(data.get(section), section).items():
+            where = f"{section}.{key}"
+            self.mapping(spell, where)
+            if not isinstance(spell.get("name"), str) or not spell["name"]:
+                self.fail(f"{where}.name", "must be a non-empty string")
+            row = {"name": spell["name"]}
+            for name, value in spell.items():
+                if name == "name":
+                    continue
+                if name not in SPELL_FIELDS:
+                    self.fail(f"{where}.{name}", "is not a spell field")
+                typecode = SPELL_FIELDS[name][0]
+                if typecode == "b" and not isinstance(value, bool):
+                    self.fail(f"{where}.{name}", "must be a boolean")
+                if typecode == "q" and (
+                    not isinstance(value, int) or isinstance(value, bool)
+                ):
+                    self.fail(f"{where}.{name}", "must be an integer")
+                if typecode == "d" and not _is_number(value):
+                    self.fail(f"{where}.{name}", "must be a number")
+                row[name] = value
+            rows[key] = row
+        return rows
+
+    def spell_name(self, name, where: str) -> None:
+        """Checks that the name is the name of a spell or buff."""
+
+        if name not in self.spell_names:
+            self.fail(where, f"names an unknown spell `{name}`")
+
+    def modifiers(self, data, where: str) -> Dict:
+        """Checks a set of modifiers."""
+
+        for name, value in self.mapping(data, where).items():
+            entry = f"{where}.{name}"
+            kind = MODIFIER_KINDS.get(name)
+            if kind is None:
+                self.fail(entry, "is not a modifier")
+            elif kind == "number":
+                if not _is_number(value):
+                    self.fail(entry, "must be a number")
+            elif kind == "integer":
+                if not isinstance(value, int) or isinstance(value, bool):
+                    self.fail(entry, "must be an integer")
+            elif kind == "names":
+                if not isinstance(value, list):
+                    self.fail(entry, "must be a list of spell names")
+                for spell_name in value:
+                    self.spell_name(spell_name, entry)
+            else:
+                for spell_name, item in self.mapping(value, entry).items():
+                    self.spell_name(spell_name, entry)
+                    self.table_entry(kind, item, f"{entry}.{spell_name}")
+        return data
+
+    def table_entry(self, kind: str, value, where: str) -> None:
+        """Checks the value of a spell in a modifier table."""
+
+        if kind == "table" and not _is_number(value):
+            self.fail(where, "must be a number")
+        if kind == "targets" and value is not None:
+            if not isinstance(value, int) or isinstance(value, bool):
+                self.fail(where, "must be an integer or null")
+            if value < 1:
+                self.fail(where, "must be at least 1")
+        if kind == "rolls":
+            if not isinstance(value, list) or not all(
+                isinstance(roll, list)
+                and len(roll) == 2
+                and all(_is_number(number) for number in roll)
+                for roll in value
+            ):
+                self.fail(where, "must be a list of [chance, multiplier]")
+
+    def talents(self, data: Dict) -> List[TalentData]:
+        """Checks the talents."""
+
+        talents = []
+        identifiers = set()
+        section = self.mapping(data.get("talents"), "talents")
+        for key, talent in section.items():
+            where = f"talents.{key}"
+            self.mapping(talent, where)
+            for name in ("identifier", "name"):
+                if not isinstance(talent.get(name), str):
+                    self.fail(f"{where}.{name}", "must be a string")
+            if talent["identifier"] in identifiers:
+                self.fail(f"{where}.identifier", "is not unique")
+            identifiers.add(talent["identifier"])
+            talents.append(
+                TalentData(
+                    key,
+                    talent["identifier"],
+                    talent["name"],
+                    self.modifiers(
+                        talent.get("modifiers", {}), f"{where}.modifiers"
+                    ),
+                )
+            )
+        return talents
+
+
+def compile_spellbook(data: Dict, digest: str, source: str) -> Spellbook:
+    """Validates the data of a spellbook file and compiles it.
+
+    Raises ValueError naming the first invalid entry.
+    """
+
+    validator = _Validator(source)
+    validator.mapping(data, "spellbook")
+    unknown = set(data) - {"spells", "buffs", "modifiers", "talents"}
+    if unknown:
+        validator.fail(sorted(unknown)[0], "is not a spellbook section")
+
+    spells = validator.spells(data, "spells")
+    buffs = validator.spells(data, "buffs")
+    duplicates = set(spells) & set(buffs)
+    if duplicates:
+        validator.fail(f"buffs.{sorted(duplicates)[0]}", "is also a spell")
+    rows = list(spells.values()) + list(buffs.values())
+    validator.spell_names = frozenset(row["name"] for row in rows)
+
+    modifiers = validator.modifiers(data.get("modifiers", {}), "modifiers")
+    talents = validator.talents(data)
+
+    columns = {
+        name: array(typecode, (row.get(name, default) for row in rows))
+        for name, (typecode, default) in SPELL_FIELDS.items()
+    }
+    return Spellbook(
+        digest,
+        list(spells),
+        list(buffs),
+        [row["name"] for row in rows],
+        columns,
+        talents,
+        modifiers,
+    )
+
+
+def load_spellbook(path: str, cache_dir: Optional[str] = None) -> Spellbook:
+    """Loads the spellbook file, from its compiled cache if it is current.
+
+    The cache lives in `cache_dir`, by default `__pycache__` next to the
+    file, and is skipped if it cannot be written.
+    """
+
+    with open(path, "rb") as file:
+        content = file.read()
+    digest = hashlib.sha256(
+        MAGIC + bytes([FORMAT_VERSION]) + content
+    ).hexdigest()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), "__pycache__")
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}.{digest[:16]}.bin")
+
+    try:
+        with open(cache_path, "rb") as file:
+            spellbook = Spellbook.from_bytes(file.read())
+        if spellbook.digest == digest:
+            return spellbook
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+
+    try:
+        data = json.loads(content)
+    except ValueError as error:
+        raise ValueError(f"{path}: invalid JSON: {error}") from error
+    spellbook = compile_spellbook(data, digest, path)
+
+    # Written to a temporary file first, so concurrent loads never read a
+    # partial cache.
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=cache_dir, suffix=".tmp", delete=False
+        ) as file:
+            file.write(spellbook.to_bytes())
+        os.replace(file.name, cache_path)
+    except OSError:
+        pass
+    return spellbook
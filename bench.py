@@ -0,0 +1,530 @@
+"""Benchmarks of the simulator.
+
+Usage:
+    python bench.py startup -n 20
+    python bench.py codegen -n 200
+    python bench.py tracing -n 2000
+    python bench.py estimate -n 2000
+    python bench.py aoe -n 20000
+    python bench.py spellbook -n 200
+    python bench.py fight -n 200
+    python bench.py weights -n 500
+    python bench.py allocations -n 50
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _time_command(command: List[str], repeat: int) -> List[float]:
+    """Returns the wall times of running the command `repeat` times."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def startup(arguments: argparse.Namespace) -> None:
+    """Measures the startup time of the short-sim paths of the CLI."""
+
+    short_sim = ["-s", "average_dps", "-e", "1", "-d", "1", "-r", "1"]
+    commands = {
+        "interpreter": [sys.executable, "-c", "pass"],
+        "import api": [sys.executable, "-c", "import api"],
+        "main.py --output json": [
+            sys.executable,
+            "main.py",
+            *short_sim,
+            "--output",
+            "json",
+        ],
+        "main.py --quiet": [sys.executable, "main.py", *short_sim, "-q"],
+    }
+
+    print(f"{'Command':<24}{'Mean (ms)':>12}{'Min (ms)':>12}")
+    for name, command in commands.items():
+        try:
+            times = _time_command(command, arguments.repeat)
+        except subprocess.CalledProcessError:
+            print(f"{name:<24}{'failed':>12}")
+            continue
+        print(
+            f"{name:<24}{statistics.mean(times) * 1000:>12.1f}"
+            + f"{min(times) * 1000:>12.1f}"
+        )
+
+    # Make sure the json and quiet paths never pay for rich.
+    for name, options in {
+        "json": ["--output", "json"],
+        "quiet": ["--quiet"],
+    }.items():
+        argv = ["main.py", *short_sim, *options]
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, runpy; "
+                + f"sys.argv = {argv!r}; "
+                + "runpy.run_path('main.py', run_name='__main__'); "
+                + "print('rich' in sys.modules, file=sys.stderr)",
+            ],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        ).stderr.strip()
+        print(f"rich loaded on the {name} path: {loaded}")
+
+
+def codegen(arguments: argparse.Namespace) -> None:
+    """Compares the specialized simulations with the generic engine.
+
+    Every build is run with the same seed by both engines, the DPS must be
+    identical.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    from api import run_batch
+    from characters.Rime.build import build_character
+
+    builds = {
+        "no talents, 1 target": ("", 1),
+        "3-13-2, 1 target": ("3-13-2", 1),
+        "2-12-3, 3 targets": ("2-12-3", 3),
+        "123-123-123, 8 targets": ("123-123-123", 8),
+    }
+
+    print(
+        f"{'Build':<24}{'Generic (ms)':>14}{'Specialized (ms)':>18}"
+        + f"{'Speedup':>10}{'Identical':>11}"
+    )
+    for name, (talent_tree, enemy_count) in builds.items():
+        character = build_character(talent_tree=talent_tree)
+        times = {}
+        results = {}
+        for engine in ("generic", "specialized"):
+            start = time.perf_counter()
+            results[engine] = run_batch(
+                character,
+                120,
+                arguments.repeat,
+                enemy_count,
+                seed=0,
+                engine=engine,
+            )
+            times[engine] = (
+                (time.perf_counter() - start) / arguments.repeat * 1000
+            )
+
+        identical = (
+            results["generic"].dps_total == results["specialized"].dps_total
+            and results["generic"].damage_total
+            == results["specialized"].damage_total
+        )
+        print(
+            f"{name:<24}{times['generic']:>14.2f}"
+            + f"{times['specialized']:>18.2f}"
+            + f"{times['generic'] / times['specialized']:>9.2f}x"
+            + f"{str(identical):>11}"
+        )
+
+
+def tracing(arguments: argparse.Namespace) -> None:
+    """Measures the cost of sampled event tracing per iteration.
+
+    Traced batches must give the same results as untraced ones.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    from api import run_batch
+    from characters.Rime.build import build_character
+
+    character = build_character(talent_tree="2-12-3")
+    # Warms up the specialized class cache.
+    run_batch(character, 120, 1, 3, seed=0)
+    modes = {
+        "untraced": {},
+        "1 in 1000": {"trace_every": 1000},
+        "extremes": {"trace_extremes": True},
+        "every iteration": {"trace_every": 1},
+    }
+
+    print(
+        f"{'Tracing':<18}{'Time (ms)':>11}{'Overhead':>10}"
+        + f"{'Identical':>11}"
+    )
+    reference = None
+    for name, options in modes.items():
+        start = time.perf_counter()
+        result = run_batch(
+            character, 120, arguments.repeat, 3, seed=0, **options
+        )
+        elapsed = (time.perf_counter() - start) / arguments.repeat * 1000
+        if reference is None:
+            reference = (elapsed, result.dps_total)
+        print(
+            f"{name:<18}{elapsed:>11.3f}"
+            + f"{(elapsed / reference[0] - 1) * 100:>9.1f}%"
+            + f"{str(result.dps_total == reference[1]):>11}"
+        )
+
+
+def estimate(arguments: argparse.Namespace) -> None:
+    """Compares the expected-value estimates with full simulations.
+
+    `--repeat` is the iteration count of the full simulations.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    from api import SimulationConfig, simulate
+    from expected import estimate as estimate_config
+
+    builds = {
+        "no talents, 1 target": ("", 1),
+        "3-13-2, 1 target": ("3-13-2", 1),
+        "2-12-3, 3 targets": ("2-12-3", 3),
+        "123-123-123, 8 targets": ("123-123-123", 8),
+    }
+
+    print(
+        f"{'Build':<24}{'Estimate (ms)':>15}{'Sim (ms)':>10}"
+        + f"{'Estimate':>10}{'Sim DPS':>10}{'Error':>9}"
+    )
+    for name, (talent_tree, enemy_count) in builds.items():
+        config = SimulationConfig(
+            enemy_count=enemy_count,
+            talent_tree=talent_tree,
+            run_count=arguments.repeat,
+            seed=0,
+        )
+        config_estimate = estimate_config(config)
+        start = time.perf_counter()
+        result = simulate(config)
+        elapsed = (time.perf_counter() - start) * 1000
+        error = config_estimate.errors(result)["base"]
+        print(
+            f"{name:<24}{config_estimate.seconds * 1000:>15.2f}"
+            + f"{elapsed:>10.0f}{error['estimate']:>10.1f}"
+            + f"{error['simulated']:>10.1f}"
+            + f"{error['relative_error']:>+9.2%}"
+        )
+
+
+def aoe(arguments: argparse.Namespace) -> None:
+    """Compares rolling every target of a hit with the batched resolution.
+
+    Both must give the same mean damage multiplier, up to the noise.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    import random
+
+    from aoe import draw_binomial, resolve_hits
+
+    crit_chance = 23.9
+
+    def roll_targets(rng: random.Random, targets: int) -> float:
+        multiplier = 1.0
+        total = 0.0
+        for _ in range(targets):
+            if rng.random() * 100 < crit_chance:
+                multiplier *= 2
+                # Soulfrost proc roll.
+                rng.random()
+            total += multiplier
+        return total
+
+    def batched(rng: random.Random, targets: int) -> float:
+        total, _, crits = resolve_hits(rng, targets, crit_chance)
+        draw_binomial(rng, crits, 0.25)
+        return total
+
+    print(
+        f"{'Targets':<9}{'Per target (us)':>17}{'Batched (us)':>14}"
+        + f"{'Mean':>12}{'Batched mean':>14}"
+    )
+    for targets in (9, 16, 20, 40, 100):
+        times = {}
+        means = {}
+        for name, resolve in (("rolled", roll_targets), ("batched", batched)):
+            rng = random.Random(0)
+            resolve(rng, targets)
+            start = time.perf_counter()
+            total = sum(
+                resolve(rng, targets) for _ in range(arguments.repeat)
+            )
+            times[name] = (
+                (time.perf_counter() - start) / arguments.repeat * 1e6
+            )
+            means[name] = total / arguments.repeat
+        print(
+            f"{targets:<9}{times['rolled']:>17.2f}{times['batched']:>14.2f}"
+            + f"{means['rolled']:>12.4g}{means['batched']:>14.4g}"
+        )
+
+
+def spellbook(arguments: argparse.Namespace) -> None:
+    """Compares compiling the Rime spellbook with loading its cache."""
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    import json
+    import tempfile
+
+    from base.spellbook import compile_spellbook, load_spellbook
+
+    path = os.path.join(ROOT, "characters", "Rime", "spellbook.json")
+    with open(path, "rb") as file:
+        content = file.read()
+
+    times = {}
+    start = time.perf_counter()
+    for _ in range(arguments.repeat):
+        compile_spellbook(json.loads(content), "", path)
+    times["compiled"] = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as cache_dir:
+        load_spellbook(path, cache_dir=cache_dir)
+        start = time.perf_counter()
+        for _ in range(arguments.repeat):
+            load_spellbook(path, cache_dir=cache_dir)
+        times["cached"] = time.perf_counter() - start
+
+    for name, seconds in times.items():
+        print(f"{name:<10}{seconds / arguments.repeat * 1e6:>10.1f} us")
+
+
+def fight(arguments: argparse.Namespace) -> None:
+    """Measures the cost of fight profiles per iteration.
+
+    A profile with a single phase must give the same DPS as the constant
+    enemy count, at the same speed.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    from api import run_batch
+    from characters.Rime.build import build_character
+    from fight import parse_fight
+
+    character = build_character(talent_tree="2-12-3")
+    profiles = {
+        "3 targets": None,
+        "0:3": parse_fight("0:3"),
+        "0:1,30:5,45:1,90:0,100:1": parse_fight("0:1,30:5,45:1,90:0,100:1"),
+    }
+
+    print(f"{'Fight':<28}{'Engine':<13}{'Time (ms)':>10}{'DPS':>10}")
+    for engine in ("generic", "specialized"):
+        for name, profile in profiles.items():
+            start = time.perf_counter()
+            result = run_batch(
+                character,
+                120,
+                arguments.repeat,
+                3,
+                seed=0,
+                engine=engine,
+                fight=profile,
+            )
+            milliseconds = (
+                (time.perf_counter() - start) / arguments.repeat * 1000
+            )
+            print(
+                f"{name:<28}{engine:<13}{milliseconds:>10.2f}"
+                + f"{result.average_dps:>10.1f}"
+            )
+
+
+def weights(arguments: argparse.Namespace) -> None:
+    """Compares the derived intellect and expertise weights with simulated
+    scenarios.
+
+    Under the same seed, both must agree up to rounding.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    from api import SimulationConfig, run_batch, scenario_character, simulate
+    from scaling import LINEAR_STATS
+
+    config = SimulationConfig(
+        simulation_type="stat_weights",
+        enemy_count=3,
+        talent_tree="2-12-3",
+        run_count=arguments.repeat,
+        seed=0,
+    )
+    start = time.perf_counter()
+    result = simulate(config)
+    derived = time.perf_counter() - start
+
+    start = time.perf_counter()
+    simulated = {
+        stat: run_batch(
+            scenario_character(config, stat),
+            config.duration,
+            config.run_count,
+            config.enemy_count,
+            seed=config.seed,
+        ).average_dps
+        / result.base.average_dps
+        for stat in LINEAR_STATS
+    }
+    scenarios = time.perf_counter() - start
+
+    print(
+        f"stat_weights {derived:.2f} s, the {len(LINEAR_STATS)} simulated "
+        + f"scenarios would add {scenarios:.2f} s"
+    )
+    print(f"{'Stat':<12}{'Derived':>12}{'Simulated':>12}")
+    for stat in LINEAR_STATS:
+        print(
+            f"{stat:<12}{result.stat_weights[stat]:>12.6f}"
+            + f"{simulated[stat]:>12.6f}"
+        )
+
+
+def allocations(arguments: argparse.Namespace) -> None:
+    """Measures the memory allocated by iterations with and without
+    pooling, with `tracemalloc` and the cyclic garbage collector disabled.
+
+    Pooled iterations must retain less than a byte per simulated second,
+    measured after warming up over at least 20 iterations.
+    """
+
+    # Imported lazily, the startup benchmark must not pay for the engine.
+    import gc
+    import random
+    import tracemalloc
+    from copy import deepcopy
+
+    # `Sim` first, it imports `base` before `characters.Rime`.
+    from Sim import Simulation
+    from characters.Rime.build import build_character
+    from codegen import specialize
+    from snapshot import deterministic_prefix
+
+    duration = 120
+    # Enough traced iterations that a few stray bytes pass the check.
+    traced = max(arguments.repeat, 20)
+    print(
+        f"{'Build':<22}{'Engine':<13}{'Mode':<8}{'Time (ms)':>10}"
+        + f"{'Retained (B/s)':>16}{'Peak (KiB)':>12}"
+    )
+    for talent_tree, enemy_count in (("2-12-3", 3), ("123-123-123", 12)):
+        character = build_character(talent_tree=talent_tree)
+        for engine in ("generic", "specialized"):
+            simulation_class = (
+                specialize(character, enemy_count)
+                if engine == "specialized"
+                else Simulation
+            )
+            rng = random.Random(0)
+
+            def new_simulation() -> Simulation:
+                return simulation_class(
+                    deepcopy(character),
+                    duration,
+                    enemy_count,
+                    do_debug=False,
+                    rng=rng,
+                )
+
+            # The iterations of `run_batch`, forked from the prefix.
+            prefix = deterministic_prefix(new_simulation())
+            pool = new_simulation()
+            for mode in ("copied", "pooled"):
+
+                def iteration() -> float:
+                    sim = pool if mode == "pooled" else new_simulation()
+                    sim.restore(prefix, restore_rng=False)
+                    return sim.resume()
+
+                # Fills the caches and grows the lists to their size.
+                for _ in range(20):
+                    iteration()
+
+                start = time.perf_counter()
+                for _ in range(arguments.repeat):
+                    iteration()
+                milliseconds = (
+                    (time.perf_counter() - start) / arguments.repeat * 1000
+                )
+
+                gc.disable()
+                tracemalloc.start()
+                try:
+                    # Allocations of the first traced iterations, e.g. of
+                    # the traces themselves, are not retained by them.
+                    for _ in range(20):
+                        iteration()
+                    before, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    for _ in range(traced):
+                        iteration()
+                    after, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                    gc.enable()
+
+                retained = (after - before) / (traced * duration)
+                print(
+                    f"{talent_tree:<22}{engine:<13}{mode:<8}"
+                    + f"{milliseconds:>10.2f}{retained:>16.2f}"
+                    + f"{(peak - before) / 1024:>12.1f}"
+                )
+                if mode == "pooled" and retained >= 1:
+                    raise AssertionError(
+                        f"Pooled iterations retain {retained:.2f} B per "
+                        + "simulated second."
+                    )
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    "startup": startup,
+    "codegen": codegen,
+    "tracing": tracing,
+    "estimate": estimate,
+    "aoe": aoe,
+    "spellbook": spellbook,
+    "fight": fight,
+    "weights": weights,
+    "allocations": allocations,
+}
+
+
+if __name__ == "__main__":
+    # Create parser for command line arguments.
+    parser = argparse.ArgumentParser(description="Benchmark the simulator.")
+
+    parser.add_argument(
+        "benchmark",
+        type=str,
+        help="Benchmark to run.",
+        choices=list(BENCHMARKS),
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=10,
+        help="Number of repetitions.",
+    )
+
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
@@ -1,4 +1,4 @@
 """Module for the Rime character."""
 
-from .spell import RimeSpell, RimeBuff
+from .spell import SPELLBOOK, RimeSpell, RimeBuff
 from .talent import RimeTalent
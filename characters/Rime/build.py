@@ -0,0 +1,101 @@
+"""Module for building Rime characters from simulation options."""
+
+from typing import List
+
+from base import Character
+from .preset import RimePreset
+from .spell import RimeSpell
+from .talent import RimeTalent
+
+# Spells casted in order.
+DEFAULT_ROTATION: List[RimeSpell] = [
+    RimeSpell.WRATH_OF_WINTER,
+    RimeSpell.ICE_BLITZ,
+    RimeSpell.DANCE_OF_SWALLOWS,
+    RimeSpell.COLD_SNAP,
+    RimeSpell.BURSTING_ICE,
+    RimeSpell.FREEZING_TORRENT,
+    RimeSpell.ICE_COMET,
+    RimeSpell.GLACIAL_BLAST,
+    RimeSpell.FROST_BOLT,
+]
+
+
+def parse_custom_character(custom_character: str) -> List[int]:
+    """Parses the `intellect-crit-expertise-haste-spirit` format."""
+
+    try:
+        stats = [int(stat) for stat in custom_character.split("-")]
+    except ValueError as e:
+        raise ValueError(
+            "Custom character must be formatted as "
+            + "intellect-crit-expertise-haste-spirit"
+        ) from e
+
+    if len(stats) != 5:
+        raise ValueError(
+            "Custom character must be formatted as "
+            + "intellect-crit-expertise-haste-spirit"
+        )
+    for stat in stats:
+        if stat < 0:
+            raise ValueError(
+                "All stats must be positive integers. "
+                + f"Invalid stat: {stat}"
+            )
+    return stats
+
+
+def parse_talent_tree(talent_tree: str) -> List[str]:
+    """Parses the talent tree argument into talent names.
+
+    e.g. Combination of "2-12-3" means Talent 1.2, 2.1, 2.2, 3.3
+    = Coalescing Ice, Unrelenting Ice, Icy Flow, Soulfrost Torrent
+    """
+
+    talent_names = []
+    if talent_tree:
+        talents = talent_tree.split("-")
+        for index, talent in enumerate(talents):
+            for i in talent:
+                rime_talent = RimeTalent.get_by_identifier(f"{index+1}.{i}")
+                if rime_talent:
+                    talent_names.append(rime_talent.value.name)
+    return talent_names
+
+
+def build_character(
+    preset: str = "",
+    custom_character: str = "",
+    talent_tree: str = "",
+) -> Character:
+    """Builds a character with talents and the default rotation."""
+
+    if preset and custom_character:
+        raise ValueError(
+            "Cannot provide both preset and custom character. "
+            + "Please provide only one."
+        )
+
+    if custom_character:
+        stats = parse_custom_character(custom_character)
+        character = Character(
+            intellect=stats[0],
+            crit=stats[1],
+            expertise=stats[2],
+            haste=stats[3],
+            spirit=stats[4],
+        )
+    else:
+        # Use preset if provided.
+        character = Character(
+            *RimePreset[preset or RimePreset.DEFAULT.name].value
+        )
+
+    for talent in parse_talent_tree(talent_tree):
+        character.add_talent(talent)
+
+    for spell in DEFAULT_ROTATION:
+        character.add_spell_to_rotation(spell)
+
+    return character
@@ -2,12 +2,13 @@
 
 from enum import Enum
 
-from base import Character
-
 
 class RimePreset(Enum):
-    """Enum for Rime's presets."""
+    """Enum for Rime's presets.
+
+    Every preset holds the stat points, in the `Character` argument order:
+    intellect, crit, expertise, haste, spirit. Presets are immutable, a new
+    character is built from them for every use.
+    """
 
-    DEFAULT = Character(
-        intellect=300, crit=90, expertise=160, haste=120, spirit=50
-    )
+    DEFAULT = (300, 90, 160, 120, 50)
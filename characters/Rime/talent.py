@@ -3,6 +3,8 @@
 from dataclasses import dataclass
 from enum import Enum
 
+from .spell import SPELLBOOK
+
 
 @dataclass
 class Talent:
@@ -12,18 +14,9 @@ class Talent:
     name: str
 
 
-class RimeTalent(Enum):
+class _RimeTalent(Enum):
     """Enum for Rime's talents."""
 
-    CHILLBLAIN = Talent("1.1", "Chillblain")
-    COALESCING_ICE = Talent("1.2", "Coalescing Ice")
-    GLACIAL_ASSAULT = Talent("1.3", "Glacial Assault")
-    UNRELENTING_ICE = Talent("2.1", "Unrelenting Ice")
-    ICY_FLOW = Talent("2.2", "Icy Flow")
-    AVALANCHE = Talent("3.1", "Avalanche")
-    WISDOM_OF_THE_NORTH = Talent("3.2", "Wisdom of the North")
-    SOULFROST_TORRENT = Talent("3.3", "Soulfrost Torrent")
-
     @classmethod
     def get_by_identifier(cls, identifier: str):
         """Get a talent by its identifier."""
@@ -32,3 +25,14 @@ class RimeTalent(Enum):
             if talent.value.identifier == identifier:
                 return talent
         return None
+
+
+# Talents of the spellbook, e.g. RimeTalent.CHILLBLAIN.
+RimeTalent = _RimeTalent(
+    "RimeTalent",
+    [
+        (talent.key, Talent(talent.identifier, talent.name))
+        for talent in SPELLBOOK.talents
+    ],
+    module=__name__,
+)
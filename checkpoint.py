@@ -0,0 +1,139 @@
+"""Module for checkpoints of long simulations.
+
+A checkpoint holds the config, the resolved seed and the progress of a
+simulation. For serial runs that is the next iteration, the generator state
+and the aggregates of every scenario, for parallel runs the aggregates of
+every finished chunk. It is rewritten atomically at most every `interval`
+seconds, and a simulation resumed from it gives the same results as an
+uninterrupted one.
+"""
+
+import json
+import os
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from api import BatchResult, SimulationConfig
+
+# Seconds between checkpoint writes.
+CHECKPOINT_INTERVAL = 60.0
+# `serial` checkpoints scenarios, `chunks` the chunks of parallel backends.
+MODES = ("serial", "chunks")
+
+
+class Checkpoint:
+    """Progress of a simulation, saved to a local JSON file."""
+
+    def __init__(
+        self,
+        path: str,
+        config: SimulationConfig,
+        mode: str,
+        seed: Optional[int] = None,
+        interval: float = CHECKPOINT_INTERVAL,
+    ):
+        if mode not in MODES:
+            raise ValueError("Mode must be one of: " + ", ".join(MODES))
+        self.path = path
+        self.config = config
+        self.mode = mode
+        # Unseeded simulations get a seed, so a resumed run continues the
+        # same random numbers.
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.interval = interval
+        # Next iteration, generator state and partial result per scenario.
+        self.scenarios: Dict[str, Dict[str, Any]] = {}
+        # Partial result per finished chunk index.
+        self.chunks: Dict[int, Dict[str, Any]] = {}
+        self._saved = time.monotonic()
+
+    @classmethod
+    def open(
+        cls,
+        path: str,
+        config: SimulationConfig,
+        mode: str,
+        resume: bool = False,
+        interval: float = CHECKPOINT_INTERVAL,
+    ) -> "Checkpoint":
+        """Loads the checkpoint to resume, or starts a new one.
+
+        Raises ValueError if the checkpoint belongs to another config or
+        backend.
+        """
+
+        if not resume or not os.path.exists(path):
+            return cls(path, config, mode, config.seed, interval)
+
+        with open(path, encoding="utf-8") as checkpoint_file:
+            data = json.load(checkpoint_file)
+        if data["config"] != config.to_dict():
+            raise ValueError(f"{path} is a checkpoint of another config.")
+        if data["mode"] != mode:
+            raise ValueError(
+                f"{path} is a checkpoint of a {data['mode']} run, resume it "
+                + "with the same kind of backend."
+            )
+
+        checkpoint = cls(path, config, mode, data["seed"], interval)
+        checkpoint.scenarios = data["scenarios"]
+        checkpoint.chunks = {
+            int(index): partial for index, partial in data["chunks"].items()
+        }
+        return checkpoint
+
+    def scenario_state(
+        self, name: str
+    ) -> Optional[Tuple[int, random.Random, BatchResult]]:
+        """Returns the next iteration, generator and partial result of a
+        scenario, None if it has not started.
+        """
+
+        state = self.scenarios.get(name)
+        if state is None:
+            return None
+        version, internal, gauss_next = state["rng"]
+        rng = random.Random()
+        rng.setstate((version, tuple(internal), gauss_next))
+        return state["row"], rng, BatchResult.from_partial(state["batch"])
+
+    def set_scenario(
+        self, name: str, row: int, rng: random.Random, batch: BatchResult
+    ) -> None:
+        """Records the progress of a scenario."""
+
+        self.scenarios[name] = {
+            "row": row,
+            "rng": rng.getstate(),
+            "batch": batch.partial(),
+        }
+
+    def set_chunk(self, index: int, batch: BatchResult) -> None:
+        """Records a finished chunk."""
+
+        self.chunks[index] = batch.partial()
+
+    def update(self) -> None:
+        """Saves the checkpoint if the interval has elapsed."""
+
+        if time.monotonic() - self._saved >= self.interval:
+            self.save()
+
+    def save(self) -> None:
+        """Writes the checkpoint, replacing the file atomically."""
+
+        data = {
+            "config": self.config.to_dict(),
+            "mode": self.mode,
+            "seed": self.seed,
+            "scenarios": self.scenarios,
+            "chunks": self.chunks,
+        }
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(data, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary, self.path)
+        self._saved = time.monotonic()
@@ -0,0 +1,347 @@
+"""Sharded simulations over TCP, with a coordinator and any number of
+workers on any number of machines.
+
+The coordinator splits every config into the same (scenario, first
+iteration) shards as the parallel backends of `api.simulate`, with seed
+`seed + first iteration`, and hands them out to the workers that connect
+to it. Workers return the mergeable aggregates of each shard (DPS moments
+and histogram, spell damage, procs and timeline), which the coordinator
+merges in shard order, so results are identical to
+`simulate(config, backend="processes")` with the same seed.
+
+Shards of a worker that disconnects are handed out again, as are shards
+not returned within the shard timeout, the first returned result wins.
+
+Messages are newline delimited JSON:
+- worker: `{"type": "ready"}` once connected, then
+  `{"type": "result", "shard": <id>, "batch": <partial>}` per shard.
+- coordinator: `{"type": "shard", "shard": <id>, "config": <options>,
+  "stat": <stat>, "start": <first iteration>, "seed": <seed>}` or
+  `{"type": "done"}` once every shard is finished.
+
+Usage:
+    python cluster.py coordinator --config sweep.json --port 8766
+    python cluster.py worker --host <coordinator> --port 8766 -w 4
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Sequence
+
+from api import (
+    BatchResult,
+    Result,
+    SimulationConfig,
+    config_chunks,
+    run_chunk,
+)
+
+# Seconds after which the shard of a silent worker is handed out again.
+SHARD_TIMEOUT = 300.0
+# Seconds between checks of idle workers for new or expired shards.
+POLL_INTERVAL = 0.05
+# Partial results with timelines are larger than the default line limit.
+LINE_LIMIT = 2**26
+
+
+class Shard(NamedTuple):
+    """Iterations of a scenario of a config."""
+
+    config: int
+    scenario: str
+    stat: Optional[str]
+    start: int
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    """Returns a message as a JSON line."""
+
+    return json.dumps(message).encode() + b"\n"
+
+
+class Coordinator:
+    """Hands out the shards of configs and merges their results."""
+
+    def __init__(
+        self,
+        configs: Sequence[SimulationConfig],
+        shard_timeout: float = SHARD_TIMEOUT,
+    ):
+        for config in configs:
+            config.validate()
+            if (
+                config.keep_iterations
+                or config.trace_every
+                or config.trace_extremes
+            ):
+                raise ValueError("Sharded runs keep no iterations or traces.")
+
+        self.configs = list(configs)
+        self.shard_timeout = shard_timeout
+        self.seeds = [
+            config.seed if config.seed is not None else random.randrange(2**32)
+            for config in self.configs
+        ]
+        self.shards = [
+            Shard(index, name, stat, start)
+            for index, config in enumerate(self.configs)
+            for name, stat, start in config_chunks(config)
+        ]
+        self.partials: Dict[int, BatchResult] = {}
+        self.pending: Deque[int] = deque(range(len(self.shards)))
+        # Deadline of every handed out, unfinished shard.
+        self.leases: Dict[int, float] = {}
+        self.finished = asyncio.Event()
+        self.port: Optional[int] = None
+        if not self.shards:
+            self.finished.set()
+
+    def _next_shard(self) -> Optional[int]:
+        """Returns the next shard to hand out, None if none is available."""
+
+        while self.pending:
+            shard = self.pending.popleft()
+            if shard not in self.partials:
+                return shard
+
+        now = time.monotonic()
+        for shard, deadline in self.leases.items():
+            if deadline < now and shard not in self.partials:
+                return shard
+        return None
+
+    def _message(self, shard: int) -> Dict[str, Any]:
+        """Returns the message handing out a shard."""
+
+        index, _, stat, start = self.shards[shard]
+        return {
+            "type": "shard",
+            "shard": shard,
+            "config": self.configs[index].to_dict(),
+            "stat": stat,
+            "start": start,
+            "seed": self.seeds[index],
+        }
+
+    def _add_partial(self, shard: int, data: Dict[str, Any]) -> None:
+        """Stores the result of a shard, the first one wins."""
+
+        self.leases.pop(shard, None)
+        if shard in self.partials:
+            return
+        self.partials[shard] = BatchResult.from_partial(data)
+        if len(self.partials) == len(self.shards):
+            self.finished.set()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serves a worker until every shard is finished."""
+
+        leased: List[int] = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message["type"] == "result":
+                    self._add_partial(message["shard"], message["batch"])
+
+                shard = self._next_shard()
+                while shard is None and not self.finished.is_set():
+                    await asyncio.sleep(POLL_INTERVAL)
+                    shard = self._next_shard()
+                if shard is None:
+                    writer.write(_encode({"type": "done"}))
+                    await writer.drain()
+                    break
+
+                self.leases[shard] = time.monotonic() + self.shard_timeout
+                leased.append(shard)
+                writer.write(_encode(self._message(shard)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            # Shards of a lost worker are handed out again first.
+            for shard in reversed(leased):
+                if shard not in self.partials:
+                    self.leases.pop(shard, None)
+                    self.pending.appendleft(shard)
+            writer.close()
+
+    async def run(
+        self, host: str = "127.0.0.1", port: int = 0
+    ) -> List[Result]:
+        """Serves workers until every shard is finished, returns the result
+        of every config. The bound port is stored in `port`.
+        """
+
+        server = await asyncio.start_server(
+            self.handle, host, port, limit=LINE_LIMIT
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        try:
+            await self.finished.wait()
+            # Lets idle workers receive `done` before the server closes.
+            await asyncio.sleep(2 * POLL_INTERVAL)
+        finally:
+            server.close()
+        return self.results()
+
+    def results(self) -> List[Result]:
+        """Merges the shard results in shard order."""
+
+        batches: List[Dict[str, BatchResult]] = [
+            {name: BatchResult() for name, _ in config.scenarios()}
+            for config in self.configs
+        ]
+        for shard, (index, name, _, _) in enumerate(self.shards):
+            batches[index][name].merge(self.partials[shard])
+        return [
+            Result(config, config_batches)
+            for config, config_batches in zip(self.configs, batches)
+        ]
+
+
+def work(host: str, port: int, connect_timeout: float = 30.0) -> int:
+    """Runs shards of a coordinator until it is done or gone.
+
+    Retries connecting for `connect_timeout` seconds, so workers can start
+    before the coordinator. Returns the number of shards run.
+    """
+
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            connection = socket.create_connection((host, port))
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+    shards = 0
+    with connection, connection.makefile("rwb") as stream:
+        try:
+            stream.write(_encode({"type": "ready"}))
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if message["type"] == "done":
+                    break
+
+                batch = run_chunk(
+                    SimulationConfig.from_dict(message["config"]),
+                    message["stat"],
+                    message["start"],
+                    message["seed"],
+                    slot=0,
+                )
+                stream.write(
+                    _encode(
+                        {
+                            "type": "result",
+                            "shard": message["shard"],
+                            "batch": batch.partial(),
+                        }
+                    )
+                )
+                stream.flush()
+                shards += 1
+        except ConnectionError:
+            # The coordinator finished without this worker.
+            pass
+    return shards
+
+
+def _work_process(host: str, port: int) -> None:
+    """Entry point of a local worker process."""
+
+    work(host, port)
+
+
+def read_configs(path: str) -> List[SimulationConfig]:
+    """Reads a JSON file of one config or a list of configs."""
+
+    with open(path, encoding="utf-8") as config_file:
+        options = json.load(config_file)
+    if isinstance(options, dict):
+        options = [options]
+    return [SimulationConfig.from_dict(config) for config in options]
+
+
+if __name__ == "__main__":
+    # Create parser for command line arguments.
+    parser = argparse.ArgumentParser(description="Run sharded simulations.")
+
+    parser.add_argument(
+        "role",
+        type=str,
+        help="`coordinator` hands out the shards and prints the results, "
+        + "`worker` runs them.",
+        choices=["coordinator", "worker"],
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the coordinator listens on, or workers connect to.",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8766, help="Port of the coordinator."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="",
+        help="Coordinator: JSON file of a config or a list of configs, with "
+        + "the options of `api.SimulationConfig`.",
+    )
+    parser.add_argument(
+        "--shard-timeout",
+        type=float,
+        default=SHARD_TIMEOUT,
+        help="Coordinator: seconds after which an unfinished shard is handed "
+        + "out again.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker: number of worker processes to start.",
+    )
+
+    args = parser.parse_args()
+
+    if args.role == "coordinator":
+        if not args.config:
+            parser.error("The coordinator requires --config.")
+        coordinator = Coordinator(
+            read_configs(args.config), args.shard_timeout
+        )
+        results = asyncio.run(coordinator.run(args.host, args.port))
+        json.dump(
+            [result.to_dict() for result in results], sys.stdout, indent=2
+        )
+        print()
+    else:
+        # Imported lazily, only multi-process workers need it.
+        from multiprocessing import Process
+
+        processes = [
+            Process(target=_work_process, args=(args.host, args.port))
+            for _ in range(max(args.workers, 1))
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
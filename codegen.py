@@ -0,0 +1,500 @@
+"""Code generator for simulations specialized to one build.
+
+Talents, the enemy count (or fight profile) and the determinism flag are
+fixed for a whole batch, so most branches of `Simulation` are loop
+invariant. `specialize` emits a `Simulation` subclass for one build from
+the template below, with the branches of inactive talents removed and the
+per-hit lookup tables of the spellbook modifiers inlined as constants, and
+caches it by the build hash.
+
+The template lines between `#if FLAG`, `#else` and `#endif` are only kept
+if the flag is set, `$NAME` is replaced by a constant. The generated code
+draws random numbers in the same order as `Simulation`, so both give the
+same results for the same seed.
+"""
+
+import hashlib
+import json
+import threading
+from string import Template
+from typing import Dict, List, Optional, Tuple, Type
+
+from aoe import BATCH_TARGETS, draw_binomial, resolve_hits
+from base import Character
+from characters.Rime import SPELLBOOK
+from fight import FightProfile
+from Sim import Simulation
+
+TEMPLATE = '''
+class SpecializedSimulation(Simulation):
+    """Simulation specialized to the talents $TALENTS on $ENEMY_COUNT
+    enemies."""
+
+    records_events = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.recorder is not None:
+            raise ValueError("Specialized simulations record no events.")
+        # Rotation spells castable on the enemy count, and the ones that can
+        # go on cooldown at all, bound in `run`.
+        self._castable = []
+        self._ticking = []
+
+    def _do_damage(
+        self, spell, damage, anima_gained, orb_cost, is_cast=True
+    ):
+        name = spell.name
+        for buff in self.buffs:
+            multiplier = MULTIPLIERS.get(buff.name)
+            if multiplier is not None:
+                damage *= multiplier
+#if DAMAGE_ROLLS
+        rolls = DAMAGE_ROLLS.get(name)
+        if rolls is not None:
+            for chance, multiplier in rolls:
+                if self.rng.random() * 100 < chance:
+                    damage *= multiplier
+                    break
+#endif
+#if GLACIAL_ASSAULT
+        if name == "Cold Snap":
+            self.character.glacial_assault_buff.apply_debuff()
+            self.buffs.append(self.character.glacial_assault_buff)
+#endif
+#if COOLDOWN_REDUCTION
+        if name in COOLDOWN_TRIGGERS:
+            for spell_name, cooldown in COOLDOWN_REDUCTIONS:
+                for character_spell in self.character.rotation:
+                    if character_spell.name == spell_name:
+                        character_spell.update_cooldown(cooldown)
+#endif
+
+        crit_chance = self.character.crit + CRIT_BONUS.get(name, 0)
+#if PHASES
+        aoe_count = PHASE_AOE_COUNTS[self.enemy_count].get(name, 1)
+#else
+        aoe_count = AOE_COUNTS.get(name, 1)
+#endif
+#if BATCHED_HITS
+        if aoe_count > BATCH_TARGETS:
+            total, last, crits = resolve_hits(
+                self.rng, aoe_count, crit_chance, REDUCTIONS.get(name, 1.0)
+            )
+#if SOULFROST
+            for _ in range(
+                draw_binomial(self.rng, crits, SOULFROST_CHANCE / 100)
+            ):
+                self.proc_soulfrost()
+#endif
+            self.total_damage += damage * total
+            self._fill_damage_table(name, damage * total)
+            self.manage_mana_and_orbs(spell, anima_gained, orb_cost)
+            return
+#endif
+
+#if SECONDARY_REDUCTION
+        reduction = REDUCTIONS.get(name)
+#endif
+        for i in range(aoe_count):
+            if self.rng.random() * 100 < crit_chance:
+                damage *= 2
+#if SOULFROST
+                if self.rng.random() * 100 < SOULFROST_CHANCE:
+                    for buff in self.buffs:
+                        if buff.name == "Soulfrost Torrent":
+                            break
+                    else:
+                        self.proc_counts["Soulfrost Torrent"] += 1
+                        self.character.soulfrost_buff.apply_debuff()
+                        self.buffs.append(self.character.soulfrost_buff)
+#endif
+#if SECONDARY_REDUCTION
+            if i != 0 and reduction is not None:
+                damage *= reduction
+#endif
+            self.total_damage += damage
+            self._fill_damage_table(name, damage)
+
+        self.manage_mana_and_orbs(spell, anima_gained, orb_cost)
+
+    def manage_mana_and_orbs(self, spell, anima_gained, orb_cost):
+        character = self.character
+#if SINGLE_TARGET_MANA
+        mana = SINGLE_TARGET_MANA.get(spell.name)
+        if mana and self.enemy_count == 1:
+            character.mana += mana
+#endif
+        character.mana += anima_gained
+
+        if anima_gained >= 1:
+            for buff in self.buffs:
+                if buff.name in SPIKE_BUFFS:
+                    self._anima_spikes(int(anima_gained))
+
+        swallow_hits = SWALLOW_HITS.get(spell.name)
+        if swallow_hits:
+            self._push(self._dance_of_swallows, self.debuffs, swallow_hits, 0)
+        self._push(self._check_mana)
+
+        if orb_cost < 0:
+            self._gain_orb()
+        else:
+            self._lose_orb(orb_cost)
+
+    def _lose_orb(self, orb_cost):
+        character = self.character
+#if ORB_COOLDOWN_REDUCTION
+        for _ in range(orb_cost):
+            character.winter_orbs -= 1
+            for spell in character.rotation:
+                reduction = ORB_COOLDOWN_REDUCTIONS.get(spell.name)
+                if reduction is not None:
+                    spell.update_cooldown(reduction)
+#else
+        if orb_cost > 0:
+            character.winter_orbs -= orb_cost
+#endif
+        if orb_cost > 0 and self.rng.random() * 100 < character.spirit:
+            self.proc_counts["Spirit"] += orb_cost
+            for _ in range(orb_cost):
+                self._push(self._gain_orb)
+
+    def _update_time(self, delta_time):
+        self.time += delta_time
+        self.gcd -= delta_time
+#if PHASES
+        if self.time >= self._next_phase:
+            self._set_phase(self.fight.phase_at(self.time))
+#endif
+
+        for spell in self._ticking:
+            if spell.remaining_cooldown > 0:
+                spell.remaining_cooldown -= delta_time
+
+        self._process_debuffs(iter(self.debuffs), delta_time)
+
+    def _process_buffs(self, buffs, delta_time, resumed=None):
+        if resumed is not None and self._resolve_buff(
+            buffs, delta_time, resumed
+        ):
+            return
+
+        for buff in buffs:
+            if buff.remaining_debuff_duration > 0:
+                buff.remaining_debuff_duration -= delta_time
+            if (
+                buff.ticks > 0 or buff.remaining_debuff_duration <= 0
+            ) and self._resolve_buff(buffs, delta_time, buff):
+                return
+
+    def _next_spell(self):
+        orbs = self.character.winter_orbs
+        for spell in self._castable:
+            if spell.remaining_cooldown <= 0 and spell.winter_orb_cost <= orbs:
+                break
+        else:
+            self.update_time(0.1)
+            return None
+
+        cast_time = self.cast_time(spell)
+        gcd = self.gcd_duration()
+
+        for test_spell in self._ticking:
+            if spell.name == test_spell.name:
+                break
+
+            remaining_cooldown = test_spell.remaining_cooldown
+            if remaining_cooldown > 0 and (
+                (cast_time == 0 and remaining_cooldown < gcd)
+                or remaining_cooldown < cast_time
+            ):
+                self.update_time(remaining_cooldown)
+                return None
+
+        return spell
+
+    def start(self):
+        super().start()
+        character = self.character
+        # Other spells only go on cooldown when cast as a replacement.
+        self._ticking = [
+            spell
+            for spell in character.rotation
+            if any(
+                spell.min_target_count <= targets <= spell.max_target_count
+                for targets in TARGET_COUNTS
+            )
+            or spell is character.soulfrost
+            or spell is character.boosted_blast
+        ]
+        self._bind_targets()
+
+    def targets_changed(self):
+        super().targets_changed()
+        self._bind_targets()
+
+    def _bind_targets(self):
+        targets = self.enemy_count
+        self._castable = [
+            spell
+            for spell in self.character.rotation
+            if spell.min_target_count <= targets <= spell.max_target_count
+        ]
+
+    def step(self):
+        character = self.character
+
+        if self.gcd > 0:
+            self.update_time(self.gcd)
+#if PHASES
+
+        if not self.enemy_count:
+            self._wait_downtime()
+            return
+#endif
+
+        spell = self._select_spell()
+        if spell is None:
+            return
+
+        self.gcd = self.gcd_duration()
+
+        replaced = False
+
+        if spell.name == "Freezing Torrent" and self._count_buffs(
+            "Soulfrost Torrent"
+        ):
+            replaced = True
+            spell = character.soulfrost
+            self._remove_buffs("Soulfrost Torrent")
+#if GLACIAL_ASSAULT
+        elif spell.name == "Glacial Blast":
+            if (
+                self._count_buffs("Glacial Assault")
+                == $GLACIAL_ASSAULT_STACKS
+            ):
+                self._remove_buffs("Glacial Assault")
+                replaced = True
+                spell = character.boosted_blast
+#endif
+
+        self.update_time(0.01)
+
+        if spell.channeled:
+            if not replaced:
+                spell.set_cooldown()
+
+            for _ in range(spell.ticks):
+                self.do_damage(
+                    spell,
+                    self.spell_damage(spell) / spell.ticks,
+                    spell.mana_generation / spell.ticks,
+                    spell.winter_orb_cost,
+                )
+                self.update_time(self.cast_time(spell) / spell.ticks)
+
+        elif spell.is_debuff:
+            self.update_time(self.cast_time(spell))
+            spell.apply_debuff()
+            if spell.winter_orb_cost > 0:
+                self.lose_orb(spell.winter_orb_cost)
+            if spell.ticks > 0:
+                spell.next_tick_time = (
+                    self.time + spell.debuff_duration / spell.ticks
+                )
+            self.debuffs.append(spell)
+
+            if not replaced:
+                spell.set_cooldown()
+
+        elif spell.is_buff:
+            self.update_time(self.cast_time(spell))
+            spell.apply_debuff()
+            if spell.ticks > 0:
+                spell.next_tick_time = (
+                    self.time + spell.debuff_duration / spell.ticks
+                )
+            self.buffs.append(spell)
+
+            haste = BUFF_HASTE.get(spell.name)
+            if haste:
+                character.haste += haste
+
+            if not replaced:
+                spell.set_cooldown()
+        else:
+            self.update_time(self.cast_time(spell))
+            self.do_damage(
+                spell,
+                self.spell_damage(spell),
+                spell.mana_generation,
+                spell.winter_orb_cost,
+            )
+
+            if not replaced:
+                spell.set_cooldown()
+'''
+
+# Generated classes, keyed by the build hash.
+_cache: Dict[str, Type[Simulation]] = {}
+_cache_lock = threading.Lock()
+
+
+def build_key(
+    character: Character,
+    enemy_count: int,
+    is_deterministic: bool = False,
+    fight: Optional[FightProfile] = None,
+) -> str:
+    """Returns the hash of everything a specialized simulation depends on."""
+
+    build = {
+        "talents": sorted(set(character.talents)),
+        "enemy_count": enemy_count,
+        "is_deterministic": is_deterministic,
+        "spellbook": SPELLBOOK.digest,
+        "fight": fight.spec if fight is not None else "",
+    }
+    encoded = json.dumps(build, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _preprocess(template: str, flags: Dict[str, bool]) -> str:
+    """Keeps the template lines of the enabled `#if` blocks."""
+
+    lines = []
+    # Whether the enclosing blocks are kept, one entry per open `#if`.
+    stack: List[Tuple[bool, bool]] = []
+    for line in template.splitlines():
+        directive = line.strip()
+        if directive.startswith("#if "):
+            enclosing = all(kept for kept, _ in stack)
+            flag = flags[directive[4:].strip()]
+            stack.append((enclosing and flag, enclosing and not flag))
+        elif directive == "#else":
+            _, otherwise = stack.pop()
+            stack.append((otherwise, False))
+        elif directive == "#endif":
+            stack.pop()
+        elif all(kept for kept, _ in stack):
+            lines.append(line)
+
+    if stack:
+        raise ValueError("Unterminated #if block in template.")
+    return "\n".join(lines)
+
+
+def generate_source(
+    character: Character,
+    enemy_count: int,
+    is_deterministic: bool = False,
+    fight: Optional[FightProfile] = None,
+) -> Tuple[str, Dict]:
+    """Returns the source of the specialized class and its constants.
+
+    With a `fight` profile, the class handles every target count of the
+    fight instead of `enemy_count`.
+    """
+
+    talents = set(character.talents)
+    modifiers = SPELLBOOK.resolve(talents)
+    target_counts = (
+        fight.target_counts if fight is not None else (enemy_count,)
+    )
+    flags = {
+        "DAMAGE_ROLLS": bool(modifiers.damage_rolls),
+        "GLACIAL_ASSAULT": modifiers.glacial_assault_stacks > 0,
+        "ORB_COOLDOWN_REDUCTION": bool(modifiers.orb_cooldown_reductions),
+        "SOULFROST": modifiers.soulfrost_chance > 0,
+        "SECONDARY_REDUCTION": bool(modifiers.secondary_target_damage),
+        "COOLDOWN_REDUCTION": bool(modifiers.hit_cooldown_reductions),
+        "SINGLE_TARGET_MANA": (
+            bool(modifiers.single_target_mana) and 1 in target_counts
+        ),
+        "BATCHED_HITS": max(target_counts) > BATCH_TARGETS,
+        "PHASES": fight is not None and len(fight.starts) > 1,
+    }
+
+    aoe_counts = {
+        targets: {
+            name: modifiers.aoe_count(name, targets)
+            for name in SPELLBOOK.names
+        }
+        for targets in target_counts
+    }
+    constants = {
+        "MULTIPLIERS": dict(modifiers.buff_damage),
+        "BUFF_HASTE": dict(modifiers.buff_haste),
+        "DAMAGE_ROLLS": dict(modifiers.damage_rolls),
+        # Targets hit by every spell, on the first and on every target
+        # count.
+        "AOE_COUNTS": aoe_counts[target_counts[0]],
+        "PHASE_AOE_COUNTS": aoe_counts,
+        "TARGET_COUNTS": target_counts,
+        "CRIT_BONUS": (
+            dict(modifiers.crit_bonus) if not is_deterministic else {}
+        ),
+        "COOLDOWN_TRIGGERS": modifiers.cooldown_triggers,
+        "COOLDOWN_REDUCTIONS": tuple(
+            modifiers.hit_cooldown_reductions.items()
+        ),
+        "ORB_COOLDOWN_REDUCTIONS": dict(modifiers.orb_cooldown_reductions),
+        "SINGLE_TARGET_MANA": dict(modifiers.single_target_mana),
+        "SWALLOW_HITS": dict(modifiers.swallow_hits),
+        "SPIKE_BUFFS": modifiers.spike_buffs,
+        "SOULFROST_CHANCE": modifiers.soulfrost_chance,
+        # Multiplier of the damage carried to every secondary target.
+        "REDUCTIONS": dict(modifiers.secondary_target_damage),
+    }
+
+    source = Template(_preprocess(TEMPLATE, flags)).substitute(
+        TALENTS=", ".join(sorted(talents)) or "none",
+        ENEMY_COUNT="/".join(str(targets) for targets in target_counts),
+        GLACIAL_ASSAULT_STACKS=modifiers.glacial_assault_stacks,
+    )
+    return source, constants
+
+
+def specialize(
+    character: Character,
+    enemy_count: int,
+    is_deterministic: bool = False,
+    fight: Optional[FightProfile] = None,
+) -> Type[Simulation]:
+    """Returns the (cached) simulation class specialized to the build."""
+
+    key = build_key(character, enemy_count, is_deterministic, fight)
+    with _cache_lock:
+        simulation_class = _cache.get(key)
+        if simulation_class is None:
+            simulation_class = _generate(
+                key, character, enemy_count, is_deterministic, fight
+            )
+            _cache[key] = simulation_class
+    return simulation_class
+
+
+def _generate(
+    key: str,
+    character: Character,
+    enemy_count: int,
+    is_deterministic: bool,
+    fight: Optional[FightProfile],
+) -> Type[Simulation]:
+    """Compiles the specialized simulation class of the build."""
+
+    source, constants = generate_source(
+        character, enemy_count, is_deterministic, fight
+    )
+    namespace = {
+        "Simulation": Simulation,
+        "BATCH_TARGETS": BATCH_TARGETS,
+        "draw_binomial": draw_binomial,
+        "resolve_hits": resolve_hits,
+        **constants,
+    }
+    exec(  # pylint: disable=exec-used
+        compile(source, f"<specialized {key[:12]}>", "exec"), namespace
+    )
+    return namespace["SpecializedSimulation"]
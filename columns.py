@@ -0,0 +1,134 @@
+"""Module for columnar result files.
+
+Columns of doubles are written as an uncompressed `.npz` file, a zip of
+`.npy` arrays that NumPy loads with `numpy.load`. The file is written
+without NumPy. `ColumnFile` memory-maps it and returns every column as a
+zero-copy view into the mapping, so millions of iterations load without a
+parse step.
+"""
+
+import ast
+import mmap
+import struct
+import zipfile
+from typing import Dict, List, Mapping
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# Offset of the name and extra field lengths in a zip local file header.
+_LOCAL_HEADER_LENGTHS = 26
+_LOCAL_HEADER_SIZE = 30
+
+
+def _npy_header(length: int) -> bytes:
+    """Returns the `.npy` header of a little-endian double vector."""
+
+    header = (
+        "{'descr': '<f8', 'fortran_order': False, "
+        + f"'shape': ({length},), }}"
+    )
+    # The data starts at a multiple of 64 bytes, the header ends with \n.
+    padding = -(len(_NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    return _NPY_MAGIC + struct.pack("<H", len(header)) + header
+
+
+def write_npz(path: str, columns: Mapping[str, memoryview]) -> None:
+    """Writes double columns, e.g. `ResultSink` views, to a `.npz` file."""
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        for name, column in columns.items():
+            data = memoryview(column).cast("B")
+            with archive.open(
+                f"{name}.npy", "w", force_zip64=data.nbytes > 2**31
+            ) as member:
+                member.write(_npy_header(data.nbytes // 8))
+                member.write(data)
+
+
+class ColumnFile:
+    """Memory-mapped reader of a `write_npz` file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets: Dict[str, tuple] = {}
+
+        with zipfile.ZipFile(path) as archive:
+            infos = archive.infolist()
+
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        for info in infos:
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Column {info.filename} is compressed.")
+            name_length, extra_length = struct.unpack_from(
+                "<HH", self._mmap, info.header_offset + _LOCAL_HEADER_LENGTHS
+            )
+            start = (
+                info.header_offset
+                + _LOCAL_HEADER_SIZE
+                + name_length
+                + extra_length
+            )
+            self._offsets[info.filename[: -len(".npy")]] = self._column(
+                start, info.file_size
+            )
+        self._views: List[memoryview] = []
+
+    def _column(self, start: int, size: int) -> tuple:
+        """Returns the data offset and length of a `.npy` member."""
+
+        if self._mmap[start : start + len(_NPY_MAGIC)] != _NPY_MAGIC:
+            raise ValueError("Only version 1.0 .npy columns are supported.")
+        (header_length,) = struct.unpack_from(
+            "<H", self._mmap, start + len(_NPY_MAGIC)
+        )
+        header_start = start + len(_NPY_MAGIC) + 2
+        header = ast.literal_eval(
+            self._mmap[header_start : header_start + header_length].decode(
+                "latin1"
+            )
+        )
+        if header["descr"] != "<f8" or len(header["shape"]) != 1:
+            raise ValueError("Only double vectors are supported.")
+        data_start = header_start + header_length
+        return data_start, size - (data_start - start)
+
+    @property
+    def names(self) -> List[str]:
+        """Names of the columns."""
+
+        return list(self._offsets)
+
+    def __getitem__(self, name: str) -> memoryview:
+        """Returns a zero-copy view of the column."""
+
+        start, size = self._offsets[name]
+        view = memoryview(self._mmap)[start : start + size].cast("d")
+        self._views.append(view)
+        return view
+
+    def numpy(self, name: str):
+        """Returns the column as a zero-copy NumPy array."""
+
+        # Imported lazily, NumPy is optional.
+        import numpy
+
+        start, size = self._offsets[name]
+        return numpy.frombuffer(
+            self._mmap, dtype="<f8", count=size // 8, offset=start
+        )
+
+    def close(self) -> None:
+        """Releases the views and unmaps the file."""
+
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._mmap.close()
+
+    def __enter__(self) -> "ColumnFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,275 @@
+"""Module for paired comparisons of builds.
+
+Iteration i of every build draws from `Random(seed + i)`, so the builds
+share their random numbers per iteration and the per-iteration DPS
+differences are far less noisy than two independent runs. Iterations run
+in rounds, after each one an anytime-valid confidence sequence of the mean
+difference to the first build is checked. A build is resolved once its
+sequence excludes zero, or shows the difference is within the tolerance,
+and the comparison stops when every build is resolved.
+
+Usage:
+    python main.py -s compare -e 3 -t 2-12-3 --variant talent_tree=3-13-2
+"""
+
+import math
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence
+
+from api import BatchResult, SimulationConfig, run_batch
+from apl import compile_apl
+from sink import ResultSink
+
+# Options a variant can change, the other ones are shared by every build.
+VARIANT_OPTIONS = (
+    "talent_tree",
+    "preset",
+    "custom_character",
+    "apl",
+    "opener",
+)
+# Iterations the confidence sequence is tightest at.
+TUNING_RUNS = 1000
+
+
+def parse_variant(spec: str) -> Dict[str, str]:
+    """Returns the options of a `key=value;key=value` variant."""
+
+    options = {}
+    for item in spec.split(";"):
+        if not item.strip():
+            continue
+        key, separator, value = item.partition("=")
+        key = key.strip()
+        if not separator or key not in VARIANT_OPTIONS:
+            raise ValueError(
+                f"Invalid variant option {item!r}, options are: "
+                + ", ".join(VARIANT_OPTIONS)
+            )
+        options[key] = value.strip()
+    return options
+
+
+def confidence_radius(
+    count: int, variance: float, alpha: float, tuning_runs: int = TUNING_RUNS
+) -> float:
+    """Half width of the normal mixture confidence sequence of a mean.
+
+    The sequence holds at every count at once with probability 1 - alpha,
+    so it can be checked after every round.
+    """
+
+    if count < 2:
+        return math.inf
+    log_alpha = math.log(alpha)
+    rho2 = (-2 * log_alpha + math.log(-2 * log_alpha + 1)) / tuning_runs
+    return math.sqrt(
+        variance
+        * 2
+        * (count * rho2 + 1)
+        / (count**2 * rho2)
+        * math.log(math.sqrt(count * rho2 + 1) / alpha)
+    )
+
+
+@dataclass
+class PairedDifference:
+    """Running DPS difference of a build to the first one."""
+
+    count: int = 0
+    mean: float = 0.0
+    # Sum of the squared deviations from the mean.
+    m2: float = 0.0
+    low: float = -math.inf
+    high: float = math.inf
+    # `better`, `worse` or `negligible` once resolved.
+    verdict: str = "unresolved"
+
+    @property
+    def variance(self) -> float:
+        """Sample variance of the differences."""
+
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def add(self, differences: Sequence[float]) -> None:
+        """Adds the differences of a round."""
+
+        count = len(differences)
+        if not count:
+            return
+        mean = math.fsum(differences) / count
+        m2 = math.fsum((value - mean) ** 2 for value in differences)
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def update(self, alpha: float, tolerance: float) -> None:
+        """Updates the interval and resolves the verdict if possible."""
+
+        radius = confidence_radius(self.count, self.variance, alpha)
+        self.low, self.high = self.mean - radius, self.mean + radius
+        if self.low > 0:
+            self.verdict = "better"
+        elif self.high < 0:
+            self.verdict = "worse"
+        elif -tolerance <= self.low and self.high <= tolerance:
+            self.verdict = "negligible"
+
+
+@dataclass
+class Comparison:
+    """Result of comparing builds to the first one."""
+
+    configs: List[SimulationConfig]
+    batches: List[BatchResult]
+    # Difference of every build but the first to the first one.
+    differences: List[PairedDifference] = field(default_factory=list)
+    alpha: float = 0.05
+    tolerance: float = 0.001
+
+    @property
+    def run_count(self) -> int:
+        """Iterations of the first build."""
+
+        return self.batches[0].run_count
+
+    def to_dict(self) -> Dict:
+        """Returns the comparison as plain, JSON serializable data."""
+
+        base_dps = self.batches[0].average_dps
+        return {
+            "alpha": self.alpha,
+            "tolerance": self.tolerance,
+            "run_count": self.run_count,
+            "builds": [
+                {
+                    "config": config.to_dict(),
+                    "run_count": batch.run_count,
+                    "average_dps": batch.average_dps,
+                }
+                for config, batch in zip(self.configs, self.batches)
+            ],
+            "differences": [
+                {
+                    "build": index + 1,
+                    "verdict": difference.verdict,
+                    "run_count": difference.count,
+                    "dps_difference": difference.mean,
+                    "confidence_interval": [difference.low, difference.high],
+                    "relative_difference": (
+                        difference.mean / base_dps if base_dps else 0.0
+                    ),
+                }
+                for index, difference in enumerate(self.differences)
+            ],
+        }
+
+
+def compare(
+    configs: Sequence[SimulationConfig],
+    alpha: float = 0.05,
+    tolerance: float = 0.001,
+    round_size: int = 100,
+) -> Comparison:
+    """Compares every config to the first one with common random numbers.
+
+    Runs rounds of `round_size` iterations until every difference is
+    resolved at level `alpha`, or the `run_count` of the first config is
+    reached. Differences within `tolerance` times the DPS of the first
+    build are negligible. Every config uses the duration, enemy count, fight
+    profile and seed of the first one.
+    """
+
+    if len(configs) < 2:
+        raise ValueError("Comparing requires at least two builds.")
+    if not 0 < alpha < 1:
+        raise ValueError("alpha must be between 0 and 1.")
+    if tolerance < 0:
+        raise ValueError("tolerance must not be negative.")
+    if round_size <= 0:
+        raise ValueError("round_size must be positive.")
+    for config in configs:
+        config.validate()
+
+    first = configs[0]
+    seed = first.seed if first.seed is not None else random.randrange(2**32)
+    characters = [config.character() for config in configs]
+    apls = [
+        compile_apl(config.apl) if config.apl else None for config in configs
+    ]
+    comparison = Comparison(
+        list(configs),
+        [BatchResult() for _ in configs],
+        [PairedDifference() for _ in configs[1:]],
+        alpha,
+        tolerance,
+    )
+    # Every difference is tested at alpha / (builds - 1), so all of them
+    # hold together with probability 1 - alpha.
+    pair_alpha = alpha / len(comparison.differences)
+
+    done = 0
+    while done < first.run_count:
+        active = [
+            index
+            for index, difference in enumerate(comparison.differences, 1)
+            if difference.verdict == "unresolved"
+        ]
+        if not active:
+            break
+
+        count = min(round_size, first.run_count - done)
+        dps: Dict[int, List[float]] = {}
+        for index in [0] + active:
+            with ResultSink(count) as sink:
+                batch = run_batch(
+                    characters[index],
+                    first.duration,
+                    count,
+                    first.enemy_count,
+                    seed=seed + done,
+                    apl=apls[index],
+                    engine=configs[index].engine,
+                    opener=configs[index].opener_spells(),
+                    sink=sink,
+                    reseed=True,
+                    fight=first.fight_profile(),
+                    pooled=configs[index].pooled,
+                )
+                dps[index] = list(sink.dps())
+            batch.iterations = None
+            comparison.batches[index].merge(batch)
+        done += count
+
+        absolute_tolerance = tolerance * comparison.batches[0].average_dps
+        for index in active:
+            difference = comparison.differences[index - 1]
+            difference.add(
+                [value - base for value, base in zip(dps[index], dps[0])]
+            )
+            difference.update(pair_alpha, absolute_tolerance)
+
+    return comparison
+
+
+def build_names(configs: Sequence[SimulationConfig]) -> List[str]:
+    """Returns short names of the builds, from the options they change."""
+
+    names = []
+    for index, config in enumerate(configs):
+        changed = [
+            f"{option}={getattr(config, option)}"
+            for option in VARIANT_OPTIONS
+            if option != "apl"
+            and getattr(config, option) != getattr(configs[0], option)
+        ]
+        if config.apl != configs[0].apl:
+            changed.append("apl")
+        names.append(
+            "A" if index == 0 else f"{chr(ord('A') + index)}: "
+            + (", ".join(changed) or "same options")
+        )
+    return names
@@ -0,0 +1,408 @@
+"""Module for binary combat-event logs.
+
+A recorder packs every combat event into a fixed-width record (time, event
+type, spell id, damage, orbs and mana) in a preallocated buffer, so
+recording costs a single `struct.pack_into`. Logs are saved with their
+spell names and read back through a memory map, for filtering, summaries
+and replaying the fight as the classic debug text.
+
+Usage:
+    python main.py -s debug_sim -e 3 --event-log fight.log
+    python events.py fight.log --summary
+    python events.py fight.log --type HIT --spell "Frost Bolt"
+"""
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+from enum import IntEnum
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+MAGIC = b"RIMELOG1"
+# time, damage, mana, spell id, orbs, event type.
+RECORD = struct.Struct("<dddHhB5x")
+_HEADER = struct.Struct("<II")
+
+
+class EventType(IntEnum):
+    """Types of combat events."""
+
+    # A fight starts, the damage field holds its duration.
+    START = 0
+    CAST = 1
+    # A spell hits or ticks, the damage field holds its damage on every
+    # target.
+    HIT = 2
+    TICK = 3
+    SPIKE = 4
+    ORB_GAINED = 5
+    ORB_SPENT = 6
+    ORB_CAPPED = 7
+    EXPIRED = 8
+    IDLE = 9
+    IDLE_APL = 10
+    WAIT = 11
+    WAIT_GCD = 12
+    WAIT_OPENER = 13
+    # A fight ends, the damage field holds its total damage.
+    END = 14
+    # A phase of the fight profile starts, the damage field holds its
+    # target count.
+    PHASE = 15
+    # A random number is drawn, the damage field holds the total damage so
+    # far. Only recorded by `golden` traces.
+    DRAW = 16
+
+
+class Event(NamedTuple):
+    """A decoded combat event."""
+
+    time: float
+    type: EventType
+    spell: str
+    damage: float
+    orbs: int
+    mana: float
+
+
+def format_event(event: Event, duration: float = 0) -> Optional[str]:
+    """Returns the debug text line of the event, None for START.
+
+    `duration` is the one of the fight, used for the DPS of END events.
+    """
+
+    time = f"Time {event.time:.2f}: "
+    match event.type:
+        case EventType.CAST:
+            return f"{time}Cast {event.spell}."
+        case EventType.HIT | EventType.TICK:
+            action = "hit" if event.type == EventType.HIT else "ticks"
+            return (
+                f"{time}Your {event.spell} {action} for "
+                + f"{event.damage:.2f} damage"
+            )
+        case EventType.SPIKE:
+            return (
+                f"{time}Cast {event.spell}, "
+                + f"dealing {event.damage:.2f} damage"
+            )
+        case EventType.ORB_GAINED:
+            return f"{time}Gained Orbs - Count: {event.orbs}"
+        case EventType.ORB_SPENT:
+            return f"{time}Used Orbs - Count: {event.orbs}"
+        case EventType.ORB_CAPPED:
+            return "Over capped on Orbs"
+        case EventType.EXPIRED:
+            return f"Removing {event.spell}"
+        case EventType.IDLE:
+            return f"{time}No ready spell available"
+        case EventType.IDLE_APL:
+            return f"{time}No APL action available"
+        case EventType.WAIT:
+            return f"Waiting for {event.spell}"
+        case EventType.WAIT_GCD:
+            return f"Waiting for {event.spell} (GCD Trigger)"
+        case EventType.WAIT_OPENER:
+            return f"{time}Waiting for opener {event.spell}"
+        case EventType.PHASE:
+            return f"{time}Phase with {event.damage:g} targets"
+        case EventType.DRAW:
+            return f"{time}Random draw at {event.damage:.2f} total damage"
+        case EventType.END:
+            dps = event.damage / duration if duration else 0.0
+            return f"Total Damage: {event.damage:.2f}, DPS: {dps:.2f}"
+    return None
+
+
+class EventLog:
+    """Read-only view of packed event records."""
+
+    def __init__(self, records: memoryview, spell_names: Sequence[str]):
+        self.records = records
+        self.spell_names = list(spell_names)
+        self._mmap: Optional[mmap.mmap] = None
+
+    @classmethod
+    def open(cls, path: str) -> "EventLog":
+        """Memory-maps a log saved by `EventRecorder.save`."""
+
+        with open(path, "rb") as file:
+            memory = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            log = cls._parse(memory, path)
+        except ValueError:
+            memory.close()
+            raise
+        log._mmap = memory
+        return log
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "EventLog":
+        """Reads a log from `EventRecorder.to_bytes` data."""
+
+        return cls._parse(data, "The data")
+
+    @classmethod
+    def _parse(cls, data, source: str) -> "EventLog":
+        """Reads the header of saved log data and views its records."""
+
+        if data[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{source} is not an event log.")
+        record_size, spell_count = _HEADER.unpack_from(data, len(MAGIC))
+        if record_size != RECORD.size:
+            raise ValueError(f"{source} has an unsupported record size.")
+
+        offset = len(MAGIC) + _HEADER.size
+        spell_names = []
+        for _ in range(spell_count):
+            (length,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            spell_names.append(
+                bytes(data[offset : offset + length]).decode("utf-8")
+            )
+            offset += length
+        offset += -offset % RECORD.size
+
+        count = (len(data) - offset) // RECORD.size
+        return cls(
+            memoryview(data)[offset : offset + count * RECORD.size],
+            spell_names,
+        )
+
+    def __len__(self) -> int:
+        return len(self.records) // RECORD.size
+
+    def __getitem__(self, index: int) -> Event:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Event index out of range.")
+        return self._decode(index * RECORD.size)
+
+    def _decode(self, offset: int) -> Event:
+        """Decodes the record at the byte offset."""
+
+        time, damage, mana, spell, orbs, event_type = RECORD.unpack_from(
+            self.records, offset
+        )
+        return Event(
+            time,
+            EventType(event_type),
+            self.spell_names[spell],
+            damage,
+            orbs,
+            mana,
+        )
+
+    def __iter__(self) -> Iterator[Event]:
+        for offset in range(0, len(self.records), RECORD.size):
+            yield self._decode(offset)
+
+    def filter(
+        self,
+        types: Optional[Sequence[EventType]] = None,
+        spell: Optional[str] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> Iterator[Event]:
+        """Yields the events matching every given criterion."""
+
+        for event in self:
+            if types is not None and event.type not in types:
+                continue
+            if spell is not None and event.spell != spell:
+                continue
+            if start is not None and event.time < start:
+                continue
+            if end is not None and event.time > end:
+                continue
+            yield event
+
+    def summary(self) -> Dict:
+        """Returns the event counts and the damage and casts per spell."""
+
+        events: Dict[str, int] = {}
+        damage: Dict[str, float] = {}
+        casts: Dict[str, int] = {}
+        fights = []
+        for event in self:
+            events[event.type.name] = events.get(event.type.name, 0) + 1
+            if event.type in (
+                EventType.HIT,
+                EventType.TICK,
+                EventType.SPIKE,
+            ):
+                damage[event.spell] = (
+                    damage.get(event.spell, 0) + event.damage
+                )
+            if event.type in (EventType.CAST, EventType.SPIKE):
+                casts[event.spell] = casts.get(event.spell, 0) + 1
+            if event.type == EventType.START:
+                fights.append({"duration": event.damage})
+            elif event.type == EventType.END and fights:
+                fights[-1]["total_damage"] = event.damage
+        return {
+            "fights": fights,
+            "events": events,
+            "damage": damage,
+            "casts": casts,
+        }
+
+    def lines(self) -> Iterator[str]:
+        """Replays the log as debug text."""
+
+        duration = 0.0
+        for event in self:
+            if event.type == EventType.START:
+                duration = event.damage
+            line = format_event(event, duration)
+            if line is not None:
+                yield line
+
+    def close(self) -> None:
+        """Releases the records and unmaps the file."""
+
+        self.records.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> "EventLog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class EventRecorder:
+    """Packs combat events into a preallocated, growing buffer.
+
+    With `echo=True` every event is also printed as debug text.
+    """
+
+    def __init__(self, capacity: int = 4096, echo: bool = False):
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0
+        self.echo = echo
+        # Spell id 0 is the empty name of events without a spell.
+        self.spell_names: List[str] = [""]
+        self.spell_ids: Dict[str, int] = {"": 0}
+        self._duration = 0.0
+
+    def record(
+        self,
+        event_type: EventType,
+        time: float,
+        spell: str = "",
+        damage: float = 0.0,
+        orbs: int = 0,
+        mana: float = 0.0,
+    ) -> None:
+        """Appends an event."""
+
+        spell_id = self.spell_ids.get(spell)
+        if spell_id is None:
+            spell_id = self.spell_ids[spell] = len(self.spell_names)
+            self.spell_names.append(spell)
+
+        offset = self.count * RECORD.size
+        if offset == len(self.buffer):
+            self.buffer.extend(bytes(len(self.buffer) or RECORD.size))
+        RECORD.pack_into(
+            self.buffer,
+            offset,
+            time,
+            damage,
+            mana,
+            spell_id,
+            orbs,
+            event_type,
+        )
+        self.count += 1
+
+        if self.echo:
+            if event_type == EventType.START:
+                self._duration = damage
+            line = format_event(
+                Event(time, event_type, spell, damage, orbs, mana),
+                self._duration,
+            )
+            if line is not None:
+                print(line)
+
+    def clear(self) -> None:
+        """Drops the recorded events, keeping the buffer."""
+
+        self.count = 0
+
+    def log(self) -> EventLog:
+        """Returns a view of the recorded events."""
+
+        return EventLog(
+            memoryview(self.buffer)[: self.count * RECORD.size],
+            self.spell_names,
+        )
+
+    def to_bytes(self) -> bytes:
+        """Returns the events and their spell names in the saved format."""
+
+        header = bytearray(MAGIC)
+        header += _HEADER.pack(RECORD.size, len(self.spell_names))
+        for name in self.spell_names:
+            encoded = name.encode("utf-8")
+            header += struct.pack("<H", len(encoded)) + encoded
+        # Records start at a multiple of the record size.
+        header += bytes(-len(header) % RECORD.size)
+        return bytes(header) + self.buffer[: self.count * RECORD.size]
+
+    def save(self, path: str) -> None:
+        """Writes the events and their spell names to a file."""
+
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+
+if __name__ == "__main__":
+    # Create parser for command line arguments.
+    parser = argparse.ArgumentParser(description="Read a combat-event log.")
+
+    parser.add_argument("log", type=str, help="Event log file.")
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Print the event counts and the damage per spell.",
+    )
+    parser.add_argument(
+        "--type",
+        type=str,
+        action="append",
+        help="Only show events of this type, can be repeated.",
+        choices=[event_type.name for event_type in EventType],
+    )
+    parser.add_argument(
+        "--spell", type=str, default=None, help="Only show this spell."
+    )
+
+    args = parser.parse_args()
+
+    with EventLog.open(args.log) as event_log:
+        if args.summary:
+            print(json.dumps(event_log.summary(), indent=2))
+            sys.exit()
+
+        types = [EventType[name] for name in args.type] if args.type else None
+        duration = 0.0
+        for event in event_log:
+            # Kept for the DPS of END events, even if START is filtered out.
+            if event.type == EventType.START:
+                duration = event.damage
+            if types is not None and event.type not in types:
+                continue
+            if args.spell is not None and event.spell != args.spell:
+                continue
+            text = format_event(event, duration)
+            if text is not None:
+                print(text)
@@ -0,0 +1,175 @@
+"""Module for expected-value DPS estimates.
+
+An expected-value simulation replaces every random roll with its
+expectation: crits multiply the damage by 1 + the crit chance, Ice Comet
+by the mean Avalanche multiplier, and the Soulfrost procs and Spirit
+refunds accumulate as fractional credit, paid out as whole procs and orbs
+once it reaches one. A build is estimated with a single pass in a few
+milliseconds, close to the mean of the full simulation, so it can rank
+candidates before they get a Monte Carlo budget.
+
+Usage:
+    python main.py -s estimate -e 3 -t 2-12-3
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple
+
+from api import STATS, Result, SimulationConfig, scenario_character
+from apl import compile_apl
+from base import Spell
+from Sim import Simulation
+
+
+class ExpectedSimulation(Simulation):
+    """Simulation with the expectation of every random roll."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Fractional Spirit refunds and Soulfrost procs not yet paid out.
+        self.spirit_credit = 0.0
+        self.soulfrost_credit = 0.0
+
+    def spirit_refunds(self, orb_cost: int) -> int:
+        """Adds the expected refunds and pays out the whole ones."""
+
+        chance = min(max(self.character.spirit, 0), 100) / 100
+        self.spirit_credit += orb_cost * chance
+        refunds = int(self.spirit_credit)
+        self.spirit_credit -= refunds
+        return refunds
+
+    def roll_multiplier(self, rolls: Sequence[Tuple[float, float]]) -> float:
+        """Returns the mean of the rolled damage multipliers, e.g. 1.436
+        for Avalanche."""
+
+        mean = 0.0
+        # Chance that no roll hit yet.
+        remaining = 1.0
+        for chance, multiplier in rolls:
+            hit = remaining * chance / 100
+            mean += hit * multiplier
+            remaining -= hit
+        return mean + remaining
+
+    def apply_critical_hit(self, spell: Spell, damage: float) -> float:
+        """Applies the expected crit damage and Soulfrost procs."""
+
+        chance = min(max(self.crit_chance(spell), 0), 100) / 100
+        self._add_soulfrost_credit(chance)
+        return damage * (1 + chance)
+
+    def apply_aoe_hits(
+        self, spell: Spell, damage: float, aoe_count: int
+    ) -> float:
+        """Deals the expected hits on every target, with the crits carried
+        to the next targets."""
+
+        chance = min(max(self.crit_chance(spell), 0), 100) / 100
+        reduction = self.aoe_damage_reduction(spell)
+        total = 0.0
+        for index in range(aoe_count):
+            damage *= (1 + chance) * (reduction if index else 1)
+            total += damage
+        self._add_soulfrost_credit(aoe_count * chance)
+        self.total_damage += total
+        self._fill_damage_table(spell.name, total)
+        return total
+
+    def _add_soulfrost_credit(self, crits: float) -> None:
+        """Adds the expected Soulfrost procs of `crits` expected crits and
+        pays out the whole ones."""
+
+        chance = self.modifiers.soulfrost_chance
+        if not chance:
+            return
+        self.soulfrost_credit += crits * chance / 100
+        while self.soulfrost_credit >= 1:
+            self.soulfrost_credit -= 1
+            self.proc_soulfrost()
+
+
+@dataclass
+class Estimate:
+    """Expected-value DPS of every scenario of a config."""
+
+    config: SimulationConfig
+    dps: Dict[str, float] = field(default_factory=dict)
+    damage_tables: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    # Wall time of the estimate.
+    seconds: float = 0.0
+
+    @property
+    def stat_weights(self) -> Dict[str, float]:
+        """Relative DPS gain of every stat, empty unless stat_weights."""
+
+        if self.config.simulation_type != "stat_weights":
+            return {}
+        base_dps = self.dps["base"]
+        linear = self.config.linear_stat_weights()
+        return {
+            stat: (
+                linear[stat]
+                if stat in linear
+                else 1 + (self.dps[stat] - base_dps) / base_dps
+            )
+            for stat in STATS
+        }
+
+    def errors(self, result: Result) -> Dict[str, Dict[str, float]]:
+        """Returns the error of every scenario against a full simulation
+        of the same config."""
+
+        errors = {}
+        for name, dps in self.dps.items():
+            simulated = result.batches[name].average_dps
+            errors[name] = {
+                "estimate": dps,
+                "simulated": simulated,
+                "error": dps - simulated,
+                "relative_error": (
+                    (dps - simulated) / simulated if simulated else 0.0
+                ),
+            }
+        return errors
+
+    def to_dict(self, result: Optional[Result] = None) -> Dict:
+        """Returns the estimate as plain, JSON serializable data, with its
+        errors against the full simulation `result` if given."""
+
+        data = {
+            "config": self.config.to_dict(),
+            "milliseconds": self.seconds * 1000,
+            "dps": self.dps,
+            "damage_tables": self.damage_tables,
+            "stat_weights": self.stat_weights,
+        }
+        if result is not None:
+            data["errors"] = self.errors(result)
+        return data
+
+
+def estimate(config: SimulationConfig) -> Estimate:
+    """Estimates the DPS of every scenario of the config with a single
+    expected-value pass each. The run count, seed and engine are unused.
+    """
+
+    config.validate()
+    start = time.perf_counter()
+    apl = compile_apl(config.apl) if config.apl else None
+    result = Estimate(config)
+    for name, stat in config.scenarios():
+        sim = ExpectedSimulation(
+            scenario_character(config, stat),
+            config.duration,
+            config.enemy_count,
+            do_debug=False,
+            apl=apl,
+            opener=config.opener_spells(),
+            fight=config.fight_profile(),
+        )
+        result.dps[name] = sim.run()
+        result.damage_tables[name] = dict(sim.damage_table)
+    result.seconds = time.perf_counter() - start
+    return result
@@ -0,0 +1,126 @@
+"""Module for fight profiles, the target count over the time of a fight.
+
+A profile is a list of phases, each with its start time in seconds and its
+target count, e.g. `0:1,30:5,45:1,90:0,100:1` for a single target fight
+with a wave of 4 adds from 30 to 45 seconds and downtime from 90 to 100
+seconds. Phases with 0 targets are downtime: nothing can be cast, damage
+over time hits nothing and the fight waits for the next phase.
+
+`parse_fight` compiles a profile into sorted arrays of the phase starts
+and target counts, and caches it by its text. Simulations keep the index
+of the current phase and the start of the next one, so a time update costs
+a single comparison, and the target dependent state is only rebuilt when a
+phase starts.
+"""
+
+import functools
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Tuple
+
+
+@dataclass(frozen=True)
+class FightProfile:
+    """Compiled fight profile, phases sorted by their start."""
+
+    # Normalized text of the profile.
+    spec: str
+    starts: Tuple[float, ...]
+    targets: Tuple[int, ...]
+
+    @property
+    def target_counts(self) -> Tuple[int, ...]:
+        """Returns every target count of the fight, in increasing order."""
+
+        return tuple(sorted(set(self.targets)))
+
+    def phase_at(self, time: float) -> int:
+        """Returns the index of the phase at the given time."""
+
+        return max(bisect_right(self.starts, time) - 1, 0)
+
+    def next_start(self, phase: int) -> float:
+        """Returns the start of the phase after `phase`, inf if none."""
+
+        if phase + 1 < len(self.starts):
+            return self.starts[phase + 1]
+        return float("inf")
+
+    def _durations(self, duration: float) -> Tuple[float, ...]:
+        """Returns the time spent in every phase of a fight of `duration`."""
+
+        return tuple(
+            max(min(self.next_start(phase), duration) - start, 0.0)
+            for phase, start in enumerate(self.starts)
+        )
+
+    def uptime(self, duration: float) -> float:
+        """Returns the share of the fight with at least one target."""
+
+        return (
+            sum(
+                time
+                for time, targets in zip(
+                    self._durations(duration), self.targets
+                )
+                if targets > 0
+            )
+            / duration
+        )
+
+    def mean_targets(self, duration: float) -> float:
+        """Returns the mean target count over a fight of `duration`."""
+
+        return (
+            sum(
+                time * targets
+                for time, targets in zip(
+                    self._durations(duration), self.targets
+                )
+            )
+            / duration
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def parse_fight(spec: str) -> FightProfile:
+    """Compiles a profile, e.g. `0:1,30:5,45:1`.
+
+    Raises ValueError if it is malformed.
+    """
+
+    phases = []
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        start, separator, targets = entry.partition(":")
+        try:
+            if not separator:
+                raise ValueError
+            phase = (float(start), int(targets))
+        except ValueError:
+            raise ValueError(
+                f"Fight phase `{entry.strip()}` must be `<start>:<targets>`."
+            ) from None
+        if phase[0] < 0 or phase[1] < 0:
+            raise ValueError(
+                f"Fight phase `{entry.strip()}` must not be negative."
+            )
+        phases.append(phase)
+
+    if not phases:
+        raise ValueError("Fight profile has no phases.")
+    phases.sort()
+    if phases[0][0] != 0:
+        raise ValueError("Fight profile must start with a phase at 0.")
+    for (start, _), (next_start, _) in zip(phases, phases[1:]):
+        if start == next_start:
+            raise ValueError(f"Fight profile has two phases at {start:g}.")
+    if not any(targets for _, targets in phases):
+        raise ValueError("Fight profile has no targets.")
+
+    return FightProfile(
+        spec=",".join(f"{start:g}:{targets}" for start, targets in phases),
+        starts=tuple(start for start, _ in phases),
+        targets=tuple(targets for _, targets in phases),
+    )
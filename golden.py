@@ -0,0 +1,585 @@
+"""Golden-trace equivalence checks of the simulation engines.
+
+Every scenario of SCENARIOS runs with a fixed seed on the reference
+engine, the generic `Simulation` without forking or pooling. The first
+iteration is recorded as a golden trace, its combat events interleaved
+with a DRAW event for every random number drawn, and the batch as its
+per-iteration DPS and its damage and proc totals. Traces are event logs,
+zlib-compressed, in the `golden` directory next to its `golden.json`
+manifest.
+
+`check` runs a candidate engine through the same scenarios and diffs it
+against the golden data: the trace event by event, reporting the first
+divergence, and the batch iteration by iteration. Engines that record no
+events (e.g. the specialized one) are diffed on the random draws of their
+trace and its total damage, which still pins every roll and its time.
+
+Engines that cannot draw their random numbers in the same order check
+with `--statistical` instead: the candidate runs every scenario with
+another seed, and its DPS is compared with the golden one by a test of
+equal means and a two-sample Kolmogorov-Smirnov test.
+
+Usage:
+    python golden.py record
+    python golden.py check --engine specialized --pooled
+    python golden.py check --engine specialized --statistical
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import zlib
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from api import ENGINES, BatchResult, SimulationConfig, run_batch
+from apl import compile_apl
+from characters.Rime import SPELLBOOK
+from codegen import specialize
+from events import Event, EventLog, EventRecorder, EventType, format_event
+from Sim import Simulation
+from sink import ResultSink
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(ROOT, "golden")
+MANIFEST = "golden.json"
+# Events compared for engines that record no events.
+DRAW_EVENTS = (EventType.DRAW, EventType.END)
+# Significance level of each statistical test.
+ALPHA = 0.001
+
+# Scenarios covering every talent, target count handling, openers, APLs
+# and fight profiles with downtime.
+SCENARIOS: Dict[str, SimulationConfig] = {
+    "single-target": SimulationConfig(seed=1, run_count=200),
+    "cleave": SimulationConfig(
+        enemy_count=3, talent_tree="2-12-3", seed=2, run_count=200
+    ),
+    "opener": SimulationConfig(
+        enemy_count=2,
+        talent_tree="3-13-2",
+        opener="wrath_of_winter,ice_blitz,cold_snap,bursting_ice",
+        seed=3,
+        run_count=200,
+    ),
+    "all-talents": SimulationConfig(
+        enemy_count=12, talent_tree="123-123-123", seed=4, run_count=200
+    ),
+    "fight": SimulationConfig(
+        talent_tree="1-23-1",
+        fight="0:1,30:5,45:1,90:0,100:12",
+        seed=5,
+        run_count=200,
+    ),
+    "apl-opener": SimulationConfig(
+        enemy_count=3,
+        talent_tree="3-13-2",
+        apl="\n".join(
+            (
+                "wrath_of_winter",
+                "ice_blitz",
+                "cold_snap",
+                "ice_comet,if=orbs>=3",
+                "bursting_ice",
+                "frost_bolt",
+            )
+        ),
+        opener="wrath_of_winter,ice_blitz,cold_snap",
+        seed=7,
+        run_count=200,
+    ),
+    "apl": SimulationConfig(
+        enemy_count=4,
+        talent_tree="2-12-3",
+        apl="\n".join(
+            (
+                "wrath_of_winter",
+                "ice_blitz,if=orbs>=2",
+                "dance_of_swallows,if=buff.ice_blitz|orbs>=4",
+                "ice_comet,if=orbs>=3&targets>=3",
+                "cold_snap,if=orbs<5",
+                "freezing_torrent,if=time>10",
+                "bursting_ice",
+                "frost_bolt",
+            )
+        ),
+        seed=6,
+        run_count=200,
+    ),
+}
+
+
+class _DrawRecorder(random.Random):
+    """Generator recording every number drawn by a simulation.
+
+    Both engines draw through `random`, also when they call `uniform`.
+    """
+
+    def __init__(self, seed: Optional[int], recorder: EventRecorder):
+        self.recorder = recorder
+        self.sim: Optional[Simulation] = None
+        super().__init__(seed)
+
+    def random(self) -> float:
+        sim = self.sim
+        self.recorder.record(
+            EventType.DRAW,
+            sim.time,
+            "",
+            sim.total_damage,
+            sim.character.winter_orbs,
+            sim.character.mana,
+        )
+        return super().random()
+
+
+@dataclass(frozen=True)
+class Divergence:
+    """First difference of a candidate trace from the golden one."""
+
+    index: int
+    expected: Optional[Event]
+    actual: Optional[Event]
+    # Duration of the fight, for the DPS of END events.
+    duration: float = 0
+
+    def _describe(self, event: Optional[Event]) -> str:
+        if event is None:
+            return "the end of the trace"
+        text = format_event(event, self.duration) or event.type.name
+        return (
+            f"`{text}` (time {event.time!r}, damage {event.damage!r}, "
+            + f"orbs {event.orbs}, mana {event.mana!r})"
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"event {self.index}: expected {self._describe(self.expected)}, "
+            + f"got {self._describe(self.actual)}"
+        )
+
+
+def simulation_class(
+    config: SimulationConfig, engine: str = "generic"
+) -> Type[Simulation]:
+    """Returns the simulation class `run_batch` uses for the engine."""
+
+    if engine == "specialized":
+        return specialize(
+            config.character(),
+            config.enemy_count,
+            fight=config.fight_profile(),
+        )
+    return Simulation
+
+
+def trace(
+    config: SimulationConfig, engine: str = "generic"
+) -> EventRecorder:
+    """Runs the first iteration of the scenario, and returns its trace.
+
+    Engines that record no events only trace their random draws and the
+    END event.
+    """
+
+    sim_class = simulation_class(config, engine)
+    recorder = EventRecorder()
+    rng = _DrawRecorder(config.seed, recorder)
+    sim = sim_class(
+        config.character(),
+        config.duration,
+        config.enemy_count,
+        do_debug=False,
+        apl=compile_apl(config.apl) if config.apl else None,
+        rng=rng,
+        opener=config.opener_spells(),
+        recorder=recorder if sim_class.records_events else None,
+        fight=config.fight_profile(),
+    )
+    rng.sim = sim
+    sim.run()
+    if not sim_class.records_events:
+        recorder.record(
+            EventType.END,
+            sim.time,
+            "",
+            sim.total_damage,
+            sim.character.winter_orbs,
+            sim.character.mana,
+        )
+    return recorder
+
+
+def cooldown_violations(
+    config: SimulationConfig, engine: str = "generic"
+) -> List[str]:
+    """Runs the first iteration of the scenario, and returns the spells
+    cast while on cooldown."""
+
+    violations: List[str] = []
+
+    class _Checked(simulation_class(config, engine)):  # type: ignore
+        def _select_spell(self):
+            spell = super()._select_spell()
+            if spell is not None and spell.remaining_cooldown > 0:
+                violations.append(
+                    f"{spell.name} cast at {self.time:.2f}s with "
+                    + f"{spell.remaining_cooldown:.2f}s of cooldown left"
+                )
+            return spell
+
+    _Checked(
+        config.character(),
+        config.duration,
+        config.enemy_count,
+        do_debug=False,
+        apl=compile_apl(config.apl) if config.apl else None,
+        rng=random.Random(config.seed),
+        opener=config.opener_spells(),
+        fight=config.fight_profile(),
+    ).run()
+    return violations
+
+
+def summary_differences(config: SimulationConfig) -> List[str]:
+    """Runs the first iteration of the scenario with an event recorder, and
+    returns the spells whose damage in the event summary differs from the
+    damage table."""
+
+    recorder = EventRecorder()
+    sim = Simulation(
+        config.character(),
+        config.duration,
+        config.enemy_count,
+        do_debug=False,
+        apl=compile_apl(config.apl) if config.apl else None,
+        rng=random.Random(config.seed),
+        opener=config.opener_spells(),
+        recorder=recorder,
+        fight=config.fight_profile(),
+    )
+    sim.run()
+    summary = recorder.log().summary()["damage"]
+    return [
+        f"summary damage of {spell}: {summary.get(spell, 0)!r}, damage "
+        + f"table {damage!r}"
+        for spell, damage in sim.damage_table.items()
+        if not math.isclose(summary.get(spell, 0), damage, rel_tol=1e-9)
+    ]
+
+
+def run_scenario(
+    config: SimulationConfig,
+    engine: str = "generic",
+    fork: bool = False,
+    pooled: bool = False,
+    seed: Optional[int] = None,
+) -> Tuple[List[float], BatchResult]:
+    """Runs the batch of the scenario, and returns its per-iteration DPS
+    and its result."""
+
+    with ResultSink(config.run_count) as sink:
+        batch = run_batch(
+            config.character(),
+            config.duration,
+            config.run_count,
+            config.enemy_count,
+            seed=config.seed if seed is None else seed,
+            apl=compile_apl(config.apl) if config.apl else None,
+            engine=engine,
+            opener=config.opener_spells(),
+            fork=fork,
+            sink=sink,
+            fight=config.fight_profile(),
+            pooled=pooled,
+        )
+        dps = list(sink.dps())
+    batch.iterations = None
+    return dps, batch
+
+
+def first_divergence(
+    expected: Iterable[Event], actual: Iterable[Event], duration: float = 0
+) -> Optional[Divergence]:
+    """Returns the first event the traces differ in, None if identical."""
+
+    for index, (want, got) in enumerate(zip_longest(expected, actual)):
+        if want != got:
+            return Divergence(index, want, got, duration)
+    return None
+
+
+def mean_p_value(expected: Sequence[float], actual: Sequence[float]) -> float:
+    """Returns the two-sided p-value of equal means of the samples, by the
+    normal approximation of Welch's t-test."""
+
+    error = math.sqrt(
+        statistics.variance(expected) / len(expected)
+        + statistics.variance(actual) / len(actual)
+    )
+    difference = abs(statistics.fmean(expected) - statistics.fmean(actual))
+    if not error:
+        return 1.0 if not difference else 0.0
+    return math.erfc(difference / error / math.sqrt(2))
+
+
+def ks_p_value(expected: Sequence[float], actual: Sequence[float]) -> float:
+    """Returns the asymptotic p-value of the two-sample Kolmogorov-Smirnov
+    test that the samples share their distribution."""
+
+    expected = sorted(expected)
+    actual = sorted(actual)
+    distance = 0.0
+    i = j = 0
+    while i < len(expected) and j < len(actual):
+        value = min(expected[i], actual[j])
+        while i < len(expected) and expected[i] == value:
+            i += 1
+        while j < len(actual) and actual[j] == value:
+            j += 1
+        distance = max(distance, abs(i / len(expected) - j / len(actual)))
+
+    count = len(expected) * len(actual) / (len(expected) + len(actual))
+    root = math.sqrt(count)
+    scale = (root + 0.12 + 0.11 / root) * distance
+    # The series converges too slowly below, where the p-value is ~1.
+    if scale < 0.2:
+        return 1.0
+    p_value = 2 * math.fsum(
+        (-1) ** (k - 1) * math.exp(-2 * k * k * scale * scale)
+        for k in range(1, 101)
+    )
+    return min(max(p_value, 0.0), 1.0)
+
+
+def _trace_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f"{name}.events.z")
+
+
+def record(directory: str = GOLDEN_DIR) -> None:
+    """Records the golden data of every scenario with the reference
+    engine."""
+
+    os.makedirs(directory, exist_ok=True)
+    manifest: Dict = {"spellbook": SPELLBOOK.digest, "scenarios": {}}
+    for name, config in SCENARIOS.items():
+        recorder = trace(config)
+        with open(_trace_path(directory, name), "wb") as file:
+            file.write(zlib.compress(recorder.to_bytes(), 9))
+
+        dps, batch = run_scenario(config)
+        manifest["scenarios"][name] = {
+            "config": config.to_dict(),
+            "events": recorder.count,
+            "dps": dps,
+            "damage_total": batch.damage_total,
+            "proc_total": batch.proc_total,
+        }
+        print(f"{name}: {recorder.count} events, {len(dps)} iterations")
+
+    with open(os.path.join(directory, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=1)
+        file.write("\n")
+
+
+def load(directory: str = GOLDEN_DIR) -> Dict:
+    """Returns the golden manifest, with the trace of every scenario under
+    `trace`.
+
+    Raises ValueError if it is out of date with the spellbook or the
+    scenarios.
+    """
+
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    if manifest["spellbook"] != SPELLBOOK.digest:
+        raise ValueError(
+            "The golden data predates the spellbook, record it again."
+        )
+    scenarios = manifest["scenarios"]
+    if {
+        name: scenario["config"] for name, scenario in scenarios.items()
+    } != {name: config.to_dict() for name, config in SCENARIOS.items()}:
+        raise ValueError(
+            "The golden data predates the scenarios, record it again."
+        )
+
+    for name, scenario in scenarios.items():
+        with open(_trace_path(directory, name), "rb") as file:
+            scenario["trace"] = EventLog.from_bytes(
+                zlib.decompress(file.read())
+            )
+    return manifest
+
+
+def _totals_differences(
+    name: str, expected: Dict[str, float], actual: Dict[str, float]
+) -> List[str]:
+    return [
+        f"{name} of {spell}: {actual.get(spell)!r}, golden "
+        + f"{expected.get(spell)!r}"
+        for spell in sorted(set(expected) | set(actual))
+        if expected.get(spell) != actual.get(spell)
+    ]
+
+
+def check_exact(
+    config: SimulationConfig,
+    golden: Dict,
+    engine: str,
+    pooled: bool = False,
+) -> List[str]:
+    """Returns the differences of the engine from the golden data of a
+    scenario and the spells it cast on cooldown, none if it reproduces it
+    exactly."""
+
+    log = trace(config, engine).log()
+    expected: Iterable[Event] = golden["trace"]
+    if not simulation_class(config, engine).records_events:
+        expected = golden["trace"].filter(types=DRAW_EVENTS)
+    divergence = first_divergence(expected, log, config.duration)
+    problems = (
+        [] if divergence is None else [f"trace diverges at {divergence}"]
+    )
+    problems += cooldown_violations(config, engine)
+    problems += summary_differences(config)
+
+    dps, batch = run_scenario(config, engine, fork=True, pooled=pooled)
+    for row, (want, got) in enumerate(zip_longest(golden["dps"], dps)):
+        if want != got:
+            problems.append(f"iteration {row}: DPS {got!r}, golden {want!r}")
+            break
+    problems += _totals_differences(
+        "damage", golden["damage_total"], batch.damage_total
+    )
+    problems += _totals_differences(
+        "procs", golden["proc_total"], batch.proc_total
+    )
+    return problems
+
+
+def check_statistical(
+    config: SimulationConfig,
+    golden: Dict,
+    engine: str,
+    pooled: bool = False,
+    alpha: float = ALPHA,
+) -> Tuple[List[str], float, float]:
+    """Compares the DPS of the engine, run with another seed, with the
+    golden one, and returns the failed tests and both p-values."""
+
+    dps, _ = run_scenario(
+        config, engine, fork=True, pooled=pooled, seed=config.seed + 1
+    )
+    mean = mean_p_value(golden["dps"], dps)
+    distribution = ks_p_value(golden["dps"], dps)
+    problems = []
+    if mean < alpha:
+        problems.append(f"mean DPS differs (p = {mean:.2g})")
+    if distribution < alpha:
+        problems.append(f"DPS distribution differs (p = {distribution:.2g})")
+    return problems, mean, distribution
+
+
+def check(
+    engine: str,
+    pooled: bool = False,
+    statistical: bool = False,
+    alpha: float = ALPHA,
+    directory: str = GOLDEN_DIR,
+) -> bool:
+    """Checks the engine against the golden data of every scenario, and
+    prints the outcome. Returns whether every scenario passed."""
+
+    manifest = load(directory)
+    passed = True
+    for name, config in SCENARIOS.items():
+        golden = manifest["scenarios"][name]
+        if statistical:
+            problems, mean, distribution = check_statistical(
+                config, golden, engine, pooled, alpha
+            )
+            outcome = (
+                f"mean p = {mean:.3f}, distribution p = {distribution:.3f}"
+            )
+        else:
+            problems = check_exact(config, golden, engine, pooled)
+            outcome = (
+                f"identical ({golden['events']} events, "
+                + f"{len(golden['dps'])} iterations)"
+            )
+        if problems:
+            passed = False
+            print(f"{name}: FAILED")
+            for problem in problems:
+                print(f"    {problem}")
+        else:
+            print(f"{name}: {outcome}")
+    return passed
+
+
+if __name__ == "__main__":
+    # Create parser for command line arguments.
+    parser = argparse.ArgumentParser(
+        description="Check engines against golden traces."
+    )
+
+    parser.add_argument(
+        "command",
+        type=str,
+        help="`record` writes the golden data with the reference engine, "
+        + "`check` compares an engine with it.",
+        choices=["record", "check"],
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="specialized",
+        help="Engine to check.",
+        choices=ENGINES,
+    )
+    parser.add_argument(
+        "--pooled",
+        action="store_true",
+        help="Check pooled batches.",
+    )
+    parser.add_argument(
+        "--statistical",
+        action="store_true",
+        help="Compare the DPS distributions with another seed instead of "
+        + "the exact traces, for engines drawing in another order.",
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=ALPHA,
+        help="Significance level of each statistical test.",
+    )
+    parser.add_argument(
+        "--golden-dir",
+        type=str,
+        default=GOLDEN_DIR,
+        help="Directory of the golden data.",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.golden_dir)
+    else:
+        try:
+            passed = check(
+                args.engine,
+                args.pooled,
+                args.statistical,
+                args.alpha,
+                args.golden_dir,
+            )
+        except (OSError, ValueError) as error:
+            parser.exit(1, f"{error}\n")
+        sys.exit(0 if passed else 1)
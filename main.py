@@ -1,33 +1,77 @@
 """Main file for simulating Character DPS."""
 
 import argparse
-from typing import Optional
-from copy import deepcopy
-from rich.table import Table, box
-from rich.console import Console
-from rich.progress import (
-    Progress,
-    BarColumn,
-    TextColumn,
-    TimeElapsedColumn,
-    TimeRemainingColumn,
-    MofNCompleteColumn,
-)
+import json
+import os
+from dataclasses import replace
+from typing import Any, Dict, Optional, Sequence, TYPE_CHECKING
 
+from api import BatchResult, Result, SimulationConfig, simulate
+from apl import compile_apl, spell_key
 from base import Character
-from characters.Rime import RimeSpell, RimeTalent
+from characters.Rime.build import build_character
 from characters.Rime.preset import RimePreset
+from compare import Comparison, build_names, compare, parse_variant
+from events import EventRecorder
+from expected import Estimate, estimate
+from fight import FightProfile
+from scaling import damage_percents
 from Sim import Simulation
 
+# `rich` is only imported when rendering, so `--output json` and `--quiet`
+# never load it.
+if TYPE_CHECKING:
+    from rich.table import Table
+
 
 def main(arguments: argparse.Namespace):
     """Main function."""
 
-    if arguments.preset and arguments.custom_character:
-        raise ValueError(
-            "Cannot provide both preset and custom character. "
-            + "Please provide only one."
-        )
+    # Validate the character options before rendering anything.
+    character = build_character(
+        preset=arguments.preset,
+        custom_character=arguments.custom_character,
+        talent_tree=arguments.talent_tree,
+    )
+    what_if = parse_what_if(arguments.what_if)
+
+    if arguments.output == "json":
+        if arguments.simulation_type == "debug_sim":
+            debug_sim(
+                character,
+                arguments.duration,
+                arguments.enemy_count,
+                read_apl(arguments.apl),
+                make_config(arguments).opener_spells(),
+                arguments.event_log,
+                make_config(arguments).fight_profile(),
+            )
+        elif arguments.simulation_type == "compare":
+            print(json.dumps(run_compare(arguments).to_dict(), indent=2))
+        elif arguments.simulation_type == "estimate":
+            config = replace(
+                make_config(arguments), simulation_type="average_dps"
+            )
+            result = simulate(config, **simulate_options(arguments))
+            save_outputs(result, arguments)
+            print(json.dumps(estimate(config).to_dict(result), indent=2))
+        else:
+            result = simulate(
+                make_config(arguments), **simulate_options(arguments)
+            )
+            save_outputs(result, arguments)
+            data = result.to_dict()
+            if what_if:
+                data["what_if_dps"] = result.base.what_if_dps(what_if)
+            print(json.dumps(data, indent=2))
+        return
+
+    if arguments.quiet:
+        print_plain(arguments, character, what_if)
+        return
+
+    from rich.console import Console
+    from rich.table import Table, box
 
     print()
 
@@ -40,6 +84,14 @@ def main(arguments: argparse.Namespace):
 
     table.add_row("Simulation Type", arguments.simulation_type)
     table.add_row("Enemy Count", str(arguments.enemy_count))
+    fight = make_config(arguments).fight_profile()
+    if fight is not None:
+        table.add_row(
+            "Fight",
+            f"{fight.spec}\n"
+            + f"{fight.mean_targets(arguments.duration):.2f} targets, "
+            + f"{fight.uptime(arguments.duration):.0%} uptime",
+        )
     table.add_row("Duration", str(arguments.duration))
     if arguments.simulation_type == "stat_weights":
         table.add_row("Stat Weights Gain", str(arguments.stat_weights_gain))
@@ -49,64 +101,6 @@ def main(arguments: argparse.Namespace):
         end_section=True,
     )
 
-    if arguments.custom_character:
-        try:
-            stats = [
-                int(stat) for stat in arguments.custom_character.split("-")
-            ]
-        except ValueError as e:
-            raise ValueError(
-                "Custom character must be formatted as "
-                + "intellect-crit-expertise-haste-spirit"
-            ) from e
-
-        if len(stats) != 5:
-            raise ValueError(
-                "Custom character must be formatted as "
-                + "intellect-crit-expertise-haste-spirit"
-            )
-        for stat in stats:
-            if stat < 0:
-                raise ValueError(
-                    "All stats must be positive integers. "
-                    + f"Invalid stat: {stat}"
-                )
-
-        character = Character(
-            intellect=stats[0],
-            crit=stats[1],
-            expertise=stats[2],
-            haste=stats[3],
-            spirit=stats[4],
-        )
-    elif arguments.preset:
-        # Use preset if provided.
-        character = RimePreset[arguments.preset].value
-    else:
-        character = RimePreset.DEFAULT.value
-
-    # Parse the talent tree argument.
-    # e.g. Combination of "2-12-3" means Talent 1.2, 2.1, 2.2, 3.3
-    # = Coalescing Ice, Unrelenting Ice, Icy Flow, Soulfrost Torrent
-    if arguments.talent_tree:
-        talents = arguments.talent_tree.split("-")
-        for index, talent in enumerate(talents):
-            for i in talent:
-                rime_talent = RimeTalent.get_by_identifier(f"{index+1}.{i}")
-                if rime_talent:
-                    character.add_talent(rime_talent.value.name)
-
-    # Spells casted in order.
-    character.add_spell_to_rotation(RimeSpell.WRATH_OF_WINTER)
-    character.add_spell_to_rotation(RimeSpell.ICE_BLITZ)
-    character.add_spell_to_rotation(RimeSpell.DANCE_OF_SWALLOWS)
-    character.add_spell_to_rotation(RimeSpell.COLD_SNAP)
-    character.add_spell_to_rotation(RimeSpell.BURSTING_ICE)
-    character.add_spell_to_rotation(RimeSpell.FREEZING_TORRENT)
-    character.add_spell_to_rotation(RimeSpell.ICE_COMET)
-    character.add_spell_to_rotation(RimeSpell.GLACIAL_BLAST)
-    character.add_spell_to_rotation(RimeSpell.FROST_BOLT)
-
     table.add_row(
         "Talent Tree",
         "\n".join(character.talents) if character.talents else "N/A",
@@ -133,215 +127,391 @@ def main(arguments: argparse.Namespace):
 
     # Sim Options - Uncomment one to run.
     match arguments.simulation_type:
-        case "average_dps":
-            average_dps(
-                table,
-                character,
-                arguments.duration,
-                arguments.run_count,
-                arguments.enemy_count,
-                arguments.experimental_feature,
-            )
-        case "stat_weights":
-            stat_weights(
-                table,
-                character,
-                arguments.duration,
-                arguments.run_count,
-                arguments.stat_weights_gain,
-                arguments.experimental_feature,
-                arguments.enemy_count,
-            )
+        case "average_dps" | "stat_weights":
+            config = make_config(arguments)
+            result = run_with_progress(config, **simulate_options(arguments))
+            save_outputs(result, arguments)
+            render_result(table, result, arguments.experimental_feature)
+            render_what_if(table, result, what_if)
         case "debug_sim":
             debug_sim(
                 character,
                 arguments.duration,
                 arguments.enemy_count,
+                read_apl(arguments.apl),
+                make_config(arguments).opener_spells(),
+                arguments.event_log,
+                make_config(arguments).fight_profile(),
             )
+        case "compare":
+            render_comparison(table, run_compare(arguments))
+        case "estimate":
+            config = replace(
+                make_config(arguments), simulation_type="average_dps"
+            )
+            config_estimate = estimate(config)
+            result = run_with_progress(config, **simulate_options(arguments))
+            save_outputs(result, arguments)
+            render_estimate(table, config_estimate, result)
 
     # Print the final results
     console.print("\n")
     console.print(table)
 
 
-def stat_weights(
-    table: Table,
+def print_plain(
+    arguments: argparse.Namespace,
     character: Character,
-    duration: int,
-    run_count: int,
-    stat_increase: int,
-    use_experimental: bool,
-    enemy_count: Optional[int] = None,
+    what_if: Dict[str, float],
 ) -> None:
-    """Calculates the stat weights of the character."""
-
-    target_count = 4 if enemy_count is None else enemy_count
-    character_base = character
-    base_dps = average_dps(
-        table,
-        character_base,
-        duration,
-        run_count,
-        target_count,
-        use_experimental=use_experimental,
-        stat_name="base",
-    )
-
-    def update_stats(
-        character: Character, stat_increase: int, stat_name: str
-    ) -> float:
-        character_updated = character
-        character_updated.update_stats(
-            intellect=(
-                character_updated.intellect_points + stat_increase
-                if stat_name == "intellect"
-                else character_updated.intellect_points
-            ),
-            crit=(
-                character_updated.crit_points + stat_increase
-                if stat_name == "crit"
-                else character_updated.crit_points
-            ),
-            expertise=(
-                character_updated.expertise_points + stat_increase
-                if stat_name == "expertise"
-                else character_updated.expertise_points
-            ),
-            haste=(
-                character_updated.haste_points + stat_increase
-                if stat_name == "haste"
-                else character_updated.haste_points
-            ),
-            spirit=(
-                character_updated.spirit_points + stat_increase
-                if stat_name == "spirit"
-                else character_updated.spirit_points
+    """Prints the results as plain text lines, without loading rich."""
+
+    match arguments.simulation_type:
+        case "average_dps" | "stat_weights":
+            result = simulate(
+                make_config(arguments), **simulate_options(arguments)
+            )
+            save_outputs(result, arguments)
+            is_stat_weights = bool(result.stat_weights)
+            for name, batch in result.batches.items():
+                suffix = f" ({name})" if is_stat_weights else ""
+                print(f"Average DPS{suffix}: {batch.average_dps:.2f}")
+                print(f"Lowest DPS{suffix}: {batch.lowest_dps:.2f}")
+                print(f"Highest DPS{suffix}: {batch.highest_dps:.2f}")
+            for stat, weight in result.stat_weights.items():
+                print(f"{stat.capitalize()}: {weight:.2f}")
+            if what_if:
+                print(f"What-if DPS: {result.base.what_if_dps(what_if):.2f}")
+        case "debug_sim":
+            debug_sim(
+                character,
+                arguments.duration,
+                arguments.enemy_count,
+                read_apl(arguments.apl),
+                make_config(arguments).opener_spells(),
+                arguments.event_log,
+                make_config(arguments).fight_profile(),
+            )
+        case "compare":
+            comparison = run_compare(arguments)
+            names = build_names(comparison.configs)
+            for name, batch in zip(names, comparison.batches):
+                print(f"Average DPS ({name}): {batch.average_dps:.2f}")
+            base_dps = comparison.batches[0].average_dps
+            for name, difference in zip(names[1:], comparison.differences):
+                print(
+                    f"{name.split(':')[0]} - A: {difference.mean:+.2f} DPS "
+                    + f"({difference.mean / base_dps:+.2%}), "
+                    + f"CI [{difference.low:+.2f}, {difference.high:+.2f}], "
+                    + f"{difference.verdict} after {difference.count} "
+                    + "iterations"
+                )
+        case "estimate":
+            config = replace(
+                make_config(arguments), simulation_type="average_dps"
+            )
+            config_estimate = estimate(config)
+            result = simulate(config, **simulate_options(arguments))
+            save_outputs(result, arguments)
+            error = config_estimate.errors(result)["base"]
+            print(f"Estimated DPS: {error['estimate']:.2f}")
+            print(f"Simulated DPS: {error['simulated']:.2f}")
+            print(
+                f"Estimate Error: {error['error']:+.2f} DPS "
+                + f"({error['relative_error']:+.2%})"
+            )
+
+
+def make_config(arguments: argparse.Namespace) -> SimulationConfig:
+    """Creates the simulation config of the command line arguments."""
+
+    return SimulationConfig(
+        simulation_type=arguments.simulation_type,
+        enemy_count=arguments.enemy_count,
+        talent_tree=arguments.talent_tree,
+        preset=arguments.preset,
+        custom_character=arguments.custom_character,
+        duration=arguments.duration,
+        run_count=arguments.run_count,
+        stat_weights_gain=arguments.stat_weights_gain,
+        timeline_bin=arguments.timeline_bin,
+        apl=read_apl(arguments.apl),
+        engine=arguments.engine,
+        opener=arguments.opener,
+        keep_iterations=bool(arguments.export),
+        trace_every=arguments.trace_every,
+        trace_extremes=arguments.trace_extremes,
+        fight=arguments.fight,
+        pooled=arguments.pooled,
+    )
+
+
+def save_outputs(result: Result, arguments: argparse.Namespace) -> None:
+    """Writes the per-iteration results and the event traces, if asked.
+
+    Traces default to a `<export>.traces` directory next to the export.
+    """
+
+    if arguments.export:
+        result.export(arguments.export)
+    if arguments.trace_every or arguments.trace_extremes:
+        directory = arguments.trace_dir or (
+            os.path.splitext(arguments.export)[0] + ".traces"
+            if arguments.export
+            else "traces"
+        )
+        result.save_traces(directory)
+
+
+def read_apl(path: str) -> str:
+    """Returns the text of the APL file, or an empty text."""
+
+    if not path:
+        return ""
+    with open(path, encoding="utf-8") as apl_file:
+        return apl_file.read()
+
+
+def parse_what_if(specs: Optional[Sequence[str]]) -> Dict[str, float]:
+    """Returns the damage percents of `<spell>=<damage_percent>` specs by
+    spell name, e.g. `frost_bolt=80`."""
+
+    names = {spell_key(name): name for name in damage_percents()}
+    changes = {}
+    for spec in specs or []:
+        key, separator, percent = spec.partition("=")
+        try:
+            if not separator:
+                raise ValueError
+            changes[names[key.strip()]] = float(percent)
+        except (KeyError, ValueError):
+            raise ValueError(
+                f"What-if `{spec}` must be `<spell>=<damage_percent>`, "
+                + "e.g. `frost_bolt=80`."
+            ) from None
+    return changes
+
+
+def simulate_options(arguments: argparse.Namespace) -> Dict[str, Any]:
+    """Returns the `simulate` options of the command line arguments."""
+
+    if arguments.resume and not arguments.checkpoint:
+        raise ValueError("--resume requires --checkpoint.")
+    return {
+        "backend": arguments.backend,
+        "workers": arguments.workers,
+        "checkpoint": arguments.checkpoint,
+        "resume": arguments.resume,
+        "checkpoint_interval": arguments.checkpoint_interval,
+    }
+
+
+def run_with_progress(config: SimulationConfig, **options: Any) -> Result:
+    """Runs the simulation config while showing a progress bar.
+
+    `options` are passed to `simulate`.
+    """
+
+    from rich.progress import (
+        Progress,
+        BarColumn,
+        TextColumn,
+        TimeElapsedColumn,
+        TimeRemainingColumn,
+        MofNCompleteColumn,
+    )
+
+    with Progress(
+        TextColumn(
+            "[bold]{task.description}[/bold] "
+            + "[progress.percentage]{task.percentage:>3.0f}%"
+        ),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TextColumn("•"),
+        TimeElapsedColumn(),
+        TextColumn("•"),
+        TimeRemainingColumn(),
+    ) as progress:
+        tasks = {
+            name: progress.add_task(
+                name if stat is not None else "Calculating DPS",
+                total=config.run_count,
+            )
+            for name, stat in config.scenarios()
+        }
+
+        return simulate(
+            config,
+            on_progress=lambda name, count: progress.update(
+                tasks[name], advance=count
             ),
+            **options,
         )
 
-        return average_dps(
-            table,
-            character_updated,
-            duration,
-            run_count,
-            target_count,
-            use_experimental=use_experimental,
-            stat_name=stat_name,
+
+def run_compare(arguments: argparse.Namespace) -> Comparison:
+    """Compares the build of the options to every `--variant` of it."""
+
+    config = replace(make_config(arguments), simulation_type="average_dps")
+    configs = [config]
+    for spec in arguments.variant or []:
+        options = parse_variant(spec)
+        if "apl" in options:
+            options["apl"] = read_apl(options["apl"])
+        configs.append(replace(config, **options))
+    return compare(configs, arguments.alpha, arguments.tolerance)
+
+
+def render_comparison(table: "Table", comparison: Comparison) -> None:
+    """Renders the builds and their differences into the table."""
+
+    names = build_names(comparison.configs)
+    for index, (name, batch) in enumerate(zip(names, comparison.batches)):
+        table.add_row(
+            f"Average DPS ({name})",
+            f"[bold magenta]{batch.average_dps:.2f}",
+            end_section=index == len(names) - 1,
         )
 
-    int_dps = update_stats(character, stat_increase, "intellect")
-    crit_dps = update_stats(character, stat_increase, "crit")
-    expertise_dps = update_stats(character, stat_increase, "expertise")
-    haste_dps = update_stats(character, stat_increase, "haste")
-    spirit_dps = update_stats(character, stat_increase, "spirit")
+    base_dps = comparison.batches[0].average_dps
+    for name, difference in zip(names[1:], comparison.differences):
+        table.add_row(
+            f"{name.split(':')[0]} - A",
+            f"[bold magenta]{difference.mean:+.2f} DPS "
+            + f"({difference.mean / base_dps:+.2%})\n"
+            + f"[white]CI [{difference.low:+.2f}, {difference.high:+.2f}]\n"
+            + f"{difference.verdict} after {difference.count} iterations",
+            end_section=True,
+        )
 
-    table.add_row("\n[white]Stat Weights", "\n[white]-------------")
-    table.add_row(
-        "Intellect", f"[magenta]{1 + ((int_dps - base_dps) / base_dps):.2f}"
-    )
+
+def render_estimate(
+    table: "Table", config_estimate: Estimate, result: Result
+) -> None:
+    """Renders the estimate and its error against the full simulation."""
+
+    error = config_estimate.errors(result)["base"]
     table.add_row(
-        "Crit", f"[magenta]{1 + ((crit_dps - base_dps) / base_dps):.2f}"
+        "Estimated DPS",
+        f"[bold magenta]{error['estimate']:.2f}\n"
+        + f"[white]in {config_estimate.seconds * 1000:.1f} ms",
     )
     table.add_row(
-        "Expertise",
-        f"[magenta]{1 + ((expertise_dps - base_dps) / base_dps):.2f}",
+        "Simulated DPS",
+        f"[bold magenta]{error['simulated']:.2f}\n"
+        + f"[white]over {result.base.run_count} iterations",
     )
     table.add_row(
-        "Haste", f"[magenta]{1 + ((haste_dps - base_dps) / base_dps):.2f}"
+        "Estimate Error",
+        f"[bold magenta]{error['error']:+.2f} DPS "
+        + f"({error['relative_error']:+.2%})",
+        end_section=True,
     )
+
+
+def render_result(table: "Table", result: Result, use_experimental: bool):
+    """Renders a simulation result into the table."""
+
+    is_stat_weights = bool(result.stat_weights)
+    for name, batch in result.batches.items():
+        render_batch(
+            table,
+            batch,
+            stat_name=name if is_stat_weights else None,
+            use_experimental=use_experimental and not is_stat_weights,
+        )
+
+    if is_stat_weights:
+        table.add_row("\n[white]Stat Weights", "\n[white]-------------")
+        for stat, weight in result.stat_weights.items():
+            table.add_row(stat.capitalize(), f"[magenta]{weight:.2f}")
+
+
+def render_what_if(
+    table: "Table", result: Result, changes: Dict[str, float]
+) -> None:
+    """Renders the base DPS with other damage percents into the table."""
+
+    if not changes:
+        return
     table.add_row(
-        "Spirit", f"[magenta]{1 + ((spirit_dps - base_dps) / base_dps):.2f}"
+        "What-if DPS",
+        f"[bold magenta]{result.base.what_if_dps(changes):.2f}\n"
+        + "[white]"
+        + ", ".join(
+            f"{name} {percent:g}%" for name, percent in changes.items()
+        ),
+        end_section=True,
     )
 
 
-def debug_sim(character: Character, duration: int, enemy_count: int) -> None:
+def debug_sim(
+    character: Character,
+    duration: int,
+    enemy_count: int,
+    apl: str = "",
+    opener: Sequence[str] = (),
+    event_log: str = "",
+    fight: Optional[FightProfile] = None,
+) -> None:
     """Runs a debug simulation.
     Creates a deterministic simulation with 0 crit and spirit.
+
+    With `event_log`, the events are saved to that file instead of printed.
     """
 
+    recorder = EventRecorder() if event_log else None
     sim = Simulation(
         character,
         duration=duration,
         enemy_count=enemy_count,
-        do_debug=True,
+        do_debug=not event_log,
         is_deterministic=False,
+        apl=compile_apl(apl) if apl else None,
+        opener=opener,
+        recorder=recorder,
+        fight=fight,
     )
     sim.run()
+    if recorder is not None:
+        recorder.save(event_log)
 
 
-def average_dps(
-    table: Table,
-    character: Character,
-    duration: int,
-    run_count: int,
-    enemy_count: int,
-    use_experimental: bool,
+def render_batch(
+    table: "Table",
+    batch: BatchResult,
     stat_name: Optional[str] = None,
-) -> float:
-    """Runs a simulation and returns the average DPS."""
-
-    with Progress(
-        TextColumn(
-            f"[bold]{stat_name if stat_name else 'Calculating DPS'}[/bold] "
-            + "[progress.percentage]{task.percentage:>3.0f}%"
-        ),
-        BarColumn(),
-        MofNCompleteColumn(),
-        TextColumn("•"),
-        TimeElapsedColumn(),
-        TextColumn("•"),
-        TimeRemainingColumn(),
-    ) as progress:
-        dps_running_total = 0
-        dps_lowest = float("inf")
-        dps_highest = float("-inf")
-
-        task = progress.add_task(f"{stat_name}", total=run_count)
-
-        for _ in range(run_count):
-            character_copy = deepcopy(character)
-            sim = Simulation(
-                character_copy,
-                duration=duration,
-                enemy_count=enemy_count,
-                do_debug=False,
-                is_deterministic=False,
-            )
-            dps = sim.run()
-
-            progress.update(task, advance=1)
-
-            dps_lowest = min(dps, dps_lowest)
-            dps_highest = max(dps, dps_highest)
-
-            dps_running_total += dps
-        avg_dps = dps_running_total / run_count
+    use_experimental: bool = False,
+) -> None:
+    """Renders the DPS of a batch into the table."""
 
     table.add_row(
         "Average DPS" if not stat_name else f"Average DPS ({stat_name})",
-        f"[bold magenta]{avg_dps:.2f}",
+        f"[bold magenta]{batch.average_dps:.2f}",
     )
     table.add_row(
         "Lowest DPS" if not stat_name else f"Lowest DPS ({stat_name})",
-        f"[bold magenta]{dps_lowest:.2f}",
+        f"[bold magenta]{batch.lowest_dps:.2f}",
     )
     table.add_row(
         "Highest DPS" if not stat_name else f"Highest DPS ({stat_name})",
-        f"[bold magenta]{dps_highest:.2f}",
+        f"[bold magenta]{batch.highest_dps:.2f}",
         end_section=True,
     )
 
     # Experimental: Damage Table
     # ---------------------------
-    if not stat_name and use_experimental:
-        damage_sum = sum(damage for _, damage in sim.damage_table.items())
+    if use_experimental:
+        damage_table = batch.damage_table
+        damage_sum = sum(damage for _, damage in damage_table.items())
 
-        # Sort sim.damage_table by damage dealt from highest to lowest.
+        # Sort damage_table by damage dealt from highest to lowest.
         # Remove rows with 0 values
         sorted_damage_table = {
             k: v
             for k, v in sorted(
-                sim.damage_table.items(),
+                damage_table.items(),
                 key=lambda item: item[1],
                 reverse=True,
             )
@@ -364,7 +534,21 @@ def average_dps(
 
             table.add_row(spell_name, damage)
 
-    return avg_dps
+    # DPS over time, mean with the 10th and 90th percentile band.
+    # ---------------------------
+    if batch.timeline is not None:
+        table.add_row(
+            "[bold]Timeline", "[bold]Mean DPS (p10 - p90) • Top Spell"
+        )
+        for row in batch.timeline.summary(percentiles=(10, 90)):
+            top_spell = max(row["spells"].items(), key=lambda item: item[1])
+            table.add_row(
+                f"{row['start']:.0f}s - {row['end']:.0f}s",
+                f"[magenta]{row['mean_dps']:.2f} "
+                + f"({row['percentiles'][10]:.0f} - "
+                + f"{row['percentiles'][90]:.0f})"
+                + (f" • {top_spell[0]}" if top_spell[1] > 0 else ""),
+            )
 
 
 if __name__ == "__main__":
@@ -377,7 +561,13 @@ if __name__ == "__main__":
         type=str,
         default="average_dps",
         help="Type of simulation to run.",
-        choices=["average_dps", "stat_weights", "debug_sim"],
+        choices=[
+            "average_dps",
+            "stat_weights",
+            "debug_sim",
+            "compare",
+            "estimate",
+        ],
         required=True,
     )
     parser.add_argument(
@@ -388,6 +578,14 @@ if __name__ == "__main__":
         help="Number of enemies to simulate.",
         required=True,
     )
+    parser.add_argument(
+        "--fight",
+        type=str,
+        default="",
+        help="Fight profile, the target count over time as "
+        + "`<start>:<targets>` phases, e.g. `0:1,30:5,45:1,90:0`. 0 targets "
+        + "is downtime. Replaces `-e`.",
+    )
     parser.add_argument(
         "-t",
         "--talent-tree",
@@ -440,6 +638,159 @@ if __name__ == "__main__":
         action="store_true",
         help="Enable experimental features such as the damage table.",
     )
+    parser.add_argument(
+        "-b",
+        "--timeline-bin",
+        type=float,
+        default=0,
+        help="Width of the DPS timeline bins in seconds (average_dps only). "
+        + "Disabled by default.",
+    )
+    parser.add_argument(
+        "-a",
+        "--apl",
+        type=str,
+        default="",
+        help="Action priority list file replacing the default rotation. "
+        + "See `characters/Rime/default.apl`.",
+    )
+    parser.add_argument(
+        "--opener",
+        type=str,
+        default="",
+        help="Comma separated spells cast in order before the rotation, "
+        + "e.g. `wrath_of_winter,ice_blitz,cold_snap`.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="specialized",
+        help="Simulation engine. `specialized` generates a faster "
+        + "simulation for the build, `generic` runs the reference engine.",
+        choices=["specialized", "generic"],
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="serial",
+        help="How to run the iterations. `threads` and `processes` run "
+        + "chunks of them in parallel, threads only scale on free-threaded "
+        + "Python builds.",
+        choices=["serial", "threads", "processes"],
+    )
+    parser.add_argument(
+        "--pooled",
+        action="store_true",
+        help="Reuse one simulation for all iterations of a batch instead of "
+        + "copying the character for each, and pause the garbage collector "
+        + "while it runs. Same results.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of threads or processes of the parallel backends. "
+        + "Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="Save the progress to this file, see `--resume`.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the run saved in the `--checkpoint` file, with the "
+        + "same options and the same kind of backend. The result is the "
+        + "same as the one of an uninterrupted run.",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=60,
+        help="Seconds between checkpoint saves.",
+    )
+    parser.add_argument(
+        "--variant",
+        type=str,
+        action="append",
+        help="With `compare`, a build compared to the one of the other "
+        + "options, e.g. `talent_tree=3-13-2;opener=ice_blitz`. Can be "
+        + "repeated. `-r` is the maximum number of iterations.",
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.05,
+        help="With `compare`, the error probability of the verdicts.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.001,
+        help="With `compare`, DPS differences below this fraction of the "
+        + "first build are negligible.",
+    )
+    parser.add_argument(
+        "--what-if",
+        type=str,
+        action="append",
+        help="Also show the DPS if a spell had another damage percent, "
+        + "e.g. `frost_bolt=80`, derived from the damage of the run without "
+        + "simulating again. Can be repeated.",
+    )
+    parser.add_argument(
+        "--event-log",
+        type=str,
+        default="",
+        help="Save the events of `debug_sim` to this binary log instead of "
+        + "printing them. Read it with `python events.py <file>`.",
+    )
+    parser.add_argument(
+        "--export",
+        type=str,
+        default="",
+        help="Write the DPS, damage, spell damage and procs of every "
+        + "iteration to this `.npz` file.",
+    )
+    parser.add_argument(
+        "--trace-every",
+        type=int,
+        default=0,
+        help="Record the combat events of every N-th iteration, e.g. 1000. "
+        + "Other iterations keep their full speed.",
+    )
+    parser.add_argument(
+        "--trace-extremes",
+        action="store_true",
+        help="Record the combat events of the lowest and highest DPS "
+        + "iterations.",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        type=str,
+        default="",
+        help="Directory of the traces. Defaults to `<export>.traces` next "
+        + "to the `--export` file, or `traces`.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="table",
+        help="Output format. `json` prints machine-readable results and "
+        + "never loads rich.",
+        choices=["table", "json"],
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Print the results as plain text, without the progress bar "
+        + "and without loading rich.",
+    )
 
     # Parse arguments.
     args = parser.parse_args()
@@ -0,0 +1,97 @@
+"""Module for decoupled, throttled progress reporting.
+
+The simulation loop only increments a counter slot, which costs a single
+integer add. A reporter thread reads the counters on a timer and forwards
+the deltas to a callback (e.g. a progress bar), so rendering never runs on
+the thread doing the simulation and is rate limited to the timer interval.
+"""
+
+import threading
+from array import array
+from typing import Callable, List, Optional
+
+
+class ProgressCounter:
+    """Counters of finished iterations, one slot per writer.
+
+    Every slot has a single writer (a batch, or a worker process), so no
+    locking is needed. With `shared=True` the slots live in shared memory
+    and can be written by other processes.
+    """
+
+    def __init__(self, slots: int = 1, shared: bool = False):
+        if shared:
+            # Imported lazily, it is only needed by multi-process runs.
+            from multiprocessing.sharedctypes import RawArray
+
+            self.values = RawArray("q", slots)
+        else:
+            self.values = array("q", bytes(8 * slots))
+
+    def add(self, count: int = 1, slot: int = 0) -> None:
+        """Adds finished iterations to the slot."""
+
+        self.values[slot] += count
+
+    def snapshot(self) -> List[int]:
+        """Returns the current value of every slot."""
+
+        return list(self.values)
+
+
+class ProgressReporter:
+    """Polls a counter on a timer and reports the deltas of every slot.
+
+    `callback` is called with the slot and the number of iterations finished
+    since the last report, from the reporter thread. A final report is made
+    when the reporter stops, so the reported totals always add up.
+    """
+
+    def __init__(
+        self,
+        counter: ProgressCounter,
+        callback: Callable[[int, int], None],
+        interval: float = 0.1,
+    ):
+        self.counter = counter
+        self.callback = callback
+        self.interval = interval
+        self._reported = counter.snapshot()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _report(self) -> None:
+        """Reports the deltas since the last report."""
+
+        for slot, value in enumerate(self.counter.snapshot()):
+            delta = value - self._reported[slot]
+            if delta:
+                self._reported[slot] = value
+                self.callback(slot, delta)
+
+    def _poll(self) -> None:
+        """Reporter thread loop."""
+
+        while not self._stop.wait(self.interval):
+            self._report()
+
+    def start(self) -> None:
+        """Starts the reporter thread."""
+
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the reporter thread and makes the final report."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._report()
+
+    def __enter__(self) -> "ProgressReporter":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,79 @@
+"""Module for the damage scaling of intellect, expertise and spells.
+
+Every hit deals `damage_percent * intellect * (1 + expertise / 100)` times
+multipliers (buffs, crits, damage rolls, targets) that depend on neither
+stat, and no decision of the rotation depends on damage. The damage of an
+iteration is thus, for every spell, its damage percent times the damage
+scale of the character times a factor of the rolls of the iteration. The
+damage table of a batch, and of every iteration in its sink, records that
+decomposition, so the DPS with more intellect or expertise, or with other
+damage percents, follows from the base run exactly, without simulating
+again.
+"""
+
+import functools
+import math
+from typing import Dict, Mapping
+
+from base import Character
+from characters.Rime import SPELLBOOK
+
+# Stats that only scale the damage of every hit.
+LINEAR_STATS = ("intellect", "expertise")
+
+
+def damage_scale(character: Character) -> float:
+    """Returns the factor of the character stats in every hit, see
+    `Spell.damage`."""
+
+    return character.intellect * (1 + character.expertise / 100)
+
+
+def linear_weight(base: Character, increased: Character) -> float:
+    """Returns the DPS of `increased` relative to `base`, two characters
+    differing only in LINEAR_STATS."""
+
+    return damage_scale(increased) / damage_scale(base)
+
+
+@functools.lru_cache(maxsize=None)
+def damage_percents() -> Dict[str, float]:
+    """Returns the damage percent of every spell name of the spellbook.
+
+    Buffs dealing the damage of a spell (e.g. the Glacial Assault blast)
+    share its name, and scale with it.
+    """
+
+    percents: Dict[str, float] = {}
+    for key in SPELLBOOK.keys:
+        percents.setdefault(
+            SPELLBOOK.names[SPELLBOOK.index[key]],
+            SPELLBOOK.row(key)["damage_percent"],
+        )
+    return percents
+
+
+def what_if_dps(
+    dps: float,
+    damage_table: Mapping[str, float],
+    changes: Mapping[str, float],
+) -> float:
+    """Returns the DPS of a run with the damage table `damage_table` if the
+    spells of `changes` had the given damage percents.
+
+    Raises ValueError for unknown spells or spells dealing no damage.
+    """
+
+    percents = damage_percents()
+    for name in changes:
+        if not percents.get(name):
+            raise ValueError(f"Spell `{name}` is unknown or deals no damage.")
+
+    total = sum(damage_table.values())
+    if not total:
+        return dps
+    change = math.fsum(
+        (percent / percents[name] - 1) * damage_table.get(name, 0)
+        for name, percent in changes.items()
+    )
+    return dps * (1 + change / total)
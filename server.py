@@ -0,0 +1,416 @@
+"""Local HTTP simulation service with a warm worker pool.
+
+Jobs are posted as JSON with the same options as the CLI and are split into
+the chunks of the parallel backends of `api.simulate`, which run on a
+persistent process pool, so seeded jobs give the same results as them. The
+workers import the engine once at startup, so a request pays neither
+interpreter startup nor imports.
+
+Endpoints:
+- `POST /jobs`: Submit a job, returns its id. Identical in-flight jobs are
+  merged and share the id.
+- `GET /jobs/<id>`: Current status and, once done, the result.
+- `GET /jobs/<id>/events`: Streams progress as newline delimited JSON until
+  the job is finished.
+- `DELETE /jobs/<id>`: Cancels the job once every submitter cancelled it.
+
+Finished jobs are dropped after `JOB_TTL` seconds, or once
+`MAX_FINISHED_JOBS` newer jobs finished.
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import random
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from api import (
+    BatchResult,
+    Result,
+    SimulationConfig,
+    config_chunks,
+    run_chunk,
+)
+
+
+# Seconds a finished job and its result stay available.
+JOB_TTL = 3600.0
+# Finished jobs kept at most, the oldest are dropped first.
+MAX_FINISHED_JOBS = 1000
+
+
+def job_key(config: SimulationConfig) -> str:
+    """Returns the key used to merge identical jobs."""
+
+    encoded = json.dumps(config.to_dict(), sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _warm_worker() -> None:
+    """Pool initializer, builds the default character once per worker."""
+
+    SimulationConfig().character()
+
+
+class Job:
+    """A simulation job and its partial results."""
+
+    def __init__(self, key: str, config: SimulationConfig):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.config = config
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.submitters = 1
+        self.total = config.run_count * len(config.scenarios())
+        self.completed = 0
+        # The same chunks as the parallel backends of `api.simulate`.
+        self.chunks = config_chunks(config)
+        self.partials: Dict[int, BatchResult] = {}
+        self.batches: Dict[str, BatchResult] = {}
+        self.futures: List[asyncio.Future] = []
+        self.changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        """Returns True if the job will not make any further progress."""
+
+        return self.status in ("done", "failed", "cancelled")
+
+    def notify(self) -> None:
+        """Wakes up every progress stream of the job."""
+
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def add_partial(self, index: int, partial: BatchResult) -> None:
+        """Stores the result of a finished chunk."""
+
+        self.partials[index] = partial
+        self.completed += partial.run_count
+        self.notify()
+
+    def merge(self) -> None:
+        """Merges the chunk results in chunk order, so the sums do not
+        depend on the scheduling."""
+
+        for index, (name, _, _) in enumerate(self.chunks):
+            partial = self.partials[index]
+            if name in self.batches:
+                self.batches[name].merge(partial)
+            else:
+                self.batches[name] = partial
+
+    def progress(self) -> Dict[str, Any]:
+        """Returns the progress of the job."""
+
+        return {
+            "id": self.id,
+            "status": self.status,
+            "completed": self.completed,
+            "total": self.total,
+        }
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """Returns the final result once the job is done."""
+
+        if self.status != "done":
+            return None
+        return Result(self.config, self.batches).to_dict()
+
+
+class SimulationService:
+    """Schedules jobs onto the worker pool and serves them over HTTP."""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        job_ttl: float = JOB_TTL,
+        max_finished_jobs: int = MAX_FINISHED_JOBS,
+    ):
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_warm_worker
+        )
+        # Starts the workers now: forked while serving, they would inherit
+        # the open connections and keep clients from seeing them close.
+        self.executor.submit(_warm_worker)
+        self.jobs: Dict[str, Job] = {}
+        self.in_flight: Dict[str, Job] = {}
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        # Ids of the finished jobs, oldest first.
+        self.finished: Deque[str] = deque()
+
+    def submit(self, options: Dict[str, Any]) -> Tuple[Job, bool]:
+        """Submits a job, merging it with an identical in-flight job."""
+
+        config = SimulationConfig.from_dict(options)
+        config.validate()
+        if (
+            config.keep_iterations
+            or config.trace_every
+            or config.trace_extremes
+        ):
+            raise ValueError("Service jobs keep no iterations or traces.")
+        key = job_key(config)
+
+        job = self.in_flight.get(key)
+        if job is not None:
+            job.submitters += 1
+            return job, True
+
+        job = Job(key, config)
+        self.jobs[job.id] = job
+        self.in_flight[key] = job
+        asyncio.get_running_loop().create_task(self._run(job))
+        return job, False
+
+    def cancel(self, job: Job) -> None:
+        """Drops one submitter, cancels the job when none are left."""
+
+        if job.finished:
+            return
+        job.submitters -= 1
+        if job.submitters > 0:
+            return
+
+        job.status = "cancelled"
+        for future in job.futures:
+            future.cancel()
+        self.in_flight.pop(job.key, None)
+        job.notify()
+
+    @staticmethod
+    def _chunk_done(job: Job, index: int, future: asyncio.Future) -> None:
+        """Stores a finished chunk in its job."""
+
+        if job.finished or future.cancelled() or future.exception():
+            return
+        job.add_partial(index, future.result())
+
+    async def _run(self, job: Job) -> None:
+        """Runs all chunks of a job on the pool."""
+
+        loop = asyncio.get_running_loop()
+        config = job.config
+        seed = (
+            config.seed if config.seed is not None else random.randrange(2**32)
+        )
+
+        for index, (_, stat, start) in enumerate(job.chunks):
+            future = loop.run_in_executor(
+                self.executor, run_chunk, config, stat, start, seed, 0
+            )
+            future.add_done_callback(
+                functools.partial(self._chunk_done, job, index)
+            )
+            job.futures.append(future)
+
+        job.status = "running"
+        job.notify()
+
+        try:
+            await asyncio.gather(*job.futures)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            job.status = "failed"
+            job.error = str(e)
+            for future in job.futures:
+                future.cancel()
+        else:
+            if not job.finished:
+                job.merge()
+                job.status = "done"
+        finally:
+            # A cancelled job may have been replaced by an identical one.
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+            job.notify()
+            self._evict_later(job)
+
+    def _evict_later(self, job: Job) -> None:
+        """Drops the finished job after the TTL, or once too many newer
+        jobs finished."""
+
+        self.finished.append(job.id)
+        while len(self.finished) > self.max_finished_jobs:
+            self.jobs.pop(self.finished.popleft(), None)
+        asyncio.get_running_loop().call_later(
+            self.job_ttl, self.jobs.pop, job.id, None
+        )
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Handles a single HTTP request."""
+
+        try:
+            request_line = (await reader.readline()).decode().split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1]
+
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                length = int(headers.get("content-length", 0))
+                if length < 0:
+                    raise ValueError
+            except ValueError:
+                await self._respond(
+                    writer, 400, {"error": "Invalid Content-Length."}
+                )
+                return
+            body = await reader.readexactly(length) if length else b""
+            await self._route(method, path.rstrip("/"), body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(
+        self,
+        method: str,
+        path: str,
+        body: bytes,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """Dispatches a request to its endpoint."""
+
+        parts = path.strip("/").split("/")
+
+        if method == "POST" and parts == ["jobs"]:
+            try:
+                job, merged = self.submit(json.loads(body or b"{}"))
+            except (ValueError, KeyError, TypeError) as e:
+                await self._respond(writer, 400, {"error": str(e)})
+                return
+            await self._respond(
+                writer, 202, {**job.progress(), "merged": merged}
+            )
+            return
+
+        job = self.jobs.get(parts[1]) if len(parts) >= 2 else None
+        if parts[0] != "jobs" or job is None:
+            await self._respond(writer, 404, {"error": "Job not found."})
+        elif method == "GET" and len(parts) == 2:
+            await self._respond(
+                writer,
+                200,
+                {**job.progress(), "error": job.error, "result": job.result()},
+            )
+        elif method == "GET" and parts[2:] == ["events"]:
+            await self._stream(writer, job)
+        elif method == "DELETE" and len(parts) == 2:
+            self.cancel(job)
+            await self._respond(writer, 200, job.progress())
+        else:
+            await self._respond(writer, 405, {"error": "Not allowed."})
+
+    async def _respond(
+        self, writer: asyncio.StreamWriter, status: int, payload: Dict
+    ) -> None:
+        """Writes a JSON response."""
+
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n".encode()
+            + b"Content-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+
+    async def _stream(self, writer: asyncio.StreamWriter, job: Job) -> None:
+        """Streams the job progress until it is finished."""
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            + b"Content-Type: application/x-ndjson\r\n"
+            + b"Connection: close\r\n\r\n"
+        )
+        while True:
+            changed = job.changed
+            writer.write(json.dumps(job.progress()).encode() + b"\n")
+            await writer.drain()
+            if job.finished:
+                break
+            await changed.wait()
+
+    def close(self) -> None:
+        """Shuts down the worker pool."""
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+}
+
+
+async def serve(
+    host: str, port: int, workers: Optional[int], job_ttl: float = JOB_TTL
+) -> None:
+    """Runs the simulation service until interrupted."""
+
+    service = SimulationService(workers, job_ttl)
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Serving simulations on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    # Create parser for command line arguments.
+    parser = argparse.ArgumentParser(description="Serve Rime simulations.")
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to listen on. Only localhost by default.",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port to listen on."
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes.",
+    )
+    parser.add_argument(
+        "--job-ttl",
+        type=float,
+        default=JOB_TTL,
+        help="Seconds a finished job and its result stay available.",
+    )
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.job_ttl))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,246 @@
+"""Module for per-iteration result storage with a fixed layout.
+
+A sink is a table of doubles with one row per iteration, stored column by
+column: the DPS, the total damage, the damage of every spell and the count
+of every proc, with spell and proc ids given by their position. With
+`shared=True` the table lives in `multiprocessing.shared_memory`, worker
+processes attach to it by name and write their rows in place, so nothing
+proportional to the run count is pickled. Statistics are computed from
+zero-copy column views, `numpy()` returns them as NumPy arrays when NumPy
+is installed, and `export` writes the columns to a `.npz` file.
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from characters.Rime import RimeSpell
+from columns import write_npz
+from Sim import PROCS
+
+if TYPE_CHECKING:
+    from Sim import Simulation
+
+# Columns before the spell damage columns.
+DPS, TOTAL_DAMAGE = 0, 1
+
+
+def default_spell_names() -> List[str]:
+    """Returns the spell ids of the default layout, the Rime spell names."""
+
+    return list(dict.fromkeys(spell.value.name for spell in RimeSpell))
+
+
+class ResultSink:
+    """Per-iteration DPS and spell damage of a scenario."""
+
+    def __init__(
+        self,
+        rows: int,
+        spell_names: Optional[Sequence[str]] = None,
+        shared: bool = False,
+        name: Optional[str] = None,
+    ):
+        self.rows = rows
+        self.spell_names: List[str] = list(
+            spell_names if spell_names is not None else default_spell_names()
+        )
+        self.columns: List[str] = (
+            ["dps", "total_damage"]
+            + [f"damage/{spell}" for spell in self.spell_names]
+            + [f"procs/{proc}" for proc in PROCS]
+        )
+        # Column of every spell and proc.
+        self.spell_index: Dict[str, int] = {
+            spell: 2 + index for index, spell in enumerate(self.spell_names)
+        }
+        self.proc_index: Dict[str, int] = {
+            proc: 2 + len(self.spell_names) + index
+            for index, proc in enumerate(PROCS)
+        }
+        size = 8 * max(rows * len(self.columns), 1)
+
+        self._memory = None
+        if shared or name is not None:
+            # Imported lazily, it is only needed by multi-process runs.
+            from multiprocessing import shared_memory
+
+            # Pool workers share the resource tracker of their parent, so
+            # only the creator has to unlink the block.
+            self._memory = shared_memory.SharedMemory(
+                name=name, create=name is None, size=size
+            )
+            buffer = self._memory.buf
+        else:
+            buffer = bytearray(size)
+        self._view = memoryview(buffer).cast("d")
+
+    @property
+    def name(self) -> Optional[str]:
+        """Name of the shared memory block, None if not shared."""
+
+        return self._memory.name if self._memory is not None else None
+
+    @classmethod
+    def attach(
+        cls, name: str, rows: int, spell_names: Sequence[str]
+    ) -> "ResultSink":
+        """Attaches to the shared sink of another process."""
+
+        return cls(rows, spell_names, name=name)
+
+    def layout(self) -> Tuple[str, int, List[str]]:
+        """Returns the `attach` arguments of a shared sink."""
+
+        if self.name is None:
+            raise ValueError("Only shared sinks can be attached to.")
+        return self.name, self.rows, self.spell_names
+
+    def write(self, row: int, sim: "Simulation", dps: float) -> None:
+        """Writes the results of a finished iteration into its row."""
+
+        view = self._view
+        rows = self.rows
+        view[DPS * rows + row] = dps
+        view[TOTAL_DAMAGE * rows + row] = sim.total_damage
+        for spell, damage in sim.damage_table.items():
+            column = self.spell_index.get(spell)
+            if column is not None:
+                view[column * rows + row] = damage
+        for proc, count in sim.proc_counts.items():
+            column = self.proc_index.get(proc)
+            if column is not None:
+                view[column * rows + row] = count
+
+    def column(self, name: str) -> memoryview:
+        """Returns a zero-copy view of a column, see `columns`."""
+
+        index = self.columns.index(name)
+        return self._view[index * self.rows : (index + 1) * self.rows]
+
+    def dps(self) -> memoryview:
+        """Returns a zero-copy view of the DPS of every iteration."""
+
+        return self.column("dps")
+
+    def statistics(
+        self, percentiles: Sequence[float] = (10, 50, 90)
+    ) -> Dict:
+        """Returns the mean, standard deviation, extremes and percentiles of
+        the DPS."""
+
+        values = sorted(self.dps())
+        count = len(values)
+        if not count:
+            return {"count": 0}
+
+        mean = math.fsum(values) / count
+        variance = (
+            math.fsum((value - mean) ** 2 for value in values) / (count - 1)
+            if count > 1
+            else 0.0
+        )
+        return {
+            "count": count,
+            "mean": mean,
+            "stdev": math.sqrt(variance),
+            "min": values[0],
+            "max": values[-1],
+            "percentiles": {
+                p: values[min(int(p / 100 * count), count - 1)]
+                for p in percentiles
+            },
+        }
+
+    def histogram(self, bins: int = 20) -> Dict[str, List[float]]:
+        """Returns the DPS histogram with `bins` equal-width bins."""
+
+        values = self.dps()
+        if not len(values):
+            return {"edges": [], "counts": []}
+
+        low, high = min(values), max(values)
+        width = (high - low) / bins or 1.0
+        counts = [0] * bins
+        for value in values:
+            counts[min(int((value - low) / width), bins - 1)] += 1
+        return {
+            "edges": [low + width * i for i in range(bins + 1)],
+            "counts": counts,
+        }
+
+    def damage_table(self) -> Dict[str, float]:
+        """Returns the mean damage per iteration of every spell."""
+
+        runs = max(self.rows, 1)
+        return {
+            spell: math.fsum(self.column(f"damage/{spell}")) / runs
+            for spell in self.spell_names
+        }
+
+    def numpy(self):
+        """Returns zero-copy NumPy views of the DPS and the damage matrix,
+        one row per spell.
+
+        The views must be released before the sink is closed.
+        """
+
+        # Imported lazily, NumPy is optional.
+        import numpy
+
+        table = numpy.frombuffer(
+            self._view.obj,
+            dtype=numpy.float64,
+            count=self.rows * len(self.columns),
+        ).reshape(len(self.columns), self.rows)
+        return table[DPS], table[2 : 2 + len(self.spell_names)]
+
+    def views(self, prefix: str = "") -> Dict[str, memoryview]:
+        """Returns zero-copy views of every column, by prefixed name."""
+
+        return {prefix + name: self.column(name) for name in self.columns}
+
+    def export(self, path: str) -> None:
+        """Writes every column to a `.npz` file, see `columns`."""
+
+        write_npz(path, self.views())
+
+    def unlink(self) -> None:
+        """Removes the name of the shared memory block.
+
+        The data stays readable in this process until the sink is closed.
+        """
+
+        if self._memory is not None:
+            self._memory.unlink()
+
+    def close(self) -> None:
+        """Releases the table."""
+
+        self._view.release()
+        if self._memory is not None:
+            self._memory.close()
+            self._memory = None
+
+    def __getstate__(self) -> Dict:
+        # Pickled as a private copy, e.g. inside a result of a worker.
+        return {
+            "rows": self.rows,
+            "spell_names": self.spell_names,
+            "data": self._view.tobytes(),
+        }
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(state["rows"], state["spell_names"])
+        self._view[:] = memoryview(state["data"]).cast("d")
+
+    def __del__(self) -> None:
+        # The view must be released before the shared block can be closed.
+        if hasattr(self, "_view"):
+            self.close()
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
@@ -0,0 +1,89 @@
+"""Module for snapshots of a running simulation.
+
+A snapshot holds the state of a fight between two casts as plain data, so
+it can be serialized and restored into a new simulation of the same
+character. Every iteration of a batch replays the same opening until the
+first random roll, `deterministic_prefix` simulates it once and the batch
+forks all iterations from the returned snapshot.
+"""
+
+import random
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from Sim import Simulation
+
+
+@dataclass
+class SimulationState:
+    """State of a fight between two casts."""
+
+    time: float
+    gcd: float
+    total_damage: float
+    mana: float
+    winter_orbs: int
+    haste: float
+    # (remaining cooldown, remaining duration, next tick time) of every
+    # spell, in the order of `Simulation._state_spells`.
+    spells: List[Tuple[float, float, float]]
+    # Active buffs and debuffs, as indices into `spells`.
+    buffs: List[int]
+    debuffs: List[int]
+    damage_table: Dict[str, float]
+    proc_counts: Dict[str, int]
+    opener_index: int = 0
+    # Non-zero (cell, damage) pairs of the running timeline iteration.
+    timeline: List[Tuple[int, float]] = field(default_factory=list)
+    rng_state: Optional[tuple] = None
+
+    def to_dict(self) -> Dict:
+        """Returns the state as plain, JSON serializable data."""
+
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SimulationState":
+        """Creates a state from `to_dict` data, e.g. loaded from JSON."""
+
+        data = dict(data)
+        data["spells"] = [tuple(spell) for spell in data["spells"]]
+        data["timeline"] = [tuple(cell) for cell in data.get("timeline", [])]
+        if data.get("rng_state") is not None:
+            version, internal, gauss = data["rng_state"]
+            data["rng_state"] = (version, tuple(internal), gauss)
+        return cls(**data)
+
+
+class RandomUsed(Exception):
+    """Raised by `_ProbeRandom` when the fight draws a random number."""
+
+
+class _ProbeRandom(random.Random):
+    """Generator that raises instead of returning a number."""
+
+    def random(self) -> float:
+        raise RandomUsed()
+
+    def uniform(self, a: float, b: float) -> float:
+        raise RandomUsed()
+
+
+def deterministic_prefix(sim: "Simulation") -> SimulationState:
+    """Simulates the fight until its first random roll.
+
+    Returns the snapshot taken before the cast that rolls. The simulation
+    is left in an undefined state and must be discarded.
+    """
+
+    sim.rng = _ProbeRandom(0)
+    sim.start()
+    state = sim.snapshot()
+    try:
+        while sim.time < sim.duration:
+            sim.step()
+            state = sim.snapshot()
+    except RandomUsed:
+        pass
+    return state